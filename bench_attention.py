@@ -0,0 +1,56 @@
+import os
+from time import time
+
+import tensorflow as tf
+import numpy as np
+
+from nn import multihead_attention
+from util import tprint
+
+
+######parameters
+
+batch_num = 128
+seq_len = 40
+hidden_dim = 300
+num_heads = 8
+warmup = 5
+steps = 50
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+##############################
+
+
+def step_time(fused):
+    tf.reset_default_graph()
+    x = tf.placeholder(tf.float32, (None, None, hidden_dim))
+    x_mask = tf.placeholder(tf.float32, (None, None))
+
+    # the four attention blocks of chttvg+cap+.py
+    pre = multihead_attention(x, x, x, h=num_heads, q_mask=x_mask, k_mask=x_mask, fused=fused, scope="pre_atten")
+    hyp = multihead_attention(x, x, x, h=num_heads, q_mask=x_mask, k_mask=x_mask, fused=fused, scope="hyp_atten")
+    p2h = multihead_attention(pre, hyp, hyp, h=num_heads, q_mask=x_mask, k_mask=x_mask, fused=fused, scope="p2h_atten")
+    h2p = multihead_attention(hyp, pre, pre, h=num_heads, q_mask=x_mask, k_mask=x_mask, fused=fused, scope="h2p_atten")
+
+    loss = tf.reduce_mean(p2h) + tf.reduce_mean(h2p)
+    train_op = tf.train.GradientDescentOptimizer(0.01).minimize(loss)
+
+    feed = {x: np.random.randn(batch_num, seq_len, hidden_dim),
+            x_mask: np.ones((batch_num, seq_len))}
+
+    sess_config = tf.ConfigProto(device_count={"GPU": 0})
+    with tf.Session(config=sess_config) as sess:
+        sess.run(tf.global_variables_initializer())
+        for _ in range(warmup):
+            sess.run(train_op, feed)
+        st = time()
+        for _ in range(steps):
+            sess.run(train_op, feed)
+        return (time() - st) / steps
+
+
+unfused = step_time(False)
+fused = step_time(True)
+tprint(f"batch {batch_num} x len {seq_len}, {num_heads} heads on CPU")
+tprint(f"unfused qkv: {unfused*1000:.2f} ms/step")
+tprint(f"fused qkv:   {fused*1000:.2f} ms/step ({(unfused - fused) / unfused * 100:+.1f}%)")
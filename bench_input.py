@@ -0,0 +1,165 @@
+import os
+import json
+from time import time
+
+import tensorflow as tf
+import numpy as np
+
+from dataset import Mnli, decode_example, char2index, DEFAULT_CHARPAD, SHARED_KEYS, POS_Tagging
+from util import tprint
+
+
+######parameters
+
+data_dir = "/tmp/bench_input" #synthetic MNLI-shaped files are written here
+examples = 20000
+vocab_size = 20000
+warmup = 20 #batches
+steps = 200 #batches timed per config
+base = {"batch": 128,
+        "prefetch_buffer_size": 3,
+        "shuffle_buffer_size": 20,
+        "pad2": True,
+        "max_len": None,
+        "char_pad": DEFAULT_CHARPAD}
+#each value is run with everything else at `base`
+sweep = {"batch": [32, 128, 512],
+         "prefetch_buffer_size": [1, 3, 16],
+         "shuffle_buffer_size": [1, 20, 200],
+         "pad2": [True, False],
+         "max_len": [None, 48],
+         "char_pad": [8, 16]}
+result_file = None #json dump of every config's numbers
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+##############################
+
+
+LABELS = ("neutral", "entailment", "contradiction")
+
+
+def synthetic_sentence(rng, words, mean_len):
+    #MNLI-like length skew: mostly short, a long tail of long premises
+    n = int(np.clip(rng.lognormal(np.log(mean_len), 0.5), 1, 8 * mean_len))
+    ranks = np.minimum(rng.zipf(1.3, n), len(words)) - 1
+    return [words[r] for r in ranks]
+
+def synthetic_mnli(path, n, vocab_size=20000, seed=0):
+    """write `n` MNLI-shaped json lines to `path`; returns the vocab and a
+    shared content dict {pairID: {SHARED_KEYS: per-token flags}}"""
+    rng = np.random.RandomState(seed)
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    words = ["".join(rng.choice(letters, rng.randint(2, 11))) for _ in range(vocab_size)]
+    tags = POS_Tagging[2:]
+    sc = {}
+    with open(path, "w") as f:
+        for i in range(n):
+            s1 = synthetic_sentence(rng, words, 20)
+            s2 = synthetic_sentence(rng, words, 10)
+            pairID = f"{i}e"
+            f.write(json.dumps({
+                "pairID": pairID,
+                "gold_label": LABELS[rng.randint(3)],
+                "sentence1_binary_parse": "( " + " ".join(s1) + " )",
+                "sentence2_binary_parse": "( " + " ".join(s2) + " )",
+                "sentence1_parse": "(ROOT (S " + " ".join(f"({tags[rng.randint(len(tags))]} {w})" for w in s1) + "))",
+                "sentence2_parse": "(ROOT (S " + " ".join(f"({tags[rng.randint(len(tags))]} {w})" for w in s2) + "))",
+            }) + "\n")
+            sc[pairID] = {k: rng.randint(0, 2, len(s1 if k.startswith("sentence1") else s2)).tolist()
+                          for k in SHARED_KEYS}
+    word2idx = {"<PAD>": 0, "<UNK>": 1}
+    word2idx.update((w, i + 2) for i, w in enumerate(dict.fromkeys(words)))
+    return word2idx, sc
+
+def cpu_seconds():
+    t = os.times()
+    return t.user + t.system
+
+def decode_latency(filename, w2i, sc, char_pad, n=2000):
+    """seconds per example spent in decode_example, the py_func stage"""
+    with open(filename, "rb") as f:
+        lines = [l for _, l in zip(range(n), f)]
+    st = time()
+    for l in lines:
+        decode_example(l, word2index=w2i, char2index=lambda w: char2index(w, pad=char_pad), char_pad=char_pad, sc=sc)
+    return (time() - st) / len(lines)
+
+def read_latency(filename, batch):
+    """seconds per batch of just reading lines through tf.data"""
+    tf.reset_default_graph()
+    Next = tf.data.TextLineDataset(filename).repeat().batch(batch).make_one_shot_iterator().get_next()
+    with tf.Session() as sess:
+        for _ in range(warmup):
+            sess.run(Next)
+        st = time()
+        for _ in range(steps):
+            sess.run(Next)
+    return (time() - st) / steps
+
+def bench(filename, w2i, sc, config):
+    """drive Mnli()'s train iterator with no model attached"""
+    tf.reset_default_graph()
+    Next, inits = Mnli(filename, (filename, filename),
+                       tbatch=config["batch"],
+                       dbatch=config["batch"],
+                       tepoch=None,
+                       shuffle_buffer_size=config["shuffle_buffer_size"],
+                       prefetch_buffer_size=config["prefetch_buffer_size"],
+                       w2i=w2i,
+                       c2i=lambda w: char2index(w, pad=config["char_pad"]),
+                       char_pad=config["char_pad"],
+                       max_len=config["max_len"],
+                       sc=sc,
+                       pad2=config["pad2"])
+    labels = Next[2]
+
+    with tf.Session() as sess:
+        sess.run(inits["train"])
+        for _ in range(warmup):
+            sess.run(labels)
+
+        latency = []
+        n = 0
+        st, cst = time(), cpu_seconds()
+        for _ in range(steps):
+            bst = time()
+            n += len(sess.run(labels))
+            latency.append(time() - bst)
+        wall, cpu = time() - st, cpu_seconds() - cst
+
+    latency = np.array(latency) * 1000.
+    return {"examples_per_sec": n / wall,
+            "batches_per_sec": steps / wall,
+            "cpu_util": cpu / wall / os.cpu_count(),
+            "cores_busy": cpu / wall,
+            "batch_ms_p50": float(np.percentile(latency, 50)),
+            "batch_ms_p99": float(np.percentile(latency, 99)),
+            "read_ms": read_latency(filename, config["batch"]) * 1000.,
+            "decode_ms": decode_latency(filename, w2i, sc, config["char_pad"]) * 1000. * config["batch"]}
+
+def configs(base, sweep):
+    yield "base", dict(base)
+    for k, values in sweep.items():
+        for v in values:
+            if v != base[k]:
+                yield f"{k}={v}", {**base, k: v}
+
+
+if __name__ == "__main__":
+    os.makedirs(data_dir, exist_ok=True)
+    filename = os.path.join(data_dir, f"synthetic_{examples}.jsonl")
+    tprint(f"writing {examples} synthetic pairs to {filename}")
+    word2idx, sc = synthetic_mnli(filename, examples, vocab_size)
+    w2i = lambda w: word2idx.get(w, 1)
+
+    tprint(f"{steps} batches per config on {os.cpu_count()} cpus; read/decode are ms per batch")
+    print(f"{'config':<26}{'ex/s':>10}{'batch/s':>9}{'cpu':>7}{'p50 ms':>9}{'p99 ms':>9}{'read ms':>9}{'decode ms':>11}")
+    results = {}
+    for name, config in configs(base, sweep):
+        r = results[name] = bench(filename, w2i, sc, config)
+        print(f"{name:<26}{r['examples_per_sec']:>10.0f}{r['batches_per_sec']:>9.1f}{r['cpu_util']*100:>6.0f}%"
+              f"{r['batch_ms_p50']:>9.2f}{r['batch_ms_p99']:>9.2f}{r['read_ms']:>9.2f}{r['decode_ms']:>11.2f}")
+
+    if result_file:
+        with open(result_file, "w") as f:
+            json.dump({"base": base, "results": results}, f, indent=1)
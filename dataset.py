@@ -6,6 +6,8 @@ import io
 import re
 import subprocess as sp
 import string
+import bisect
+import itertools
 
 import tensorflow as tf
 import numpy as np
@@ -13,6 +15,7 @@ import nltk
 from tqdm import tqdm
 
 from util import tprint
+from store import Store, KeyedShards, write_store, write_keyed_store, is_store, shard_paths, next_shard
 
 DEFAULT_LABEL2IDX = {'neutral': 0, 'entailment': 1, 'contradiction': 2, 'hidden': 3, '-': -1}
 DEFAULT_WORD2IDX = {"<PAD>":0, "<UNK>":1}
@@ -30,14 +33,52 @@ shared_files = ["DIIN/data/multinli_0.9/shared_train.json",
                 "DIIN/data/multinli_0.9/shared_dev_mismatched.json",
                 ]
 
-def load_shared_content():
+SHARED_KEYS = ("sentence1_token_antonym_with_s2",
+               "sentence2_token_antonym_with_s1",
+               "sentence1_token_exact_match_with_s2",
+               "sentence2_token_exact_match_with_s1",
+               "sentence1_token_synonym_with_s2",
+               "sentence2_token_synonym_with_s1")
+
+def read_shared_file(sf, skip=()):
+    with open(sf, "r") as sfd:
+        for l in tqdm(sfd):
+            pairID = l.split(" ")[0]
+            if pairID in skip:
+                continue
+            yield pairID, json.loads(l[len(pairID)+1:])
+
+def compile_shared_content(path, files=shared_files, skip=()):
+    shard = next_shard(path)
+    tprint(f"compiling shared_files into {shard}")
+    items = ((pairID, tuple(content[k] for k in SHARED_KEYS))
+             for sf in files for pairID, content in read_shared_file(sf, skip))
+    return write_keyed_store(shard,
+                             [(k, np.uint8, (), True) for k in SHARED_KEYS],
+                             items,
+                             meta={"files": [os.path.abspath(sf) for sf in files]})
+
+def update_shared_content(path, files=shared_files):
+    """add the pairIDs of `files` that the store at `path` lacks as a new shard"""
+    store = KeyedShards(path)
+    done = set(store.keys())
+    for sf in files:
+        with open(sf, "r") as sfd:
+            if any(l.split(" ")[0] not in done for l in sfd):
+                return compile_shared_content(path, files, skip=done)
+    tprint(f"{path} is up to date")
+
+def load_shared_content(store_path=None):
+    if store_path:
+        #flat memory-mapped arrays indexed by pairID, opened lazily
+        if not shard_paths(store_path):
+            compile_shared_content(store_path)
+        return KeyedShards(store_path)
+
     tprint("loading shared_files")
     shared_content = {}
     for sf in shared_files:
-        with open(sf, "r") as sfd:
-            for l in tqdm(sfd):
-                pairID = l.split(" ")[0]
-                shared_content[pairID] = json.loads(l[len(pairID)+1:])
+        shared_content.update(read_shared_file(sf))
     return shared_content
 
 def label2index(x, l2i=DEFAULT_LABEL2IDX):
@@ -83,24 +124,122 @@ def random_embedding(size, dim, keep_zeros=[]):
 
     return emb
 
-def count_word(zfile, size=None):
+GLOVE_VOCAB = "vocab.txt"
+
+def glove_cache_path(zfile):
+    return f"{zfile}.cache"
+
+def compile_glove(zfile, path):
+    tprint(f"converting {zfile} into {path}")
+    words = ["<PAD>", "<UNK>"]
+    def rows():
+        dim = None
+        with io.BufferedReader(gzip.open(zfile, "rb")) as f:
+            for l in tqdm(f):
+                l = l.decode("utf-8").rstrip("\n")
+                if dim is None:
+                    dim = len(l.split(" ")) - 1
+                    yield (np.zeros(dim),)
+                    yield (np.zeros(dim),)
+                #a few glove tokens contain spaces, so split the vector off the right
+                values = l.rsplit(" ", dim)
+                words.append(values[0])
+                yield (np.array(values[1:], dtype=np.float32),)
+
+    rows = rows()
+    first = next(rows)
+    dim = len(first[0])
+    rows = itertools.chain([first], rows)
+    info = write_store(path, [("embedding", np.float32, (dim,), False)], rows, meta={"source": os.path.abspath(zfile)})
+    write_vocab(os.path.join(path, GLOVE_VOCAB), words)
+    return info
+
+#newline="" so tokens containing "\r" don't split into extra lines
+def write_vocab(path, words):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write("\n".join(words))
+
+def read_vocab(path):
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return f.read().split("\n")
+
+def load_glove(zfile, size=None, vocab=None, oov="unk"):
+    path = glove_cache_path(zfile)
+    if not is_store(path):
+        compile_glove(zfile, path)
+
     tprint("loadding glove")
-    word2idx = {"<PAD>":0, "<UNK>":1}
-    embedding = [np.zeros(300), np.zeros(300)#np.random.randn(300),#np.zeros(300),
-                 ]#np.random.randn(300)]
-    with io.BufferedReader(gzip.open(zfile, "rb")) as f:
-        for i, l in tqdm(enumerate(f)):
-            l = l.decode("utf-8")
-            values = l.split(" ")
-            w = values.pop(0)
-            word2idx[w] = i+2
-            embedding.append(np.asarray(values, dtype=np.float32))
-            if size and i+2 >= size - 1:
-                break
-
-    embedding = np.array(embedding)
+    embedding = Store(path).column("embedding").values
+    words = read_vocab(os.path.join(path, GLOVE_VOCAB))
+    if len(words) != len(embedding):
+        raise ValueError(f"{path} has {len(words)} words for {len(embedding)} rows; remove it to recompile")
+
+    if size:
+        words = words[:size]
+        embedding = embedding[:size]
+
+    if vocab is not None:
+        return prune_vocab(words, embedding, vocab, oov)
+
+    word2idx = {w:i for i, w in enumerate(words)}
+    return word2idx, embedding
+
+OOV_POLICIES = ("unk", "random")
+
+def prune_vocab(words, embedding, vocab, oov="unk"):
+    """keep only the rows of `vocab` tokens; tokens missing from glove (even lowercased)
+    map to <UNK> ("unk") or get their own random row ("random")"""
+    if oov not in OOV_POLICIES:
+        raise ValueError(f"unknown oov policy {oov}, expected one of {OOV_POLICIES}")
+
+    glove2idx = {w:i for i, w in enumerate(words)}
+    kept = ["<PAD>", "<UNK>"]
+    rows = [0, 1]
+    missing = []
+    #<PAD> and <UNK> keep rows 0 and 1 under every policy
+    for w in sorted(set(vocab) - set(kept)):
+        i = glove2idx.get(w, glove2idx.get(w.lower(), 0))
+        if i > 1:
+            kept.append(w)
+            rows.append(i)
+        else:
+            missing.append(w)
+
+    embedding = np.asarray(embedding[rows], dtype=np.float32)
+    if oov == "random" and missing:
+        embedding = np.concatenate((embedding,
+                                    random_embedding(len(missing), embedding.shape[1]).astype(np.float32)))
+        kept.extend(missing)
+
+    tprint(f"vocab pruned to {len(kept)} words, {len(missing)} oov ({oov})")
+    word2idx = {w:i for i, w in enumerate(kept)}
     return word2idx, embedding
 
+def count_word(zfile, size=None, vocab=None, oov="unk"):
+    return load_glove(zfile, size, vocab, oov)
+
+def count_vocab(paths):
+    tprint("counting vocab")
+    vocab = set()
+    for path in paths:
+        with open(path, "r") as f:
+            for l in tqdm(f):
+                j = json.loads(l)
+                vocab.update(tokenize(j["sentence1_binary_parse"]))
+                vocab.update(tokenize(j["sentence2_binary_parse"]))
+    return vocab
+
+MNLI_VOCAB = "vocab.txt"
+
+def cached_vocab(path, files):
+    """count_vocab of `files`, saved at `path` the first time so later runs skip the scan"""
+    if os.path.isfile(path):
+        return set(read_vocab(path)) - {""}
+    vocab = count_vocab(files)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    write_vocab(path, sorted(vocab))
+    return vocab
+
 def count_char(path):
     tprint("counting char")
     chars = set()
@@ -188,105 +327,58 @@ def MapDatasetString(dataset,
                           func=lambda x: tkn(x, func=func))
 
 
-def MNLIJSONDataset(filename,
-                    batch=10,
-                    epoch=1,
-                    shuffle_buffer_size=1,
-                    word2index=word2index,
-                    char2index=char2index,
-                    char_pad=DEFAULT_CHARPAD,
-                    max_len=None,
-                    sc=None,
-                    pad2=True):
-
-    dataset = tf.data.TextLineDataset(filename)
-    sentence1 = MapDatasetString(dataset,
-                                "sentence1_binary_parse",
-                                dtype=[tf.int64],
-                                func=word2index).repeat(epoch).padded_batch(batch, [None])
-
-    sentence2 = MapDatasetString(dataset,
-                                "sentence2_binary_parse",
-                                dtype=[tf.int64],
-                                func=word2index).repeat(epoch).padded_batch(batch, [None])
-
-    gold_label = MapDatasetJSON(dataset,
-                                "gold_label",
-                                dtype=tf.int64,
-                                func=label2index).repeat(epoch).batch(batch)
-
-    ###20180629 char_embedding
-    sent1_char = MapDatasetString(dataset,
-                                  "sentence1_binary_parse",
-                                  osize=[None, char_pad],
-                                  dtype=[tf.int64],
-                                  func=char2index).repeat(epoch).padded_batch(batch, [None, char_pad])
-    sent2_char = MapDatasetString(dataset,
-                                  "sentence2_binary_parse",
-                                  osize=[None, char_pad],
-                                  dtype=[tf.int64],
-                                  func=char2index).repeat(epoch).padded_batch(batch, [None, char_pad])
-    
-    ###change dataset1->sentence1 dataset2->sentence2 dataset3->gold_label
-
-    ###20180612: add antonym exactmatch synonym into the dataset
-
-    antonym1 = MapDatasetJSON(dataset,
-                              "pairID",
-                              dtype=[tf.float32],
-                              func=lambda x: np.array(sc[x]["sentence1_token_antonym_with_s2"]).astype(np.float32)).repeat(epoch).padded_batch(batch, [None])
-
-    antonym2 = MapDatasetJSON(dataset,
-                              "pairID",
-                              dtype=[tf.float32],
-                              func=lambda x: np.array(sc[x]["sentence2_token_antonym_with_s1"]).astype(np.float32)).repeat(epoch).padded_batch(batch, [None])
+FEATURE_TYPES = (tf.int64, tf.int64, tf.int64,
+                 tf.float32, tf.float32, tf.float32, tf.float32, tf.float32, tf.float32,
+                 tf.int64, tf.int64,
+                 tf.int64, tf.int64)
+
+def feature_shapes(char_pad=DEFAULT_CHARPAD):
+    return ([None], [None], [],
+            [None], [None], [None], [None], [None], [None],
+            [None, char_pad], [None, char_pad],
+            [None], [None])
+
+def decode_example(x,
+                   word2index=word2index,
+                   char2index=char2index,
+                   char_pad=DEFAULT_CHARPAD,
+                   sc=None):
+    d = json.loads(x.decode("utf-8")) if isinstance(x, bytes) else x
+    s1 = tokenize(d["sentence1_binary_parse"])
+    s2 = tokenize(d["sentence2_binary_parse"])
+    content = sc[d["pairID"]]
+    return (np.array([word2index(w) for w in s1], dtype=np.int64),
+            np.array([word2index(w) for w in s2], dtype=np.int64),
+            np.int64(label2index(d["gold_label"])),
+            *(np.array(content[k], dtype=np.float32) for k in SHARED_KEYS),
+            np.array([char2index(w) for w in s1], dtype=np.int64).reshape((-1, char_pad)),
+            np.array([char2index(w) for w in s2], dtype=np.int64).reshape((-1, char_pad)),
+            np.array(parse_pos(d["sentence1_parse"], func=pos2index), dtype=np.int64),
+            np.array(parse_pos(d["sentence2_parse"], func=pos2index), dtype=np.int64),
+    )
 
-    exact1to2 = MapDatasetJSON(dataset,
-                               "pairID",
-                               dtype=[tf.float32],
-                               func=lambda x: np.array(sc[x]["sentence1_token_exact_match_with_s2"]).astype(np.float32)).repeat(epoch).padded_batch(batch, [None])
-    
-    exact2to1 = MapDatasetJSON(dataset,
-                               "pairID",
-                               dtype=[tf.float32],
-                               func=lambda x: np.array(sc[x]["sentence2_token_exact_match_with_s1"]).astype(np.float32)).repeat(epoch).padded_batch(batch, [None])
-    
-    synonym1 = MapDatasetJSON(dataset,
-                              "pairID",
-                              dtype=[tf.float32],
-                              func=lambda x: np.array(sc[x]["sentence1_token_synonym_with_s2"]).astype(np.float32)).repeat(epoch).padded_batch(batch, [None])
-    
-    synonym2 = MapDatasetJSON(dataset,
-                              "pairID",
-                              dtype=[tf.float32],
-                              func=lambda x: np.array(sc[x]["sentence2_token_synonym_with_s1"]).astype(np.float32)).repeat(epoch).padded_batch(batch, [None])
-
-    pos1 = MapDatasetString(dataset,
-                            "sentence1_parse",
-                            dtype=[tf.int64],
-                            tkn=parse_pos,
-                            func=pos2index).repeat(epoch).padded_batch(batch, [None])
-
-    pos2 = MapDatasetString(dataset,
-                            "sentence2_parse",
-                            dtype=[tf.int64],
-                            tkn=parse_pos,
-                            func=pos2index).repeat(epoch).padded_batch(batch, [None])
-
-    D = tf.data.Dataset.zip((sentence1,
-                             sentence2,
-                             gold_label,
-                             antonym1,
-                             antonym2,
-                             exact1to2,
-                             exact2to1,
-                             synonym1,
-                             synonym2,
-                             sent1_char,
-                             sent2_char,
-                             pos1,
-                             pos2,
-    ))
+def resize_all(xs, sizes):
+    return tuple(resize(x, s) for x, s in zip(xs, sizes))
+
+def batch_features(dataset,
+                   batch=10,
+                   epoch=1,
+                   shuffle_buffer_size=1,
+                   char_pad=DEFAULT_CHARPAD,
+                   max_len=None,
+                   pad2=True,
+                   bucket_boundaries=None,
+                   bucket_batch_sizes=None):
+    if bucket_boundaries:
+        #group examples of similar length so a long sentence doesn't pad the whole batch
+        bucket_batch_sizes = bucket_batch_sizes or [batch] * (len(bucket_boundaries) + 1)
+        D = dataset.repeat(epoch).apply(tf.contrib.data.bucket_by_sequence_length(
+            lambda s1, s2, *_: tf.cast(tf.maximum(tf.shape(s1)[0], tf.shape(s2)[0]), tf.int32),
+            bucket_boundaries,
+            bucket_batch_sizes,
+            padded_shapes=feature_shapes(char_pad)))
+    else:
+        D = dataset.repeat(epoch).padded_batch(batch, feature_shapes(char_pad))
 
     if pad2:
         D = D.map(lambda s1, s2, l, a1, a2, e1, e2, sy1, sy2, s1c, s2c, p1, p2: (*padding(s1,s2), l,
@@ -315,6 +407,206 @@ def MNLIJSONDataset(filename,
 
     return D.shuffle(shuffle_buffer_size)
 
+
+def MNLIJSONDataset(filename,
+                    batch=10,
+                    epoch=1,
+                    shuffle_buffer_size=1,
+                    word2index=word2index,
+                    char2index=char2index,
+                    char_pad=DEFAULT_CHARPAD,
+                    max_len=None,
+                    sc=None,
+                    pad2=True,
+                    bucket_boundaries=None,
+                    bucket_batch_sizes=None):
+
+    ### decode each line once and emit all 13 features together
+    dataset = tf.data.TextLineDataset(filename)
+    _decode = lambda x: decode_example(x,
+                                       word2index=word2index,
+                                       char2index=char2index,
+                                       char_pad=char_pad,
+                                       sc=sc)
+    dataset = dataset.map(
+        lambda line: tf.py_func(_decode, [line], FEATURE_TYPES)
+    ).map(lambda *xs: resize_all(xs, feature_shapes(char_pad)))
+
+    return batch_features(dataset,
+                          batch=batch,
+                          epoch=epoch,
+                          shuffle_buffer_size=shuffle_buffer_size,
+                          char_pad=char_pad,
+                          max_len=max_len,
+                          pad2=pad2,
+                          bucket_boundaries=bucket_boundaries,
+                          bucket_batch_sizes=bucket_batch_sizes)
+
+STORE_COLUMNS = (("sentence1", np.int32, (), True),
+                 ("sentence2", np.int32, (), True),
+                 ("label", np.int8, (), False),
+                 ("antonym1", np.uint8, (), True),
+                 ("antonym2", np.uint8, (), True),
+                 ("exact1to2", np.uint8, (), True),
+                 ("exact2to1", np.uint8, (), True),
+                 ("synonym1", np.uint8, (), True),
+                 ("synonym2", np.uint8, (), True),
+                 ("sent1char", np.int16, (DEFAULT_CHARPAD,), True),
+                 ("sent2char", np.int16, (DEFAULT_CHARPAD,), True),
+                 ("pos1", np.uint8, (), True),
+                 ("pos2", np.uint8, (), True),
+)
+
+def store_columns(char_pad=DEFAULT_CHARPAD):
+    return [(n, t, (char_pad,) if s else s, r) for n, t, s, r in STORE_COLUMNS]
+
+def compile_mnli_store(filename,
+                       path,
+                       word2index=word2index,
+                       char2index=char2index,
+                       char_pad=DEFAULT_CHARPAD,
+                       sc=None,
+                       meta=None):
+    tprint(f"compiling {filename} into {path}")
+    def rows():
+        with open(filename, "rb") as f:
+            for l in tqdm(f):
+                yield decode_example(l,
+                                     word2index=word2index,
+                                     char2index=char2index,
+                                     char_pad=char_pad,
+                                     sc=sc)
+
+    meta = dict(meta or {}, source=os.path.abspath(filename), char_pad=char_pad)
+    return write_store(path, store_columns(char_pad), rows(), meta=meta)
+
+def store_name(filename):
+    return os.path.splitext(os.path.basename(filename))[0]
+
+def MNLIStoreDataset(path,
+                     batch=10,
+                     epoch=1,
+                     shuffle_buffer_size=1,
+                     char_pad=DEFAULT_CHARPAD,
+                     max_len=None,
+                     pad2=True,
+                     bucket_boundaries=None,
+                     bucket_batch_sizes=None):
+
+    store = Store(path)
+    if store.meta["char_pad"] != char_pad:
+        raise ValueError(f"{path} was compiled with char_pad={store.meta['char_pad']}, not {char_pad}")
+
+    dtypes = [t.as_numpy_dtype for t in FEATURE_TYPES]
+    def rows():
+        for row in store:
+            yield tuple(np.asarray(x, dtype=t) for x, t in zip(row, dtypes))
+
+    dataset = tf.data.Dataset.from_generator(rows,
+                                             FEATURE_TYPES,
+                                             tuple(tf.TensorShape(s) for s in feature_shapes(char_pad)))
+
+    return batch_features(dataset,
+                          batch=batch,
+                          epoch=epoch,
+                          shuffle_buffer_size=shuffle_buffer_size,
+                          char_pad=char_pad,
+                          max_len=max_len,
+                          pad2=pad2,
+                          bucket_boundaries=bucket_boundaries,
+                          bucket_batch_sizes=bucket_batch_sizes)
+
+def MNLIDataset(filename,
+                batch=10,
+                epoch=1,
+                shuffle_buffer_size=1,
+                word2index=word2index,
+                char_pad=DEFAULT_CHARPAD,
+                max_len=None,
+                sc=None,
+                pad2=True,
+                bucket_boundaries=None,
+                bucket_batch_sizes=None,
+                from_store=False,
+                char2index=char2index):
+    if from_store:
+        return MNLIStoreDataset(filename,
+                                batch,
+                                epoch,
+                                shuffle_buffer_size,
+                                char_pad=char_pad,
+                                max_len=max_len,
+                                pad2=pad2,
+                                bucket_boundaries=bucket_boundaries,
+                                bucket_batch_sizes=bucket_batch_sizes)
+
+    return MNLIJSONDataset(filename,
+                           batch,
+                           epoch,
+                           shuffle_buffer_size,
+                           word2index=word2index,
+                           char2index=char2index,
+                           pad2=pad2,
+                           bucket_boundaries=bucket_boundaries,
+                           bucket_batch_sizes=bucket_batch_sizes,
+                           char_pad=char_pad,
+                           max_len=max_len,
+                           sc=sc)
+
+def sequence_lengths(filename):
+    if is_store(filename):
+        store = Store(filename)
+        return list(zip(np.diff(store.column("sentence1").offsets),
+                        np.diff(store.column("sentence2").offsets)))
+
+    lengths = []
+    with open(filename, "r") as f:
+        for l in f:
+            d = json.loads(l)
+            lengths.append((len(tokenize(d["sentence1_binary_parse"])),
+                            len(tokenize(d["sentence2_binary_parse"]))))
+    return lengths
+
+def padding_ratio(lengths,
+                  batch=10,
+                  pad2=True,
+                  bucket_boundaries=None,
+                  bucket_batch_sizes=None):
+    """fraction of padded token slots when batching `lengths` [(len1, len2)] in stream order"""
+    batches = []
+    if bucket_boundaries:
+        bucket_batch_sizes = bucket_batch_sizes or [batch] * (len(bucket_boundaries) + 1)
+        buckets = [[] for _ in bucket_batch_sizes]
+        for l in lengths:
+            i = bisect.bisect_right(bucket_boundaries, max(l))
+            buckets[i].append(l)
+            if len(buckets[i]) == bucket_batch_sizes[i]:
+                batches.append(buckets[i])
+                buckets[i] = []
+        batches.extend(b for b in buckets if b)
+    else:
+        batches = [lengths[i:i+batch] for i in range(0, len(lengths), batch)]
+
+    real = 0
+    total = 0
+    for b in batches:
+        l1 = max(l[0] for l in b)
+        l2 = max(l[1] for l in b)
+        total += len(b) * (2 * max(l1, l2) if pad2 else l1 + l2)
+        real += sum(l[0] + l[1] for l in b)
+    return 1. - real / total if total else 0.
+
+def padding_report(filename,
+                   batch=10,
+                   pad2=True,
+                   bucket_boundaries=None,
+                   bucket_batch_sizes=None):
+    lengths = sequence_lengths(filename)
+    before = padding_ratio(lengths, batch, pad2)
+    after = padding_ratio(lengths, batch, pad2, bucket_boundaries, bucket_batch_sizes)
+    tprint(f"{os.path.basename(filename)}> padding ratio: {before:.3f} -> {after:.3f} with buckets {bucket_boundaries}")
+    return before, after
+
 def MnliTrainSet(filename="multinli_0.9_train.jsonl",
                  batch=10,
                  epoch=1,
@@ -325,17 +617,24 @@ def MnliTrainSet(filename="multinli_0.9_train.jsonl",
                  char_pad=DEFAULT_CHARPAD,
                  max_len=None,
                  sc=None,
-                 pad2=True):
-
-    train = MNLIJSONDataset(filename,
-                            batch,
-                            epoch,
-                            shuffle_buffer_size,
-                            word2index=w2i,
-                            pad2=pad2,
-                            char_pad=char_pad,
-                            max_len=max_len,
-                            sc=sc
+                 pad2=True,
+                 bucket_boundaries=None,
+                 bucket_batch_sizes=None,
+                 from_store=False):
+
+    train = MNLIDataset(filename,
+                        batch,
+                        epoch,
+                        shuffle_buffer_size,
+                        word2index=w2i,
+                        char2index=c2i,
+                        pad2=pad2,
+                        bucket_boundaries=bucket_boundaries,
+                        bucket_batch_sizes=bucket_batch_sizes,
+                        char_pad=char_pad,
+                        max_len=max_len,
+                        sc=sc,
+                        from_store=from_store
     )
 
     return train.prefetch(prefetch_buffer_size)
@@ -350,27 +649,38 @@ def MnliDevSet(files=("multinli_0.9_dev_mismatched_clean.jsonl", "multinli_0.9_d
                char_pad=DEFAULT_CHARPAD,
                max_len = None,
                sc=None,
-               pad2=True):
-
-    dev_mismatch = MNLIJSONDataset(files[0],
-                                   batch,
-                                   epoch,
-                                   shuffle_buffer_size,
-                                   w2i,
-                                   pad2=pad2,
-                                   char_pad=char_pad,
-                                   max_len=max_len,
-                                   sc=sc
+               pad2=True,
+               bucket_boundaries=None,
+               bucket_batch_sizes=None,
+               from_store=False):
+
+    dev_mismatch = MNLIDataset(files[0],
+                               batch,
+                               epoch,
+                               shuffle_buffer_size,
+                               w2i,
+                               pad2=pad2,
+                               bucket_boundaries=bucket_boundaries,
+                               bucket_batch_sizes=bucket_batch_sizes,
+                               char_pad=char_pad,
+                               max_len=max_len,
+                               sc=sc,
+                               from_store=from_store,
+                               char2index=c2i
     )
-    dev_match = MNLIJSONDataset(files[1],
-                                batch,
-                                epoch,
-                                shuffle_buffer_size,
-                                w2i,
-                                pad2=pad2,
-                                char_pad=char_pad,
-                                max_len=max_len,
-                                sc=sc
+    dev_match = MNLIDataset(files[1],
+                            batch,
+                            epoch,
+                            shuffle_buffer_size,
+                            w2i,
+                            pad2=pad2,
+                            bucket_boundaries=bucket_boundaries,
+                            bucket_batch_sizes=bucket_batch_sizes,
+                            char_pad=char_pad,
+                            max_len=max_len,
+                            sc=sc,
+                            from_store=from_store,
+                            char2index=c2i
     )
     return {"match": dev_match.prefetch(prefetch_buffer_size),
             "mismatch": dev_mismatch.prefetch(prefetch_buffer_size)}
@@ -390,7 +700,10 @@ def Mnli(tfile="multinli_0.9_train.jsonl",
          char_pad=DEFAULT_CHARPAD,
          max_len=None,
          sc=None,
-         pad2=True):
+         pad2=True,
+         bucket_boundaries=None,
+         bucket_batch_sizes=None,
+         from_store=False):
 
     trainset = MnliTrainSet(tfile,
                             batch=tbatch,
@@ -402,7 +715,10 @@ def Mnli(tfile="multinli_0.9_train.jsonl",
                             char_pad=char_pad,
                             max_len=max_len,
                             sc=sc,
-                            pad2=pad2)
+                            pad2=pad2,
+                            bucket_boundaries=bucket_boundaries,
+                            bucket_batch_sizes=bucket_batch_sizes,
+                            from_store=from_store)
 
     devset = MnliDevSet(dfiles,
                         batch=dbatch,
@@ -414,7 +730,10 @@ def Mnli(tfile="multinli_0.9_train.jsonl",
                         char_pad=char_pad,
                         max_len=max_len,
                         sc=sc,
-                        pad2=pad2)
+                        pad2=pad2,
+                        bucket_boundaries=bucket_boundaries,
+                        bucket_batch_sizes=bucket_batch_sizes,
+                        from_store=from_store)
 
     iterator =  tf.data.Iterator.from_structure(trainset.output_types,
                                                trainset.output_shapes)
@@ -446,6 +765,13 @@ class MultiNli:
                  char_emb_dim=100,
                  char_pad=DEFAULT_CHARPAD,
                  max_len=None,
+                 store_path=None,
+                 bucket_boundaries=None,
+                 bucket_batch_sizes=None,
+                 report_padding=False,
+                 shared_store=None,
+                 restrict_vocab=False,
+                 oov="unk",
     ):
 
         self.glove_path = glove_path
@@ -458,6 +784,11 @@ class MultiNli:
         self.prefetch_buffer_size = prefetch_buffer_size
         self.pad2 = pad2
         self.max_len = max_len
+        self.shared_store = shared_store
+        self.restrict_vocab = restrict_vocab
+        self.oov = oov
+        self.bucket_boundaries = bucket_boundaries
+        self.bucket_batch_sizes = bucket_batch_sizes
         
         self.char_pad = char_pad
         self.char_emb_dim = char_emb_dim
@@ -466,21 +797,36 @@ class MultiNli:
         
         self.devfile = tuple(os.path.join(mnli_path, dfile) for dfile in ("multinli_0.9_dev_mismatched_clean.jsonl", "multinli_0.9_dev_matched_clean.jsonl"))
 
-        self.train_size = int(sp.check_output(["wc", "-l", self.trainfile]).split()[0])
-        self.dev_size = [int(sp.check_output(["wc", "-l", devf]).split()[0]) for devf in self.devfile]
-
-        #load shared_content
-        self.shared_content = load_shared_content()
-
-        #load word embedding
-        self.word2idx, self.embedding = count_word(self.glove_path, self.glove_size)
+        #load word embedding, optionally only the words seen in train/dev (kept with the store)
+        vocab = None
+        if restrict_vocab:
+            files = (self.trainfile, *self.devfile)
+            vocab = cached_vocab(os.path.join(store_path, MNLI_VOCAB), files) if store_path else count_vocab(files)
+        self.word2idx, self.embedding = count_word(self.glove_path, self.glove_size, vocab, oov)
+
+        self.store_path = store_path
+        if store_path:
+            #read pre-indexed examples instead of raw jsonl
+            self.trainstore = os.path.join(store_path, store_name(self.trainfile))
+            self.devstore = tuple(os.path.join(store_path, store_name(devf)) for devf in self.devfile)
+            self.shared_content = None
+            self.compile_store(all_printable_char)
+
+            self.char2idx = Store(self.trainstore).meta["char2idx"]
+            self.train_size = len(Store(self.trainstore))
+            self.dev_size = [len(Store(devs)) for devs in self.devstore]
+        else:
+            self.train_size = int(sp.check_output(["wc", "-l", self.trainfile]).split()[0])
+            self.dev_size = [int(sp.check_output(["wc", "-l", devf]).split()[0]) for devf in self.devfile]
 
+            #load shared_content
+            self.shared_content = load_shared_content(self.shared_store)
 
-        #load char embedding
-        if all_printable_char:
-            self.char2idx = DEFAULT_CHAR2IDX
-        else:
-            self.char2idx = count_char(self.trainfile)
+            #load char embedding
+            if all_printable_char:
+                self.char2idx = DEFAULT_CHAR2IDX
+            else:
+                self.char2idx = count_char(self.trainfile)
 
         #gen random char emb
         self.char_embedding = random_embedding(len(self.char2idx), self.char_emb_dim, keep_zeros=(0,))
@@ -489,9 +835,17 @@ class MultiNli:
         self.pos2idx = POS2IDX
         self.pos_embedding = random_embedding(len(self.pos2idx), len(self.pos2idx), keep_zeros=(0,))
 
+        if report_padding:
+            for f in (self.trainstore, *self.devstore) if store_path else (self.trainfile, *self.devfile):
+                padding_report(f,
+                               self.batch,
+                               self.pad2,
+                               self.bucket_boundaries,
+                               self.bucket_batch_sizes)
+
         #setup dataset
-        self.data, self.init = Mnli(tfile=self.trainfile,
-                                    dfiles=self.devfile,
+        self.data, self.init = Mnli(tfile=self.trainstore if store_path else self.trainfile,
+                                    dfiles=self.devstore if store_path else self.devfile,
                                     tbatch=self.batch,
                                     dbatch=self.batch,
                                     tepoch=self.train_epoch,
@@ -500,9 +854,12 @@ class MultiNli:
                                     prefetch_buffer_size=self.prefetch_buffer_size,
                                     w2i=lambda x: word2index(x, self.word2idx),
                                     pad2=self.pad2,
+                                    bucket_boundaries=self.bucket_boundaries,
+                                    bucket_batch_sizes=self.bucket_batch_sizes,
                                     c2i=lambda x: char2index(x, self.char2idx, pad=self.char_pad),
                                     max_len=self.max_len,
-                                    sc=self.shared_content
+                                    sc=self.shared_content,
+                                    from_store=bool(store_path)
         )
 
         self.sentence1 = self.data[0]
@@ -520,6 +877,38 @@ class MultiNli:
         self.pos1 = self.data[11]
         self.pos2 = self.data[12]
 
+    def store_meta(self, char2idx):
+        return {"glove": os.path.basename(self.glove_path),
+                "glove_size": self.glove_size,
+                "restrict_vocab": self.restrict_vocab,
+                "oov": self.oov,
+                "char2idx": char2idx}
+
+    def compile_store(self, all_printable_char=False):
+        files = [(self.trainfile, self.trainstore)] + list(zip(self.devfile, self.devstore))
+        missing = [(f, p) for f, p in files if not is_store(p)]
+
+        if missing:
+            if is_store(self.trainstore):
+                char2idx = Store(self.trainstore).meta["char2idx"]
+            else:
+                char2idx = DEFAULT_CHAR2IDX if all_printable_char else count_char(self.trainfile)
+            sc = load_shared_content(self.shared_store)
+            for f, p in missing:
+                compile_mnli_store(f, p,
+                                   word2index=lambda x: word2index(x, self.word2idx),
+                                   char2index=lambda x: char2index(x, char2idx, pad=self.char_pad),
+                                   char_pad=self.char_pad,
+                                   sc=sc,
+                                   meta=self.store_meta(char2idx))
+
+        expect = self.store_meta(None)
+        for f, p in files:
+            meta = Store(p).meta
+            for k in ("glove", "glove_size", "restrict_vocab", "oov"):
+                if meta[k] != expect[k]:
+                    raise ValueError(f"{p} was compiled with {k}={meta[k]}, not {expect[k]}; remove it to recompile")
+
     def train(self, sess):
         sess.run(self.init['train'])
 
@@ -0,0 +1,157 @@
+import os
+import json
+import types
+from time import time
+
+import numpy as np
+import tensorflow as tf
+import tensorflow.contrib.rnn #registers the fused GRU ops the frozen graphs use
+from tensorflow.tools.graph_transforms import TransformGraph
+
+from inference import Predictor
+from dataset import DEFAULT_CHAR2IDX, write_vocab, read_vocab
+from util import tprint
+
+
+GRAPH_FILE = "graph.pb"
+META_FILE = "meta.json"
+VOCAB_FILE = "vocab.txt"
+WORD_TABLE_FILE = "word_table.npy"
+
+#a GraphDef is one protobuf message, which cannot be serialized past 2GB
+MAX_GRAPH_BYTES = 2**31 - 1
+
+TRANSFORMS = ["strip_unused_nodes",
+              "remove_nodes(op=CheckNumerics)",
+              "fold_constants(ignore_errors=true)",
+              "sort_by_execution_order"]
+
+
+def node_name(tensor):
+    return tensor.name.split(":")[0]
+
+def placeholder_node(name, dtype, shape):
+    n = tf.NodeDef(name=name, op="Placeholder")
+    n.attr["dtype"].type = tf.as_dtype(dtype).as_datatype_enum
+    n.attr["shape"].shape.CopyFrom(tf.TensorShape(shape).as_proto())
+    return n
+
+def freeze(predictor):
+    """GraphDef of the predictor's inference graph with every variable turned
+    into a constant, training-only nodes dropped and constant subgraphs
+    folded. The zero-padded word table stays out of it: it becomes a
+    placeholder of the same name, fed from WORD_TABLE_FILE at load time"""
+    table = predictor.model.word_table
+    inputs = [node_name(t) for t in predictor.inputs.features()] + [node_name(table)]
+    outputs = [node_name(predictor.prob)]
+
+    word_variables = [v.op.name for v in predictor.graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)
+                      if v.op.name.startswith("word_embedding/")]
+    graph_def = tf.graph_util.convert_variables_to_constants(predictor.sess,
+                                                             predictor.graph.as_graph_def(),
+                                                             outputs,
+                                                             variable_names_blacklist=word_variables)
+    for n in graph_def.node:
+        if n.name == node_name(table):
+            n.CopyFrom(placeholder_node(n.name, tf.float32, table.shape))
+    graph_def = tf.graph_util.remove_training_nodes(graph_def, protected_nodes=outputs + inputs)
+    return TransformGraph(graph_def, inputs, outputs, TRANSFORMS)
+
+def write_graph(graph_def, path):
+    size = graph_def.ByteSize()
+    if size > MAX_GRAPH_BYTES:
+        raise ValueError(f"the graph is {size / 2**30:.2f}GB, past the 2GB protobuf limit; "
+                         f"keep large constants out of it (see WORD_TABLE_FILE)")
+    with open(path, "wb") as f:
+        f.write(graph_def.SerializeToString())
+
+#one "index\tword" line per word: glove may map several lines to one word, leaving gaps in the indices
+def write_word2idx(path, word2idx):
+    write_vocab(path, (f"{i}\t{w}" for w, i in sorted(word2idx.items(), key=lambda x: x[1])))
+
+def read_word2idx(path):
+    lines = (l.split("\t", 1) for l in read_vocab(path) if l)
+    return {w:int(i) for i, w in lines}
+
+def export_frozen(predictor, path):
+    """write `predictor` as a self-contained directory: graph.pb, the word
+    table, the vocab and the tensor names and preprocessing settings
+    FrozenPredictor needs"""
+    os.makedirs(path, exist_ok=True)
+    graph_def = freeze(predictor)
+    write_graph(graph_def, os.path.join(path, GRAPH_FILE))
+    np.save(os.path.join(path, WORD_TABLE_FILE), predictor.sess.run(predictor.model.word_table))
+
+    write_word2idx(os.path.join(path, VOCAB_FILE), predictor.word2idx)
+
+    meta = {"variant": predictor.variant,
+            "char2idx": predictor.char2idx,
+            "char_pad": predictor.char_pad,
+            "max_len": predictor.max_len,
+            "inputs": [t.name for t in predictor.inputs.features()],
+            "prob": predictor.prob.name,
+            #graph placeholder -> .npy it is loaded from
+            "tables": {predictor.model.word_table.name: WORD_TABLE_FILE}}
+    with open(os.path.join(path, META_FILE), "w") as f:
+        json.dump(meta, f)
+
+    tprint(f"exported {len(graph_def.node)} nodes to {path}")
+    return meta
+
+
+class FrozenPredictor(Predictor):
+    """Predictor over a graph written by `export_frozen`; needs neither the
+    model code nor GloVe, only the export directory"""
+    def __init__(self,
+                 path,
+                 features=None,
+                 sc=None,
+                 batch_size=64,
+                 max_tokens=4096,
+                 threads=0):
+
+        st = time()
+        with open(os.path.join(path, META_FILE), "r") as f:
+            meta = json.load(f)
+        word2idx = read_word2idx(os.path.join(path, VOCAB_FILE))
+
+        self.configure(word2idx, meta["char2idx"], meta["char_pad"], meta["max_len"],
+                       features, sc, batch_size, max_tokens)
+        self.variant = meta["variant"]
+
+        graph_def = tf.GraphDef()
+        with open(os.path.join(path, GRAPH_FILE), "rb") as f:
+            graph_def.ParseFromString(f.read())
+
+        #tables outside the GraphDef are loaded once into variables that stand in for their placeholders
+        self.graph = tf.Graph()
+        input_map = {}
+        feeds = {}
+        with self.graph.as_default():
+            for i, (tensor, filename) in enumerate(meta.get("tables", {}).items()):
+                value = np.load(os.path.join(path, filename), mmap_mode="r")
+                init = tf.placeholder(value.dtype, value.shape)
+                input_map[tensor] = tf.Variable(init, trainable=False, name=f"table_{i}").value()
+                feeds[init] = value
+            tf.import_graph_def(graph_def, input_map=input_map, name="")
+            init = tf.global_variables_initializer()
+        get = self.graph.get_tensor_by_name
+        inputs = tuple(get(n) for n in meta["inputs"])
+        self.inputs = types.SimpleNamespace(features=lambda: inputs)
+        self.prob = get(meta["prob"])
+
+        self.sess = self.session(threads, fold_constants=meta.get("fold_constants", True))
+        self.sess.run(init, feed_dict=feeds)
+        tprint(f"loaded {path} in {time() - st:.1f} seconds")
+
+
+if __name__ == "__main__":
+    ######parameters
+    checkpoint = "model/cap+hinge+pos-abs"
+    variant = "chttvg+cap+"
+    glove_path = "glove.txt.gz"
+    char2idx = DEFAULT_CHAR2IDX #must be the training one; a store keeps it in meta["char2idx"]
+    export_dir = "export/cap+hinge+pos-abs"
+    ##############################
+
+    export_frozen(Predictor.from_glove(checkpoint, variant, glove_path, char2idx=char2idx), export_dir)
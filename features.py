@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+
+from relations import RelationIndex
+from util import tprint, LRU
+
+
+class FeatureService:
+    """antonym/exact-match/synonym flags of arbitrary token pairs, as in shared_*.json.
+
+    Pairs whose tokens are all in the precomputed RelationIndex are matched
+    vectorized by its match_batch, any other pair with set lookups, so the
+    index tables are never rebuilt while serving. Results are cached per
+    (s1, s2) in an LRU. Flags come back as float32 arrays in
+    dataset.SHARED_KEYS order, so a service can be passed as
+    `Predictor(features=...)`.
+    """
+    def __init__(self, index, cache_size=100000):
+        self.index = index
+        self.cache = LRU(cache_size)
+        #build the lookup tables once, up front
+        self.index.tables()
+
+    @classmethod
+    def load(cls, relation_file, vocab=None, **kwargs):
+        if vocab is not None:
+            index = RelationIndex.cached(relation_file, vocab)
+        elif os.path.isfile(relation_file):
+            index = RelationIndex.load(relation_file)
+        else:
+            raise FileNotFoundError(f"no relation index at {relation_file}; pass a vocab to build it")
+        tprint(f"relation index with {len(index)} tokens")
+        return cls(index, **kwargs)
+
+    @staticmethod
+    def to_features(flags):
+        #match order (exact, antonym, synonym) -> SHARED_KEYS order (antonym, exact, synonym)
+        s1_exact, s2_exact, s1_ant, s2_ant, s1_syn, s2_syn = (f.astype(np.float32) for f in flags)
+        return (s1_ant, s2_ant, s1_exact, s2_exact, s1_syn, s2_syn)
+
+    def batch(self, pairs):
+        """features of a list of (s1 tokens, s2 tokens)"""
+        keys = [(tuple(s1), tuple(s2)) for s1, s2 in pairs]
+        results = [self.cache.get(k) for k in keys]
+        misses = list({k for k, r in zip(keys, results) if r is None})
+        computed = {k: self.to_features(flags) for k, flags in zip(misses, self.index.match_batch(misses))}
+
+        for k, features in computed.items():
+            self.cache.put(k, features)
+        return [r if r is not None else computed[k] for k, r in zip(keys, results)]
+
+    def __call__(self, s1, s2):
+        return self.batch([(s1, s2)])[0]
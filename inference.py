@@ -0,0 +1,280 @@
+import json
+import types
+import itertools
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.core.protobuf import rewriter_config_pb2
+import nltk
+
+from dataset import (DEFAULT_CHAR2IDX, DEFAULT_CHARPAD, SHARED_KEYS,
+                     word2index, char2index, pos2index, tokenize, parse_pos, count_word)
+from model import Model, checkpoint_saver
+from features import FeatureService
+from util import tprint
+
+
+#class order of DEFAULT_LABEL2IDX
+LABELS = ("neutral", "entailment", "contradiction")
+
+EMBEDDING_VARIABLES = {"embedding": "word_embedding/embedding_weights",
+                       "char_embedding": "char_embedding/char_embedding_weights",
+                       "pos_embedding": "pos_embedding/pos_embedding_weights"}
+
+
+def checkpoint_embeddings(checkpoint):
+    """zero embedding tables shaped like the ones in `checkpoint` (plus the pad row),
+    enough to build the graph before restoring it; they take no memory"""
+    shapes = dict(tf.train.list_variables(checkpoint))
+    return types.SimpleNamespace(**{k: np.broadcast_to(np.float32(0), (shapes[v][0] + 1, shapes[v][1]))
+                                    for k, v in EMBEDDING_VARIABLES.items() if v in shapes})
+
+
+class Inputs:
+    """placeholders under the MultiNli attribute names, for feeding a Model directly"""
+    def __init__(self, char_pad=DEFAULT_CHARPAD):
+        self.sentence1 = tf.placeholder(tf.int64, (None, None), name="sentence1")
+        self.sentence2 = tf.placeholder(tf.int64, (None, None), name="sentence2")
+        self.label = None
+        for k in ("antonym1", "antonym2", "exact1to2", "exact2to1", "synonym1", "synonym2"):
+            setattr(self, k, tf.placeholder(tf.float32, (None, None), name=k))
+        self.sent1char = tf.placeholder(tf.int64, (None, None, char_pad), name="sent1char")
+        self.sent2char = tf.placeholder(tf.int64, (None, None, char_pad), name="sent2char")
+        self.pos1 = tf.placeholder(tf.int64, (None, None), name="pos1")
+        self.pos2 = tf.placeholder(tf.int64, (None, None), name="pos2")
+
+    def features(self):
+        #same order as decode_example, without the label
+        return (self.sentence1, self.sentence2,
+                self.antonym1, self.antonym2, self.exact1to2, self.exact2to1, self.synonym1, self.synonym2,
+                self.sent1char, self.sent2char, self.pos1, self.pos2)
+
+
+FEATURE_DTYPES = [np.int64, np.int64] + [np.float32] * 6 + [np.int64] * 4
+
+
+def no_features(s1, s2):
+    return tuple(np.zeros(len(s), dtype=np.float32) for s in (s1, s2) * 3)
+
+def shared_features(sc):
+    """side features of pairs already in shared content, looked up by pairID"""
+    def features(s1, s2, pairID):
+        content = sc[pairID]
+        return tuple(np.array(content[k], dtype=np.float32) for k in SHARED_KEYS)
+    return features
+
+#nltk data raw pairs are tokenized and tagged with; either name of each, by nltk version
+NLTK_RESOURCES = (("tokenizers/punkt_tab", "tokenizers/punkt"),
+                  ("taggers/averaged_perceptron_tagger_eng", "taggers/averaged_perceptron_tagger"))
+
+_nltk_checked = False
+
+def check_nltk():
+    global _nltk_checked
+    if _nltk_checked:
+        return
+    for names in NLTK_RESOURCES:
+        for name in names:
+            try:
+                nltk.data.find(name)
+                break
+            except LookupError:
+                pass
+        else:
+            package = names[0].split("/")[1]
+            raise LookupError(f"nltk data {names[0]} is missing; install it with nltk.download({package!r})")
+    _nltk_checked = True
+
+def parse_pair(pair):
+    """(s1 tokens, s2 tokens, s1 pos, s2 pos, pairID) of an MNLI json line/dict
+    or of a raw (premise, hypothesis) pair; ValueError if either has no tokens"""
+    if isinstance(pair, (str, bytes)):
+        pair = json.loads(pair)
+    if isinstance(pair, dict):
+        s1 = tokenize(pair["sentence1_binary_parse"])
+        s2 = tokenize(pair["sentence2_binary_parse"])
+        if not s1 or not s2:
+            raise ValueError(f"empty sentence in pair {pair.get('pairID')}")
+        return (s1, s2,
+                parse_pos(pair["sentence1_parse"], func=pos2index),
+                parse_pos(pair["sentence2_parse"], func=pos2index),
+                pair.get("pairID"))
+
+    check_nltk()
+    premise, hypothesis = pair
+    s1 = nltk.word_tokenize(premise)
+    s2 = nltk.word_tokenize(hypothesis)
+    if not s1 or not s2:
+        raise ValueError("empty premise or hypothesis")
+    return (s1, s2,
+            [pos2index(p) for _, p in nltk.pos_tag(s1)],
+            [pos2index(p) for _, p in nltk.pos_tag(s2)],
+            None)
+
+def pad_batch(xs, dtype):
+    shape = (len(xs), max(len(x) for x in xs)) + np.shape(xs[0])[1:]
+    out = np.zeros(shape, dtype=dtype)
+    for i, x in enumerate(xs):
+        out[i, :len(x)] = x
+    return out
+
+
+class Predictor:
+    """Scores sentence pairs with a trained Model variant.
+
+    The graph is fed through placeholders (no tf.data iterator, loss or
+    optimizer) and restored from `checkpoint`. `word2idx` and `char2idx` must
+    be the ones the checkpoint was trained with. `features(s1, s2)` computes
+    the antonym/exact/synonym flags of a pair (e.g. a features.FeatureService);
+    with a shared content `sc` they are looked up by pairID instead, and
+    without either they are 0.
+    """
+    def __init__(self,
+                 checkpoint,
+                 variant,
+                 word2idx,
+                 char2idx=DEFAULT_CHAR2IDX,
+                 char_pad=DEFAULT_CHARPAD,
+                 max_len=None,
+                 features=None,
+                 sc=None,
+                 batch_size=64,
+                 max_tokens=4096,
+                 threads=0,
+                 **model_kwargs):
+
+        self.configure(word2idx, char2idx, char_pad, max_len, features, sc, batch_size, max_tokens)
+        self.variant = variant
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.inputs = Inputs(char_pad)
+            self.model = Model.variant(variant,
+                                       self.inputs,
+                                       checkpoint_embeddings(checkpoint),
+                                       **{"feed_init": True, **model_kwargs})
+            self.prob = tf.identity(self.model.prob, name="prob")
+            saver = checkpoint_saver(variant)
+
+        self.sess = self.session(threads)
+        tprint(f"restoring {checkpoint}")
+        saver.restore(self.sess, checkpoint)
+
+    def configure(self, word2idx, char2idx, char_pad, max_len, features, sc, batch_size, max_tokens):
+        self.word2idx = word2idx
+        self.char2idx = char2idx
+        self.char_pad = char_pad
+        self.max_len = max_len
+        self.features = features
+        self.shared_features = shared_features(sc) if sc is not None else None
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+
+    def session(self, threads=0, fold_constants=True):
+        sess_config = tf.ConfigProto(intra_op_parallelism_threads=threads,
+                                     inter_op_parallelism_threads=threads)
+        sess_config.gpu_options.allow_growth = True
+        if not fold_constants:
+            #both the graph optimizer and grappler would fold Cast(int8 const) back into a float32 const
+            sess_config.graph_options.optimizer_options.opt_level = tf.OptimizerOptions.L0
+            sess_config.graph_options.rewrite_options.constant_folding = rewriter_config_pb2.RewriterConfig.OFF
+        return tf.Session(graph=self.graph, config=sess_config)
+
+    @classmethod
+    def from_glove(cls, checkpoint, variant, glove_path, glove_size=None, vocab=None, oov="unk", **kwargs):
+        word2idx, _ = count_word(glove_path, glove_size, vocab, oov)
+        return cls(checkpoint, variant, word2idx, **kwargs)
+
+    def close(self):
+        self.sess.close()
+
+    def parse(self, pair):
+        s1, s2, p1, p2, pairID = parse_pair(pair)
+        if self.max_len:
+            s1, s2, p1, p2 = s1[:self.max_len], s2[:self.max_len], p1[:self.max_len], p2[:self.max_len]
+        return s1, s2, p1, p2, pairID
+
+    def side_features(self, parsed):
+        """antonym/exact/synonym flags of parsed pairs, in one call when `features` has a batch()"""
+        side = [self.shared_features(s1, s2, pairID) if self.shared_features is not None and pairID is not None else None
+                for s1, s2, _, _, pairID in parsed]
+        todo = [i for i, f in enumerate(side) if f is None]
+        if self.features is None:
+            computed = [no_features(*parsed[i][:2]) for i in todo]
+        elif hasattr(self.features, "batch"):
+            computed = self.features.batch([parsed[i][:2] for i in todo])
+        else:
+            computed = [self.features(*parsed[i][:2]) for i in todo]
+        for i, f in zip(todo, computed):
+            side[i] = f
+        return side
+
+    def encode(self, parsed, side):
+        """one example as numpy arrays, in Inputs.features() order"""
+        s1, s2, p1, p2, _ = parsed
+        side = tuple(f[:len(s1) if i % 2 == 0 else len(s2)] for i, f in enumerate(side))
+
+        w2i = lambda w: word2index(w, self.word2idx)
+        c2i = lambda w: char2index(w, self.char2idx, pad=self.char_pad)
+        return (np.array([w2i(w) for w in s1], dtype=np.int64),
+                np.array([w2i(w) for w in s2], dtype=np.int64),
+                *side,
+                np.array([c2i(w) for w in s1], dtype=np.int64).reshape((-1, self.char_pad)),
+                np.array([c2i(w) for w in s2], dtype=np.int64).reshape((-1, self.char_pad)),
+                np.array(p1, dtype=np.int64),
+                np.array(p2, dtype=np.int64))
+
+    def encode_all(self, pairs):
+        parsed = [self.parse(p) for p in pairs]
+        return [self.encode(p, f) for p, f in zip(parsed, self.side_features(parsed))]
+
+    def batches(self, examples):
+        """indices of `examples` grouped by (premise, hypothesis) length, at most
+        batch_size rows and max_tokens padded tokens per batch. Only pairs of the
+        same lengths share a batch: the capsule attention does not mask padding,
+        so a padded pair would score differently than it does alone"""
+        lengths = lambda i: (len(examples[i][0]), len(examples[i][1]))
+        for _, group in itertools.groupby(sorted(range(len(examples)), key=lengths), key=lengths):
+            group = list(group)
+            l = max(lengths(group[0]) + (1,))
+            size = max(1, min(self.batch_size, self.max_tokens // l))
+            for i in range(0, len(group), size):
+                yield group[i:i + size]
+
+    def feed(self, examples):
+        return {p: pad_batch(xs, t) for p, xs, t in zip(self.inputs.features(), zip(*examples), FEATURE_DTYPES)}
+
+    def run(self, examples):
+        return self.sess.run(self.prob, feed_dict=self.feed(examples))
+
+    def predict(self, pairs):
+        """[len(pairs), 3] label probabilities, columns in LABELS order"""
+        examples = self.encode_all(pairs)
+        probs = np.zeros((len(examples), len(LABELS)), dtype=np.float32)
+        for batch in self.batches(examples):
+            probs[batch] = self.run([examples[i] for i in batch])
+        return probs
+
+    def predict_labels(self, pairs):
+        return [LABELS[i] for i in self.predict(pairs).argmax(-1)]
+
+
+if __name__ == "__main__":
+    ######parameters
+    checkpoint = "model/cap+hinge+pos-abs"
+    variant = "chttvg+cap+"
+    glove_path = "glove.txt.gz"
+    char2idx = DEFAULT_CHAR2IDX #must be the training one; a store keeps it in meta["char2idx"]
+    pairs_file = "./DIIN/data/multinli_0.9/multinli_0.9_dev_matched_clean.jsonl"
+    relation_file = "DIIN/data/multinli_0.9/relations.pkl"
+    ##############################
+
+    predictor = Predictor.from_glove(checkpoint, variant, glove_path,
+                                     char2idx=char2idx,
+                                     features=FeatureService.load(relation_file))
+    with open(pairs_file, "r") as f:
+        pairs = [json.loads(l) for l in f]
+
+    labels = predictor.predict_labels(pairs)
+    correct = sum(l == p["gold_label"] for l, p in zip(labels, pairs))
+    tprint(f"accuracy: {correct / len(pairs)} on {len(pairs)} pairs")
@@ -0,0 +1,351 @@
+import tensorflow as tf
+
+from nn import embedded, mask, per_token, highway_network, multihead_attention, softmax_multihead_attention, trilinear_attention, normalize, char_conv, interaction_pool, gru_encoder, gru_pair, concat_sequences
+import rnn_capsule
+import rnn_capsule_H
+
+
+#component flags of every experiment script, named after the README rule:
+# c: char, h: highway, t: attention (multihead, or trilinear for "a"), second t: cross,
+# v: cross attention over the self attention outputs, i: interaction pooling,
+# g: gru over both sentences ("+": hypothesis continues from the premise state), cap: capsule,
+# gg: ugrnn over the joint interaction pooling of both sentences, final h: highway reconstruction loss
+VARIANTS = {
+    "htg":         dict(),
+    "hag":         dict(attention="trilinear"),
+    "httg":        dict(cross=True),
+    "httig":       dict(cross=True, interactive=True),
+    "chttg":       dict(char=True, cross=True, mask_integration=True),
+    "chttvg":      dict(char=True, cross=True, cross_self=True, mask_integration=True),
+    "chttvg+":     dict(char=True, cross=True, cross_self=True, mask_integration=True, gru="chained"),
+    "chttvg+cap":  dict(char=True, mask_integration=True, integration="normalize", gru=None,
+                        capsule="rnn_capsule", clip_norm=1.0),
+    "chttvg+cap+": dict(char=True, pos=True, feed_init=True, cross=True, cross_self=True,
+                        mask_integration=True, abs_sub=False, integration="dense", gru="chained",
+                        capsule="rnn_capsule_H", capsule_loss=dict(uk=10), clip_norm=1.0),
+    #test_char_httggh_capsule.py
+    "chttgghcap":  dict(char=True, zero_pad=False, attention="softmax", cross=True, integrate_cross=False,
+                        interactive="joint", gru="ugrnn", capsule="rnn_capsule", reconstruct=True, l2=0),
+}
+
+#scopes whose variables a variant's script checkpoints hold under another name, model -> script;
+#hag's dense attention scores became trilinear_attention, which also renumbered its classifier
+CHECKPOINT_SCOPES = {
+    "hag": {"pre_atten": "dense_2", "hyp_atten": "dense_3", "dense_2": "dense_4"},
+}
+
+CAPSULES = {"rnn_capsule": rnn_capsule.RNN_Capsule,
+            "rnn_capsule_H": rnn_capsule_H.RNN_Capsule}
+
+ATTENTIONS = ("multihead", "trilinear", "softmax")
+INTEGRATIONS = ("concat", "normalize", "dense")
+GRUS = ("concat", "chained", "ugrnn", None)
+
+
+class Model:
+    """embedding -> highway -> attention -> integration -> gru -> classifier graph
+    shared by the experiment scripts.
+
+    `inputs` gives the batch tensors under the MultiNli attribute names
+    (sentence1, sentence2, label, antonym1, ..., pos2) and `embeddings` the
+    initial embedding, char_embedding and pos_embedding arrays; both default
+    to a MultiNli. Layers are created in the order the scripts created them,
+    so variables keep the scripts' names; `checkpoint_saver` also restores
+    hag, whose attention scopes changed. Restoring is not reproducing, though:
+    nn.multihead_attention now splits heads per feature block and masks
+    padding (the scripts' version reshaped rows across heads) and the grus
+    skip padding, so a restored variant scores differently from its script
+    until it is fine-tuned.
+    """
+    def __init__(self,
+                 inputs,
+                 embeddings=None,
+                 char=False,
+                 pos=False,
+                 zero_pad=True,
+                 highway=True,
+                 attention="multihead",
+                 cross=False,
+                 cross_self=False,
+                 integrate_cross=True,
+                 interactive=False,
+                 gru="concat",
+                 capsule=None,
+                 capsule_loss=None,
+                 reconstruct=False,
+                 abs_sub=True,
+                 integration="concat",
+                 mask_integration=False,
+                 feed_init=False,
+                 skip_padding=True,
+                 hidden_dim=300,
+                 num_heads=8,
+                 filter_size=3,
+                 gru_units=128,
+                 l2=9e-5,
+                 clip_norm=None):
+
+        if attention not in ATTENTIONS:
+            raise ValueError(f"attention must be one of {ATTENTIONS}, not {attention!r}")
+        if integration not in INTEGRATIONS:
+            raise ValueError(f"integration must be one of {INTEGRATIONS}, not {integration!r}")
+        if gru not in GRUS:
+            raise ValueError(f"gru must be one of {GRUS}, not {gru!r}")
+        if gru is None and capsule is None:
+            raise ValueError("a model without gru needs a capsule classifier")
+        if (gru == "ugrnn") != (interactive == "joint"):
+            raise ValueError("the ugrnn gru reads, and only it reads, the joint interaction")
+        if reconstruct and capsule is None:
+            raise ValueError("reconstruct needs a capsule classifier")
+
+        self.inputs = inputs
+        self.embeddings = embeddings if embeddings is not None else inputs
+        self.char = char
+        self.pos = pos
+        self.zero_pad = zero_pad
+        self.highway = highway
+        self.attention = attention
+        self.cross = cross
+        self.cross_self = cross_self
+        self.integrate_cross = integrate_cross
+        self.interactive = interactive
+        self.gru = gru
+        self.capsule = capsule
+        self.capsule_loss = capsule_loss or {}
+        self.reconstruct = reconstruct
+        self.abs_sub = abs_sub
+        self.integration = integration
+        self.mask_integration = mask_integration
+        self.feed_init = feed_init
+        self.skip_padding = skip_padding
+        self.hidden_dim = hidden_dim
+        self.num_heads = num_heads
+        self.filter_size = filter_size
+        self.gru_units = gru_units
+        self.l2 = l2
+        self.clip_norm = clip_norm
+
+        self.labels = getattr(inputs, "label", None)
+
+        self.build_inputs()
+        self.build_embedding()
+        self.build_encoder()
+        self.build_attention()
+        self.build_integration()
+        self.build_classifier()
+        if self.labels is not None:
+            self.build_loss()
+
+    @classmethod
+    def variant(cls, name, inputs, embeddings=None, **kwargs):
+        return cls(inputs, embeddings, **{**VARIANTS[name], **kwargs})
+
+    def build_inputs(self):
+        x = self.inputs
+        self.sentence1 = x.sentence1
+        self.sentence2 = x.sentence2
+        self.sent1_mask = tf.cast(tf.sign(self.sentence1), dtype=tf.float32)
+        self.sent2_mask = tf.cast(tf.sign(self.sentence2), dtype=tf.float32)
+        self.sent1_len = tf.reduce_sum(self.sent1_mask, -1)
+        self.sent2_len = tf.reduce_sum(self.sent2_mask, -1)
+
+        self.antonym1  = tf.expand_dims(x.antonym1, -1)
+        self.antonym2  = tf.expand_dims(x.antonym2, -1)
+        self.exact1to2 = tf.expand_dims(x.exact1to2, -1)
+        self.exact2to1 = tf.expand_dims(x.exact2to1, -1)
+        self.synonym1  = tf.expand_dims(x.synonym1, -1)
+        self.synonym2  = tf.expand_dims(x.synonym2, -1)
+
+    def build_embedding(self):
+        x = self.inputs
+        e = self.embeddings
+        with tf.variable_scope("word_embedding"):
+            glove_embedding = embedded(e.embedding, mask_padding=self.zero_pad, feed_init=self.feed_init)
+            self.word_table = glove_embedding.weights
+            self.embedding_pre = glove_embedding(self.sentence1)
+            self.embedding_hyp = glove_embedding(self.sentence2)
+
+        embed_pre = [self.embedding_pre, self.antonym1, self.exact1to2, self.synonym1]
+        embed_hyp = [self.embedding_hyp, self.antonym2, self.exact2to1, self.synonym2]
+
+        if self.char:
+            with tf.variable_scope("char_embedding"):
+                char_embedding = embedded(e.char_embedding, name="char", mask_padding=self.zero_pad)
+                char_embedding_pre = char_embedding(x.sent1char)
+                char_embedding_hyp = char_embedding(x.sent2char)
+
+                with tf.variable_scope("conv") as scope:
+                    self.conv_pre = char_conv(char_embedding_pre, filter_size=self.filter_size)
+                    scope.reuse_variables()
+                    self.conv_hyp = char_conv(char_embedding_hyp, filter_size=self.filter_size)
+            embed_pre.append(self.conv_pre)
+            embed_hyp.append(self.conv_hyp)
+
+        if self.pos:
+            with tf.variable_scope("pos_embedding"):
+                pos_embedding = embedded(e.pos_embedding, name="pos")
+                self.pos_embedding_pre = pos_embedding(x.pos1)
+                self.pos_embedding_hyp = pos_embedding(x.pos2)
+            embed_pre.append(self.pos_embedding_pre)
+            embed_hyp.append(self.pos_embedding_hyp)
+
+        self.embed_pre = tf.concat(embed_pre, -1)
+        self.embed_hyp = tf.concat(embed_hyp, -1)
+
+    def encode(self, x, x_mask, name):
+        def layers(x):
+            if self.highway:
+                x = highway_network(x, 2, [tf.nn.sigmoid] * 2, name)
+            #peter: dim reduction
+            return normalize(tf.layers.dense(x, self.hidden_dim, activation=tf.nn.sigmoid))
+
+        if self.skip_padding:
+            return per_token(layers, x, x_mask)
+        return mask(layers(x), x_mask)
+
+    def build_encoder(self):
+        self.hout_pre = self.encode(self.embed_pre, self.sent1_mask, "premise")
+        self.hout_hyp = self.encode(self.embed_hyp, self.sent2_mask, "hypothesis")
+
+    def scope(self, name):
+        #the softmax attention keeps its script's scope names
+        return f"{name}_multihead_attention" if self.attention == "softmax" else f"{name}_atten"
+
+    def self_attention(self, x, x_mask, name):
+        if self.attention == "trilinear":
+            return trilinear_attention(x, x, x_mask, x_mask, scope=self.scope(name))
+        return self.cross_attention(x, x, x_mask, x_mask, name)
+
+    def cross_attention(self, q, k, q_mask, k_mask, name):
+        if self.attention == "softmax":
+            return softmax_multihead_attention(q, k, self.hidden_dim, self.num_heads, scope=self.scope(name))
+        return multihead_attention(q, k, k,
+                                   h=self.num_heads,
+                                   q_mask=q_mask,
+                                   k_mask=k_mask,
+                                   scope=self.scope(name))
+
+    def build_attention(self):
+        self.pre_atten = self.self_attention(self.hout_pre, self.sent1_mask, "pre")
+        self.hyp_atten = self.self_attention(self.hout_hyp, self.sent2_mask, "hyp")
+
+        if self.cross:
+            p, h = (self.pre_atten, self.hyp_atten) if self.cross_self else (self.hout_pre, self.hout_hyp)
+            self.p2h_atten = self.cross_attention(p, h, self.sent1_mask, self.sent2_mask, "p2h")
+            self.h2p_atten = self.cross_attention(h, p, self.sent2_mask, self.sent1_mask, "h2p")
+
+    def integrate(self, x, atten, x_mask):
+        #[B, L, 300+300+300+300]
+        sub = tf.subtract(x, atten)
+        if self.abs_sub:
+            sub = tf.abs(sub)
+        out = tf.concat([x, atten, tf.multiply(x, atten), sub], axis=2)
+
+        if self.integration == "normalize":
+            out = normalize(out)
+        elif self.integration == "dense":
+            out = tf.layers.dense(out, self.hidden_dim)
+
+        return mask(out, x_mask if self.mask_integration else None)
+
+    def build_integration(self):
+        P = self.integrate(self.hout_pre, self.pre_atten, self.sent1_mask)
+        H = self.integrate(self.hout_hyp, self.hyp_atten, self.sent2_mask)
+
+        if self.cross and self.integrate_cross:
+            PH = self.integrate(self.hout_pre, self.p2h_atten, self.sent1_mask)
+            HP = self.integrate(self.hout_hyp, self.h2p_atten, self.sent2_mask)
+            P = tf.concat([P, PH], 2)
+            H = tf.concat([H, HP], 2)
+        elif self.cross:
+            P = tf.concat([P, self.p2h_atten], 2)
+            H = tf.concat([H, self.h2p_atten], 2)
+
+        self.P = P
+        self.H = H
+
+        if self.interactive == "joint":
+            #both pooled sides side by side, which needs both sentences padded to one length (pad2)
+            pl_sum_pool, hl_sum_pool, pl_ave_pool, hl_ave_pool, pl_max_pool, hl_max_pool = interaction_pool(P, H)
+            self.pl = tf.layers.dense(tf.concat([pl_sum_pool, pl_ave_pool, pl_max_pool, P], axis=2), self.hidden_dim)
+            self.hl = tf.layers.dense(tf.concat([hl_sum_pool, hl_ave_pool, hl_max_pool, H], axis=2), self.hidden_dim)
+            self.ph = tf.layers.dense(tf.concat([self.pl, self.hl], axis=2), self.hidden_dim)
+        elif self.interactive:
+            #httig builds these but its gru still reads P/H
+            _, _, pl_ave_pool, hl_ave_pool, pl_max_pool, hl_max_pool = interaction_pool(P, H)
+            self.pl = tf.layers.dense(tf.concat([pl_ave_pool, pl_max_pool, P], axis=2), self.hidden_dim)
+            self.hl = tf.layers.dense(tf.concat([hl_ave_pool, hl_max_pool, H], axis=2), self.hidden_dim)
+
+    def build_classifier(self):
+        if self.gru == "concat":
+            #fused gru over the valid premise steps followed by the valid hypothesis steps
+            ph = concat_sequences(self.P, self.sent1_len, self.H, self.sent2_len)
+            self.outputs, self.state = gru_encoder(ph, self.sent1_len + self.sent2_len, units=self.gru_units)
+        elif self.gru == "chained":
+            #hypothesis continues from the premise state, in one pass
+            self.p_outputs, self.h_outputs, _, self.state = gru_pair(self.P, self.sent1_len,
+                                                                      self.H, self.sent2_len,
+                                                                      units=self.gru_units)
+            self.outputs = tf.concat([self.p_outputs, self.h_outputs], 1)
+        elif self.gru == "ugrnn":
+            cell = tf.contrib.rnn.UGRNNCell(num_units=self.gru_units)
+            self.outputs, self.state = tf.nn.dynamic_rnn(cell, self.ph, dtype=tf.float32)
+        else:
+            self.outputs = tf.concat([self.P, self.H], 1)
+
+        if self.capsule:
+            self.rnn_capsule = CAPSULES[self.capsule](3, self.labels)
+            self.ps, self.rs = self.rnn_capsule(self.outputs)
+            self.y = self.ps
+            self.prob = self.ps / tf.reduce_sum(self.ps, -1, keepdims=True)
+        else:
+            self.y = tf.layers.dense(self.state, 3)
+            self.prob = tf.nn.softmax(self.y)
+
+        self.predictlabel = tf.argmax(self.y, axis=1)
+
+    def build_loss(self):
+        if self.capsule:
+            loss = self.rnn_capsule.loss(self.outputs, **self.capsule_loss)
+        else:
+            loss = tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(labels=self.labels,
+                                                                                 logits=self.y))
+        if self.reconstruct:
+            #the capsule representations and the final gru state map to the same 3 scores
+            with tf.variable_scope("final") as scope:
+                final = highway_network(self.rs, 2, [tf.nn.sigmoid] * 2, "reconstruct")
+                scope.reuse_variables()
+                state_final = highway_network(self.state, 2, [tf.nn.sigmoid] * 2, "reconstruct", reuse=True)
+            _y = tf.squeeze(tf.layers.dense(final, 1), -1) #[B, 3]
+            _state = tf.layers.dense(state_final, 3) #[B, 3]
+            loss += tf.reduce_mean(tf.reduce_sum(tf.square(_y - _state), -1))
+        if self.l2:
+            l2_loss = tf.add_n([tf.nn.l2_loss(v) for v in tf.trainable_variables()])
+            loss += l2_loss * self.l2
+        self.loss = loss
+
+        # current accuracy
+        self.correctlabel = tf.cast(tf.equal(self.predictlabel, self.labels), dtype=tf.float32)
+        self.correctnumber = tf.reduce_sum(self.correctlabel)
+        self.correntPred = tf.reduce_mean(self.correctlabel)
+
+    def train_op(self, learning_rate):
+        optimizer = tf.train.AdamOptimizer(learning_rate=learning_rate)
+        if self.clip_norm is None:
+            return optimizer.minimize(self.loss)
+
+        tvars = tf.trainable_variables()
+        grads, _ = tf.clip_by_global_norm(tf.gradients(self.loss, tvars), self.clip_norm)
+        return optimizer.apply_gradients(zip(grads, tvars))
+
+
+def checkpoint_saver(variant, **kwargs):
+    """tf.train.Saver over the current graph's variables under the names the
+    `variant` script's checkpoints use"""
+    scopes = CHECKPOINT_SCOPES.get(variant, {})
+    var_list = {}
+    for v in tf.global_variables():
+        scope, _, rest = v.op.name.partition("/")
+        name = f"{scopes[scope]}/{rest}" if scope in scopes and rest else v.op.name
+        var_list[name] = v
+    return tf.train.Saver(var_list, **kwargs)
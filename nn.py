@@ -1,30 +1,57 @@
 import tensorflow as tf
 
-def ZeroPadEmbeddingWeight(weights, name="", trainable=True):
+_init_feeds = {}
+
+def init_feed(value, name):
+    """placeholder initial value, fed by `init_feed_dict` so `value` never lands in the GraphDef"""
+    p = tf.placeholder(tf.float32, shape=value.shape, name=f"{name}_init")
+    _init_feeds[p] = value
+    return p
+
+def init_feed_dict(graph=None):
+    graph = graph or tf.get_default_graph()
+    return {p: v for p, v in _init_feeds.items() if p.graph is graph}
+
+def ZeroPadEmbeddingWeight(weights, name="", trainable=True, feed_init=False):
     vs, dims = weights.shape
-    weight_init = tf.constant_initializer(weights[1:, :])
-    embedding_weights = tf.get_variable(
-        name=f'{name + "_" if name else ""}embedding_weights', shape=(vs-1, dims),
-        initializer=weight_init,
-        trainable=trainable)
+    vname = f'{name + "_" if name else ""}embedding_weights'
+    if feed_init:
+        embedding_weights = tf.get_variable(
+            name=vname,
+            initializer=init_feed(weights[1:, :], vname),
+            trainable=trainable)
+    else:
+        weight_init = tf.constant_initializer(weights[1:, :])
+        embedding_weights = tf.get_variable(
+            name=vname, shape=(vs-1, dims),
+            initializer=weight_init,
+            trainable=trainable)
     zeropad = tf.zeros((1,dims), dtype=tf.float32)
     return tf.concat((zeropad, embedding_weights), 0)
     
-def embedded(weights, name="", trainable=True, mask_padding=True):
+def embedded(weights, name="", trainable=True, mask_padding=True, feed_init=False):
     if mask_padding:
-        embedding_weights = ZeroPadEmbeddingWeight(weights, name=name, trainable=trainable)
+        embedding_weights = ZeroPadEmbeddingWeight(weights, name=name, trainable=trainable, feed_init=feed_init)
     else:
-        weight_init = tf.constant_initializer(weights)
-        embedding_weights = tf.get_variable(
-            name = f'{name + "_" if name else ""}embedding_weights',
-            shape = weights.shape,
-            initializer = weight_init,
-            trainable = trainable)
+        vname = f'{name + "_" if name else ""}embedding_weights'
+        if feed_init:
+            embedding_weights = tf.get_variable(
+                name = vname,
+                initializer = init_feed(weights, vname),
+                trainable = trainable)
+        else:
+            weight_init = tf.constant_initializer(weights)
+            embedding_weights = tf.get_variable(
+                name = vname,
+                shape = weights.shape,
+                initializer = weight_init,
+                trainable = trainable)
 
     def lookup(x):
         nonlocal embedding_weights
         return tf.nn.embedding_lookup(embedding_weights, x)
 
+    lookup.weights = embedding_weights
     return lookup
 
 
@@ -52,6 +79,22 @@ def mask(x, x_mask=None):
     mask = tf.tile(tf.expand_dims(x_mask, -1), [1, 1, dim])
     return x * mask
 
+def gather_tokens(x, x_mask): #x: [B, L, d] -> [N_tok, d]
+    """the unpadded steps of x as one flat batch, and where they came from"""
+    idx = tf.where(x_mask > 0)
+    return tf.gather_nd(x, idx), idx
+
+def scatter_tokens(tokens, idx, x_mask): #[N_tok, d'] -> [B, L, d']
+    """inverse of gather_tokens; padded steps are 0"""
+    shape = tf.concat([tf.shape(x_mask, out_type=tf.int64), tf.shape(tokens, out_type=tf.int64)[1:]], 0)
+    return tf.scatter_nd(idx, tokens, shape)
+
+def per_token(f, x, x_mask):
+    """f applied to the valid steps of x only, so per-token layers (highway,
+    dense, normalize) do no work on padding; padded steps come out 0"""
+    tokens, idx = gather_tokens(x, x_mask)
+    return scatter_tokens(f(tokens), idx, x_mask)
+
 
 def normalize(inputs,
               epsilon=1e-8,
@@ -124,6 +167,55 @@ def attention(q, k): #q: [B, ql, d], k: [B, kl, d]
     v = tf.matmul(a, k) #[B, ql, d]
     return v
 
+def trilinear_attention(q, k,
+                        q_mask=None,
+                        k_mask=None,
+                        scope="trilinear_attention",
+                        reuse=None): #q: [B, ql, d], k: [B, kl, d]
+    # same score as `attention`, dense([q; k; q*k]), split into its three
+    # projections so the [B, ql, kl, 3d] tile is never built
+    with tf.variable_scope(scope, reuse=reuse):
+        d = q.get_shape().as_list()[-1]
+        kernel = tf.get_variable("kernel", (3 * d, 1))
+        bias = tf.get_variable("bias", (1,), initializer=tf.zeros_initializer())
+        wq, wk, wqk = tf.split(kernel, 3, 0) #[d, 1]
+
+        eq = tf.tensordot(q, wq, 1) #[B, ql, 1]
+        ek = tf.transpose(tf.tensordot(k, wk, 1), (0, 2, 1)) #[B, 1, kl]
+        eqk = tf.matmul(q * tf.squeeze(wqk, -1), k, transpose_b=True) #[B, ql, kl]
+        e = eq + ek + eqk + bias
+
+        if k_mask is not None:
+            e += (1. - tf.expand_dims(k_mask, 1)) * -1e9
+
+        a = tf.nn.softmax(e, -1)
+        v = tf.matmul(a, k) #[B, ql, d]
+        return mask(v, q_mask)
+
+def interaction_pool(p, h): #p: [B, PL, d], h: [B, HL, d]
+    """sum/mean/max pooling of the interaction p[:, i] * h[:, j] over each axis,
+    without materializing the [B, PL, HL, d] tensor.
+
+    Returns (pl_sum, hl_sum, pl_ave, hl_ave, pl_max, hl_max); pl_* reduce over
+    the premise axis ([B, HL, d]), hl_* over the hypothesis axis ([B, PL, d]).
+    """
+    PL = tf.cast(tf.shape(p)[1], tf.float32)
+    HL = tf.cast(tf.shape(h)[1], tf.float32)
+
+    # sum_i p_i * h_j = h_j * sum_i p_i
+    pl_sum = h * tf.reduce_sum(p, 1, keepdims=True)
+    hl_sum = p * tf.reduce_sum(h, 1, keepdims=True)
+
+    # max_i p_i * h_j is h_j * max_i p_i where h_j >= 0, else h_j * min_i p_i
+    pl_max = tf.where(h >= 0,
+                      h * tf.reduce_max(p, 1, keepdims=True),
+                      h * tf.reduce_min(p, 1, keepdims=True))
+    hl_max = tf.where(p >= 0,
+                      p * tf.reduce_max(h, 1, keepdims=True),
+                      p * tf.reduce_min(h, 1, keepdims=True))
+
+    return pl_sum, hl_sum, pl_sum / PL, hl_sum / HL, pl_max, hl_max
+
 def ffn(x, d, act=None):
     a = tf.layers.dense(x, d, activation=act)
     return tf.layers.dense(a, d)
@@ -133,10 +225,47 @@ def pwffn(x, ff=2048):
     a = tf.layers.dense(x, ff, activation=tf.nn.relu)
     return tf.layers.dense(a, dim)
 
+def split_heads(x, h): #[b, l, h*dk] -> [b*h, l, dk]
+    b = tf.shape(x)[0]
+    l = tf.shape(x)[1]
+    dk = x.get_shape().as_list()[-1] // h
+    x = tf.transpose(tf.reshape(x, (b, l, h, dk)), (0, 2, 1, 3))
+    return tf.reshape(x, (b*h, l, dk))
+
+def merge_heads(x, h): #[b*h, l, dk] -> [b, l, h*dk]
+    l = tf.shape(x)[1]
+    dk = x.get_shape().as_list()[-1]
+    x = tf.transpose(tf.reshape(x, (-1, h, l, dk)), (0, 2, 1, 3))
+    return tf.reshape(x, (-1, l, h*dk))
+
+def fused_dense(x, layers):
+    """apply several tf.layers.Dense to the same x with a single matmul"""
+    for l in layers:
+        if not l.built:
+            #an empty call creates the variables under the usual dense_N names
+            l(x[:, :0])
+    kernel = tf.concat([l.kernel for l in layers], 1)
+    bias = tf.concat([l.bias for l in layers], 0)
+    y = tf.tensordot(x, kernel, 1) + bias
+    return tf.split(y, [l.units for l in layers], -1)
+
+def qkv_projection(q, k, v, units, fused=True):
+    Qd, Kd, Vd = (tf.layers.Dense(units) for _ in range(3))
+    if fused and q is k and k is v:
+        return fused_dense(q, (Qd, Kd, Vd))
+    elif fused and k is v:
+        Q = Qd(q)
+        K, V = fused_dense(k, (Kd, Vd))
+        return Q, K, V
+    return Qd(q), Kd(k), Vd(v)
+
 def multihead_attention(q, k, v,
                         dk=64,
                         h = 8,
                         ff=2048,
+                        q_mask=None,
+                        k_mask=None,
+                        fused=False,
                         scope="multihead_attention",
                         reuse=None):
     with tf.variable_scope(scope, reuse=reuse):
@@ -144,23 +273,163 @@ def multihead_attention(q, k, v,
         b = tf.shape(q)[0]
         ql = tf.shape(q)[1]
         kl = tf.shape(k)[1]
-        vl = kl
-        Q = tf.layers.dense(q, h*dk)
-        K = tf.layers.dense(k, h*dk)
-        V = tf.layers.dense(v, h*dk)
-        hq = tf.reshape(Q, (b*h, ql, dk))
-        hk = tf.reshape(K, (b*h, kl, dk))
-        hv = tf.reshape(V, (b*h, vl, dk)) #[b*h, vl, dk]
+        # fused projects q, k, v with one matmul; variables stay
+        # dense/dense_1/dense_2 either way, so checkpoints are interchangeable.
+        # off by default: on CPU the split copies cost more than the matmuls saved
+        Q, K, V = qkv_projection(q, k, v, h*dk, fused=fused)
+        hq = split_heads(Q, h)
+        hk = split_heads(K, h)
+        hv = split_heads(V, h) #[b*h, vl, dk]
         
         qkt = tf.matmul(hq, tf.transpose(hk, (0, 2, 1))) / (dk ** 0.5)#[b*h, ql, kl=vl]
+        if k_mask is not None:
+            # padded keys get no attention weight
+            hk_mask = tf.reshape(tf.tile(tf.expand_dims(k_mask, 1), (1, h, 1)), (b*h, 1, kl))
+            qkt += (1. - hk_mask) * -1e9
         a = tf.nn.softmax(qkt, -1)
         
         hatten = tf.matmul(a , hv) #[b*h, ql, dk]
-        hatten = tf.reshape(hatten, (b, ql, h*dk))
+        hatten = merge_heads(hatten, h)
 
         atten = tf.layers.dense(hatten, dim, use_bias=False)
         aoutput = normalize(atten + q)
         output = pwffn(aoutput, ff)
         output = normalize(aoutput + output)
         
-        return output
+        return mask(output, q_mask)
+
+def softmax_multihead_attention(queries, keys,
+                                num_units,
+                                num_heads=8,
+                                scope="multihead_attention",
+                                reuse=None):
+    """the attention of test_char_httggh_capsule.py: softmax activated Q/K/V
+    projections, padding inferred from all-zero rows, a residual connection
+    and layer norm, and no output projection or feed forward"""
+    with tf.variable_scope(scope, reuse=reuse):
+        Q = tf.layers.dense(queries, num_units, activation=tf.nn.softmax) # (N, T_q, C)
+        K = tf.layers.dense(keys, num_units, activation=tf.nn.softmax) # (N, T_k, C)
+        V = tf.layers.dense(keys, num_units, activation=tf.nn.softmax) # (N, T_k, C)
+
+        Q_ = tf.concat(tf.split(Q, num_heads, axis=2), axis=0) # (h*N, T_q, C/h)
+        K_ = tf.concat(tf.split(K, num_heads, axis=2), axis=0) # (h*N, T_k, C/h)
+        V_ = tf.concat(tf.split(V, num_heads, axis=2), axis=0) # (h*N, T_k, C/h)
+
+        outputs = tf.matmul(Q_, tf.transpose(K_, [0, 2, 1])) # (h*N, T_q, T_k)
+        outputs = outputs / (K_.get_shape().as_list()[-1] ** 0.5)
+
+        key_masks = tf.sign(tf.abs(tf.reduce_sum(keys, axis=-1))) # (N, T_k)
+        key_masks = tf.tile(key_masks, [num_heads, 1]) # (h*N, T_k)
+        key_masks = tf.tile(tf.expand_dims(key_masks, 1), [1, tf.shape(queries)[1], 1]) # (h*N, T_q, T_k)
+        paddings = tf.ones_like(outputs)*(-2**32+1)
+        outputs = tf.nn.softmax(tf.where(tf.equal(key_masks, 0), paddings, outputs)) # (h*N, T_q, T_k)
+
+        query_masks = tf.sign(tf.abs(tf.reduce_sum(queries, axis=-1))) # (N, T_q)
+        query_masks = tf.tile(query_masks, [num_heads, 1]) # (h*N, T_q)
+        outputs *= tf.expand_dims(query_masks, -1)
+
+        outputs = tf.matmul(outputs, V_) # (h*N, T_q, C/h)
+        outputs = tf.concat(tf.split(outputs, num_heads, axis=0), axis=2) # (N, T_q, C)
+        return normalize(outputs + queries)
+
+
+def gru_cell(units, fused=True):
+    # GRUBlockCellV2 runs each step as one fused kernel and keeps GRUCell's
+    # variable names (gru_cell/gates, gru_cell/candidate), so checkpoints load either way
+    if fused:
+        return tf.contrib.rnn.GRUBlockCellV2(units, name="gru_cell")
+    return tf.nn.rnn_cell.GRUCell(units)
+
+def gru_encoder(x, lengths,
+                units=128,
+                initial_state=None,
+                bidirectional=False,
+                fused=True,
+                scope="rnn",
+                reuse=None):
+    """GRU over x: [B, L, d] that stops at `lengths`; returns (outputs, state).
+    outputs past a row's length are 0 and state is the state at its last token.
+    bidirectional concatenates forward and backward outputs/states."""
+    lengths = tf.cast(lengths, tf.int32)
+    with tf.variable_scope(scope, reuse=reuse):
+        if not bidirectional:
+            return tf.nn.dynamic_rnn(gru_cell(units, fused), x,
+                                     sequence_length=lengths,
+                                     initial_state=initial_state,
+                                     dtype=tf.float32,
+                                     scope=tf.get_variable_scope())
+
+        fw_state, bw_state = initial_state if initial_state is not None else (None, None)
+        (fw, bw), (fs, bs) = tf.nn.bidirectional_dynamic_rnn(gru_cell(units, fused),
+                                                             gru_cell(units, fused),
+                                                             x,
+                                                             sequence_length=lengths,
+                                                             initial_state_fw=fw_state,
+                                                             initial_state_bw=bw_state,
+                                                             dtype=tf.float32,
+                                                             scope=tf.get_variable_scope())
+        return tf.concat([fw, bw], -1), tf.concat([fs, bs], -1)
+
+def _batch_gather(x, idx): #x: [B, L, d], idx: [B, T] -> [B, T, d]
+    b = tf.tile(tf.expand_dims(tf.range(tf.shape(idx)[0]), 1), (1, tf.shape(idx)[1]))
+    return tf.gather_nd(x, tf.stack([b, idx], -1))
+
+def _pad_step(x):
+    return tf.pad(x, ((0, 0), (0, 1), (0, 0)))
+
+def concat_sequences(a, a_len, b, b_len):
+    """[B, La+Lb, d]: the a_len valid steps of a directly followed by the b_len
+    valid steps of b, zero padded at the end (tf.concat keeps a's padding in between)"""
+    a_len = tf.cast(a_len, tf.int32)
+    b_len = tf.cast(b_len, tf.int32)
+    la = tf.shape(a)[1]
+    lb = tf.shape(b)[1]
+    # one zero step past each end, so indices stay valid when la or lb is 0
+    a = _pad_step(a)
+    b = _pad_step(b)
+    t = tf.expand_dims(tf.range(la + lb), 0)
+    ia = tf.minimum(t, la) + tf.zeros_like(tf.expand_dims(a_len, 1))
+    ib = tf.clip_by_value(t - tf.expand_dims(a_len, 1), 0, lb)
+    in_a = tf.expand_dims(t < tf.expand_dims(a_len, 1), -1)
+    in_b = tf.expand_dims(t < tf.expand_dims(a_len + b_len, 1), -1)
+    ga = _batch_gather(a, ia)
+    gb = _batch_gather(b, ib)
+    return tf.where(tf.tile(in_a, (1, 1, tf.shape(a)[2])), ga,
+                    tf.where(tf.tile(in_b, (1, 1, tf.shape(a)[2])), gb, tf.zeros_like(gb)))
+
+def split_sequences(x, a_len, la, lb):
+    """inverse of concat_sequences: ([B, la, d], [B, lb, d]) with padding zeroed"""
+    a_len = tf.cast(a_len, tf.int32)
+    l = tf.shape(x)[1]
+    ta = tf.expand_dims(tf.range(la), 0)
+    a = x[:, :la] * tf.cast(tf.expand_dims(ta < tf.expand_dims(a_len, 1), -1), x.dtype)
+    tb = tf.expand_dims(a_len, 1) + tf.expand_dims(tf.range(lb), 0)
+    b = _batch_gather(_pad_step(x), tf.minimum(tb, l))
+    # steps past the end of x, or past b's length, are already 0 in x
+    return a, b * tf.cast(tf.expand_dims(tb < l, -1), x.dtype)
+
+def gru_pair(p, p_len, h, h_len, units=128, chained=True, **kwargs):
+    """encode premise and hypothesis with one recurrent call.
+
+    chained: the hypothesis starts from the premise's final state (what two
+    dynamic_rnn calls with initial_state=p_state do), run as one pass over
+    concat_sequences(p, h). Otherwise both are stacked along the batch axis
+    and encoded independently with shared weights.
+    Returns (p_outputs, h_outputs, p_state, h_state); p_state is None when chained.
+    """
+    lp = tf.shape(p)[1]
+    lh = tf.shape(h)[1]
+    if chained:
+        outputs, state = gru_encoder(concat_sequences(p, p_len, h, h_len),
+                                     tf.cast(p_len, tf.int32) + tf.cast(h_len, tf.int32),
+                                     units, **kwargs)
+        p_outputs, h_outputs = split_sequences(outputs, p_len, lp, lh)
+        return p_outputs, h_outputs, None, state
+
+    b = tf.shape(p)[0]
+    l = tf.maximum(lp, lh)
+    ph = tf.concat([tf.pad(p, [[0, 0], [0, l - lp], [0, 0]]),
+                    tf.pad(h, [[0, 0], [0, l - lh], [0, 0]])], 0)
+    outputs, state = gru_encoder(ph, tf.concat([tf.cast(p_len, tf.int32), tf.cast(h_len, tf.int32)], 0),
+                                 units, **kwargs)
+    return outputs[:b, :lp], outputs[b:, :lh], state[:b], state[b:]
@@ -10,18 +10,19 @@ import nltk
 from nltk.corpus import wordnet as wn 
 import os
 import pickle
+import shutil
 import multiprocessing as mp
+import threading
 from itertools import islice, chain
 from nltk.tag import StanfordNERTagger
 from nltk.tag import StanfordPOSTagger
 
-from dataset import tokenize
+from dataset import tokenize, update_shared_content
+from relations import RelationIndex
 
 ##params
 #FIXED_PARAMETERS, config = params.load_parameters()
 
-nltk.download('wordnet')
-
 
 LABEL_MAP = {
     "entailment": 0,
@@ -39,25 +40,32 @@ stemmer = nltk.SnowballStemmer('english')
 tt = nltk.tokenize.treebank.TreebankWordTokenizer()
 
 
-def load_nli_data(path, snli=False, shuffle = True):
+def iter_nli_data(path, snli=False, skip=()):
     """
-    Load MultiNLI or SNLI data.
-    If the "snli" parameter is set to True, a genre label of snli will be assigned to the data. 
+    Lazily yield MultiNLI or SNLI examples, leaving out pairIDs in `skip`.
     """
-    data = []
     with open(path, encoding='utf-8') as f:
-        for line in tqdm(f):
+        for line in f:
             loaded_example = json.loads(line)
             if loaded_example["gold_label"] not in LABEL_MAP:
                 continue
-            
+            if loaded_example["pairID"] in skip:
+                continue
+
             loaded_example["label"] = LABEL_MAP[loaded_example["gold_label"]]
             if snli:
                 loaded_example["genre"] = "snli"
-            data.append(loaded_example)
-        if shuffle:
-            random.seed(1)
-            random.shuffle(data)
+            yield loaded_example
+
+def load_nli_data(path, snli=False, shuffle = True):
+    """
+    Load MultiNLI or SNLI data.
+    If the "snli" parameter is set to True, a genre label of snli will be assigned to the data. 
+    """
+    data = list(tqdm(iter_nli_data(path, snli)))
+    if shuffle:
+        random.seed(1)
+        random.shuffle(data)
     return data
 
 def load_nli_data_genre(path, genre, snli=True, shuffle = True):
@@ -82,66 +90,26 @@ def load_nli_data_genre(path, genre, snli=True, shuffle = True):
             random.shuffle(data)
     return data
 
-def is_exact_match(token1, token2):
-    token1 = token1.lower()
-    token2 = token2.lower()
-    
-    token1_stem = stemmer.stem(token1)
+relation_index = RelationIndex()
 
-    if token1 == token2:
-        return True
-    
-    for synsets in wn.synsets(token2):
-        for lemma in synsets.lemma_names():
-            if token1_stem == stemmer.stem(lemma):
-                return True
-    
-    if token1 == "n't" and token2 == "not":
-        return True
-    elif token1 == "not" and token2 == "n't":
-        return True
-    elif token1_stem == stemmer.stem(token2):
-        return True
-    return False
+def is_exact_match(token1, token2):
+    return relation_index.is_exact_match(token1, token2)
 
 def is_antonyms(token1, token2):
-    token1 = token1.lower()
-    token2 = token2.lower()
-    token1_stem = stemmer.stem(token1)
-    antonym_lists_for_token2 = []
-    for synsets in wn.synsets(token2):
-        for lemma_synsets in [wn.synsets(l) for l in synsets.lemma_names()]:
-            for lemma_syn in lemma_synsets:
-                for lemma in lemma_syn.lemmas():
-                    for antonym in lemma.antonyms():
-                        antonym_lists_for_token2.append(antonym.name())
-                        # if token1_stem == stemmer.stem(antonym.name()):
-                        #     return True 
-    antonym_lists_for_token2 = list(set(antonym_lists_for_token2))
-    for atnm in antonym_lists_for_token2:
-        if token1_stem == stemmer.stem(atnm):
-            return True
-    return False
-
-
-#TODO: check wordnet synonyms api
+    return relation_index.is_antonyms(token1, token2)
+
 def is_synonyms(token1, token2):
-    token1 = token1.lower()
-    token2 = token2.lower()
-    token1_stem = stemmer.stem(token1)
-    synonym_lists_for_token2 = []
-    for synsets in wn.synsets(token2):
-       for lemma_synsets in [wn.synsets(l) for l in synsets.lemma_names()]:
-            for lemma_syn in lemma_synsets:
-                for lemma in lemma_syn.lemmas():
-                    synonym_lists_for_token2.append(lemma.name())
-                        # if token1_stem == stemmer.stem(synonym.name()):
-                        #     return True 
-    synonym_lists_for_token2 = list(set(synonym_lists_for_token2))
-    for atnm in synonym_lists_for_token2:
-        if token1_stem == stemmer.stem(atnm):
-            return True
-    return False
+    return relation_index.is_synonyms(token1, token2)
+
+def vocabulary(paths):
+    vocab = set()
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                example = json.loads(line)
+                vocab.update(tokenize(example['sentence1_binary_parse']))
+                vocab.update(tokenize(example['sentence2_binary_parse']))
+    return vocab
 
 
 def worker(dataset):
@@ -157,28 +125,9 @@ def worker(dataset):
             s2_tokenize = tokenize(example['sentence2_binary_parse'])
 
 
-            s1_token_exact_match = [0] * len(s1_tokenize)
-            s2_token_exact_match = [0] * len(s2_tokenize)
-            s1_token_antonym = [0] * len(s1_tokenize)
-            s2_token_antonym = [0] * len(s2_tokenize)
-            s1_token_synonym = [0] * len(s1_tokenize)
-            s2_token_synonym = [0] * len(s2_tokenize)
-            for i, word in enumerate(s1_tokenize):
-                matched = False
-                for j, w2 in enumerate(s2_tokenize):
-                    matched = is_exact_match(word, w2)
-                    if matched:
-                        s1_token_exact_match[i] = 1
-                        s2_token_exact_match[j] = 1
-                    ant = is_antonyms(word, w2)
-                    if ant:
-                        s1_token_antonym[i] = 1
-                        s2_token_antonym[j] = 1
-                    syn = is_synonyms(word,w2)
-                    if syn:
-                        s1_token_synonym[i] = 1
-                        s2_token_synonym[j] = 1
-                    #TODO: add synonym
+            (s1_token_exact_match, s2_token_exact_match,
+             s1_token_antonym, s2_token_antonym,
+             s1_token_synonym, s2_token_synonym) = (flags.astype(int).tolist() for flags in relation_index.match(s1_tokenize, s2_tokenize))
             
             content = {}
 
@@ -200,41 +149,121 @@ def worker(dataset):
 def partition(x, n):
     return ([i for i in islice(x,j,j+n)] for j in range(0,len(x),n))
 
+def chunked(x, n):
+    x = iter(x)
+    while True:
+        chunk = list(islice(x, n))
+        if not chunk:
+            return
+        yield chunk
 
-shared_files = [
-    "DIIN/data/multinli_0.9/shared_dev_matched.json",
-    "DIIN/data/multinli_0.9/shared_dev_mismatched.json",
-    "DIIN/data/multinli_0.9/shared_train.json",
-]
+def bounded(x, sem, stop):
+    #Pool.imap* drains its input eagerly; block the feeder until results are consumed,
+    #and end it once `stop` is set
+    for i in x:
+        sem.acquire()
+        if stop.is_set():
+            return
+        yield i
 
-data_files = [
-    "./DIIN/data/multinli_0.9/multinli_0.9_dev_matched.jsonl",
-    "./DIIN/data/multinli_0.9/multinli_0.9_dev_mismatched.jsonl",
-    "./DIIN/data/multinli_0.9/multinli_0.9_train.jsonl",
-]
+def done_pairs(path):
+    """pairIDs already written to `path`. Only the last line can be cut off by
+    a crash, so only a broken last line is truncated away; a broken line before
+    it means the file is damaged and is an error."""
+    done = set()
+    if not os.path.isfile(path):
+        return done
 
-fsize = [500, 500, 10000]
+    good = 0
+    with open(path, "rb+") as f:
+        for i, l in enumerate(f):
+            try:
+                if not l.endswith(b"\n"):
+                    raise ValueError("incomplete line")
+                pairID, content = l.decode("utf-8").split(" ", 1)
+                json.loads(content)
+            except ValueError:
+                if f.read(1):
+                    raise ValueError(f"{path}:{i+1} is malformed")
+                f.truncate(good)
+                break
+            done.add(pairID)
+            good += len(l)
+    return done
 
-p = mp.Pool(8)
+def publish(sf, partial):
+    """replace `sf` by `sf` + `partial` in one rename, so readers never see a
+    half-written file"""
+    tmp = f"{sf}.tmp"
+    with open(tmp, "wb") as out:
+        for path in (sf, partial):
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    shutil.copyfileobj(f, out)
+    os.replace(tmp, sf)
+    os.remove(partial)
 
-for sf, df, fs in zip(shared_files, data_files, fsize):
-    print(f"processing {df}...")
-    dataset = load_nli_data(df)
-    shared = {k:v for d in p.map(worker, partition(dataset, fs)) for k,v in d.items()}
-    with open(sf, "w") as f:
-        for k in shared:
-            f.write(f"{k} {json.dumps(shared[k])}\n")
-    
-print("done")
-            
-# dataset = load_nli_data("./DIIN/data/multinli_0.9/multinli_0.9_train.jsonl")#TODO: path
-# p = mp.Pool(10)
-# shared = {k:v for d in p.map(worker, partition(dataset, 10000)) for k,v in d.items()}
+def generate(sf, df, chunk_size, num_workers=8):
+    """compute shared content for the pairIDs of `df` missing from `sf` and add
+    them, so new data or an interrupted run only costs the delta. New pairs go
+    to `sf`.partial first and are published together at the end."""
+    partial = f"{sf}.partial"
+    done = done_pairs(sf) | done_pairs(partial)
+    if done:
+        print(f"{sf} already has {len(done)} pairs, computing the rest")
+
+    sem = threading.Semaphore(2 * num_workers)
+    stop = threading.Event()
+    with mp.Pool(num_workers) as p, open(partial, "a") as f:
+        chunks = bounded(chunked(iter_nli_data(df, skip=done), chunk_size), sem, stop)
+        try:
+            for shared in p.imap_unordered(worker, chunks):
+                for k, v in shared.items():
+                    f.write(f"{k} {json.dumps(v)}\n")
+                f.flush()
+                sem.release()
+        finally:
+            #on a worker error Pool.__exit__ terminates the pool, which joins the
+            #feeder thread; wake it up if it is waiting in bounded() so it can end
+            stop.set()
+            sem.release()
+
+    publish(sf, partial)
+
+
+if __name__ == "__main__":
+    nltk.download('wordnet')
+
+    shared_files = [
+        "DIIN/data/multinli_0.9/shared_dev_matched.json",
+        "DIIN/data/multinli_0.9/shared_dev_mismatched.json",
+        "DIIN/data/multinli_0.9/shared_train.json",
+    ]
+
+    data_files = [
+        "./DIIN/data/multinli_0.9/multinli_0.9_dev_matched.jsonl",
+        "./DIIN/data/multinli_0.9/multinli_0.9_dev_mismatched.jsonl",
+        "./DIIN/data/multinli_0.9/multinli_0.9_train.jsonl",
+    ]
+
+    fsize = [500, 500, 10000]
+
+    num_workers = 8
+
+    #memory-mapped copy of the shared files (see dataset.load_shared_content), None to skip
+    shared_store = None
+
+    relation_file = "DIIN/data/multinli_0.9/relations.pkl"
+
+    #build the wordnet index and its tables once, before forking, so every worker shares them
+    relation_index = RelationIndex.cached(relation_file, vocabulary(data_files))
+    relation_index.tables()
+
+    for sf, df, fs in zip(shared_files, data_files, fsize):
+        print(f"processing {df}...")
+        generate(sf, df, fs, num_workers)
 
-# #save to file
-# #TODO: 
-# with open("./DIIN/data/multinli_0.9/shared.json", "w") as f:
-#     for k in shared:
-#         f.write(f"{k} {json.dumps(shared[k])}")
+    if shared_store:
+        update_shared_content(shared_store, shared_files)
 
-        
+    print("done")
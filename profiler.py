@@ -0,0 +1,143 @@
+import os
+import json
+from time import time
+from fnmatch import fnmatch
+from collections import defaultdict
+
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+from util import tprint
+
+
+#(label, patterns matched against each part of an op's name), first match wins;
+#"input" is the time a step blocks on IteratorGetNext, i.e. the py_func pipeline
+SCOPES = [("input", ["IteratorGetNext*"]),
+          ("word_embedding", ["word_embedding"]),
+          ("char_embedding/conv", ["char_embedding"]),
+          ("pos_embedding", ["pos_embedding"]),
+          ("capsule", ["capsule_*"]),
+          ("highway", ["*_highway*"]),
+          ("attention", ["*_atten", "*_atten_*", "trilinear_attention*", "multihead_attention*", "*_multihead_attention"]),
+          ("rnn", ["rnn", "rnn_*"]),
+          ("optimizer", ["Adam*", "beta?_power*", "clip_by_global_norm"])]
+
+
+def scope_of(name):
+    """(scope label, backward) of an op name; gradient ops count under the scope
+    of the forward op they differentiate"""
+    parts = name.split("/")
+    backward = parts[0] == "gradients" or parts[0].startswith("gradients_")
+    if backward:
+        parts = parts[1:]
+    for label, patterns in SCOPES:
+        if any(fnmatch(p, pat) for p in parts for pat in patterns):
+            return label, backward
+    return "other", backward
+
+def op_devices(step_stats):
+    """device stats to count: on GPU the kernels' real time is on /stream:all,
+    so the per-stream and launch-side entries are left out"""
+    devices = [d.device for d in step_stats.dev_stats]
+    streams = any("stream:all" in d for d in devices)
+    for d in step_stats.dev_stats:
+        if "stream:" in d.device and "stream:all" not in d.device:
+            continue
+        if streams and "GPU" in d.device and "stream:" not in d.device:
+            continue
+        yield d
+
+def allocated_bytes(node):
+    return sum(o.tensor_description.allocation_description.allocated_bytes for o in node.output)
+
+
+class StepProfiler:
+    """Opt-in step profiler for the training loop.
+
+    `run(fetches)` is sess.run; with an `out_dir` every `every`-th step (after
+    `skip` warm-up steps) is run with a full trace instead. Each traced step's
+    op time and output allocations are aggregated per SCOPES entry, forward
+    and backward separately, and up to `max_traces` of them are written as
+    Chrome traces (open in chrome://tracing). `report()` prints the table and
+    writes it to summary.json. Without an `out_dir` it costs nothing.
+    """
+    def __init__(self, sess, out_dir=None, every=100, skip=10, max_traces=5):
+        self.sess = sess
+        self.out_dir = out_dir
+        self.every = every
+        self.skip = skip
+        self.max_traces = max_traces
+        self.step = 0
+        self.traced = 0
+        self.step_time = [0., 0] #untraced seconds, steps
+        self.traced_time = 0.
+        self.op_time = defaultdict(float) #(scope, backward) -> micros
+        self.op_bytes = defaultdict(int)  #(scope, backward) -> bytes
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+
+    def sampled(self):
+        return self.out_dir and self.step >= self.skip and (self.step - self.skip) % self.every == 0
+
+    def run(self, fetches, feed_dict=None):
+        self.step += 1
+        if not self.out_dir:
+            return self.sess.run(fetches, feed_dict)
+
+        st = time()
+        if not self.sampled():
+            result = self.sess.run(fetches, feed_dict)
+            self.step_time[0] += time() - st
+            self.step_time[1] += 1
+            return result
+
+        options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+        metadata = tf.RunMetadata()
+        result = self.sess.run(fetches, feed_dict, options=options, run_metadata=metadata)
+        self.traced_time += time() - st
+        self.add(metadata.step_stats)
+        return result
+
+    def add(self, step_stats):
+        for device in op_devices(step_stats):
+            for node in device.node_stats:
+                key = scope_of(node.node_name)
+                self.op_time[key] += node.all_end_rel_micros
+                self.op_bytes[key] += allocated_bytes(node)
+
+        if self.traced < self.max_traces:
+            trace = timeline.Timeline(step_stats).generate_chrome_trace_format(show_memory=True)
+            with open(os.path.join(self.out_dir, f"timeline_step{self.step}.json"), "w") as f:
+                f.write(trace)
+        self.traced += 1
+
+    def summary(self):
+        total = sum(self.op_time.values()) or 1.
+        traced = max(self.traced, 1)
+        rows = []
+        for label in [l for l, _ in SCOPES] + ["other"]:
+            fwd, bwd = self.op_time[(label, False)], self.op_time[(label, True)]
+            rows.append({"scope": label,
+                         "forward_ms": fwd / traced / 1000.,
+                         "backward_ms": bwd / traced / 1000.,
+                         "share": (fwd + bwd) / total,
+                         "alloc_mb": (self.op_bytes[(label, False)] + self.op_bytes[(label, True)]) / traced / 2**20})
+        return {"steps": self.step,
+                "traced_steps": self.traced,
+                "step_ms": self.step_time[0] / max(self.step_time[1], 1) * 1000.,
+                "traced_step_ms": self.traced_time / traced * 1000.,
+                "scopes": sorted(rows, key=lambda r: -r["share"])}
+
+    def report(self, name=""):
+        if not self.out_dir or not self.traced:
+            return None
+        s = self.summary()
+        tprint(f"{name}> profiled {s['traced_steps']} of {s['steps']} steps, "
+               f"{s['step_ms']:.1f} ms/step ({s['traced_step_ms']:.1f} ms traced)")
+        print(f"{'scope':<20}{'fwd ms':>10}{'bwd ms':>10}{'share':>8}{'alloc MB':>10}")
+        for r in s["scopes"]:
+            print(f"{r['scope']:<20}{r['forward_ms']:>10.2f}{r['backward_ms']:>10.2f}"
+                  f"{r['share']*100:>7.1f}%{r['alloc_mb']:>10.1f}")
+        with open(os.path.join(self.out_dir, "summary.json"), "w") as f:
+            json.dump(s, f, indent=1)
+        return s
@@ -0,0 +1,249 @@
+import os
+import json
+import shutil
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.framework import tensor_util
+
+from export import FrozenPredictor, GRAPH_FILE, META_FILE, placeholder_node, write_graph
+from inference import LABELS
+from dataset import load_shared_content
+from util import tprint
+
+
+GATHER_OPS = ("Gather", "GatherV2")
+WEIGHT_MODES = ("int8", "fp16", None)
+
+
+def base_name(name):
+    return name.lstrip("^").split(":")[0]
+
+def consumers(graph_def):
+    """node name -> [(consumer node, input position)]"""
+    out = {}
+    for n in graph_def.node:
+        for i, x in enumerate(n.input):
+            out.setdefault(base_name(x), []).append((n, i))
+    return out
+
+def drop_nodes(graph_def, names):
+    """remove the nodes `names` and the colocation constraints that name them
+    (embedding_lookup colocates its ops with the table)"""
+    locations = {f"loc:@{name}".encode("utf-8") for name in names}
+    nodes = [n for n in graph_def.node if n.name not in names]
+    for n in nodes:
+        if "_class" in n.attr:
+            kept = [c for c in n.attr["_class"].list.s if c not in locations]
+            if kept:
+                del n.attr["_class"].list.s[:]
+                n.attr["_class"].list.s.extend(kept)
+            else:
+                del n.attr["_class"]
+    del graph_def.node[:]
+    graph_def.node.extend(nodes)
+    return graph_def
+
+def const_node(name, value):
+    n = tf.NodeDef(name=name, op="Const")
+    n.attr["dtype"].type = tf.as_dtype(value.dtype).as_datatype_enum
+    n.attr["value"].tensor.CopyFrom(tensor_util.make_tensor_proto(value))
+    return n
+
+def cast_node(name, x, src, dst):
+    n = tf.NodeDef(name=name, op="Cast", input=[x])
+    n.attr["SrcT"].type = src.as_datatype_enum
+    n.attr["DstT"].type = dst.as_datatype_enum
+    return n
+
+def mul_node(name, x, y):
+    n = tf.NodeDef(name=name, op="Mul", input=[x, y])
+    n.attr["T"].type = tf.float32.as_datatype_enum
+    return n
+
+def quantize_int8(w, axis):
+    """symmetric int8 with one scale per slice along `axis` (kept as a size-1 dim)"""
+    scale = np.max(np.abs(w), axis=axis, keepdims=True) / 127.
+    scale[scale == 0] = 1.
+    return np.clip(np.round(w / scale), -127, 127).astype(np.int8), scale.astype(np.float32)
+
+def is_float_const(n):
+    return n.op == "Const" and n.attr["dtype"].type == tf.float32.as_datatype_enum
+
+def rewrite_embedding(n, table, gathers, node=const_node):
+    """per-row int8 table; every gather reads int8 rows and their scales and
+    dequantizes only the gathered rows, under its original name. `node(name,
+    value)` makes the int8 and scale nodes: constants, or placeholders for
+    tables kept outside the graph. Returns the new nodes and the two arrays."""
+    q, scale = quantize_int8(table, axis=1)
+    nodes = [node(f"{n.name}/int8", q), node(f"{n.name}/scale", scale)]
+    for g, _ in gathers:
+        ids = list(g.input[1:])
+        gq = tf.NodeDef(name=f"{g.name}/int8", op=g.op, input=[f"{n.name}/int8"] + ids)
+        gs = tf.NodeDef(name=f"{g.name}/scale", op=g.op, input=[f"{n.name}/scale"] + ids)
+        for x in (gq, gs):
+            for k, v in g.attr.items():
+                x.attr[k].CopyFrom(v)
+        gq.attr["Tparams"].type = tf.int8.as_datatype_enum
+        nodes += [gq, gs, cast_node(f"{g.name}/dequantize", gq.name, tf.int8, tf.float32)]
+        g.CopyFrom(mul_node(g.name, f"{g.name}/dequantize", gs.name))
+    return nodes, (q, scale)
+
+def rewrite_weight(n, w, mode, transpose_b):
+    """int8 (one scale per output unit) or float16 copy of a matmul weight,
+    cast back to float under the original name"""
+    if mode == "fp16":
+        nodes = [const_node(f"{n.name}/fp16", w.astype(np.float16))]
+        n.CopyFrom(cast_node(n.name, f"{n.name}/fp16", tf.float16, tf.float32))
+        return nodes
+
+    q, scale = quantize_int8(w, axis=1 if transpose_b else 0)
+    nodes = [const_node(f"{n.name}/int8", q),
+             const_node(f"{n.name}/scale", scale),
+             cast_node(f"{n.name}/dequantize", f"{n.name}/int8", tf.int8, tf.float32)]
+    n.CopyFrom(mul_node(n.name, f"{n.name}/dequantize", f"{n.name}/scale"))
+    return nodes
+
+def quantize_graph(graph_def, weights="int8", embeddings=True, min_elements=4096):
+    """rewrite the large float constants of a frozen GraphDef:
+
+    embeddings -- tables only read by Gather ops become per-row int8
+    weights    -- 2-D matrices only read as MatMul weights become "int8"
+                  (per output unit) or "fp16"; None keeps them float
+    Returns the new GraphDef and a {node: (kind, float bytes, new bytes)} summary.
+    """
+    if weights not in WEIGHT_MODES:
+        raise ValueError(f"weights must be one of {WEIGHT_MODES}, not {weights!r}")
+
+    graph_def = tf.GraphDef.FromString(graph_def.SerializeToString())
+    users = consumers(graph_def)
+    added = []
+    summary = {}
+    for n in list(graph_def.node):
+        if not is_float_const(n):
+            continue
+        w = tensor_util.MakeNdarray(n.attr["value"].tensor)
+        uses = users.get(n.name, [])
+        if w.ndim != 2 or w.size < min_elements or not uses:
+            continue
+
+        if embeddings and gathered_only(uses):
+            new, _ = rewrite_embedding(n, w, uses)
+            kind = "embedding int8"
+        elif weights and all(u.op == "MatMul" and i == 1 for u, i in uses):
+            transpose_b = {u.attr["transpose_b"].b for u, _ in uses}
+            if len(transpose_b) != 1:
+                continue
+            new = rewrite_weight(n, w, weights, transpose_b.pop())
+            kind = f"weight {weights}"
+        else:
+            continue
+
+        added += new
+        summary[n.name] = (kind, w.nbytes, sum(tensor_util.MakeNdarray(x.attr["value"].tensor).nbytes
+                                              for x in new if x.op == "Const"))
+
+    #the embedding tables themselves are no longer read
+    dropped = {name for name, (kind, _, _) in summary.items() if kind.startswith("embedding")}
+    graph_def.node.extend(added)
+    return drop_nodes(graph_def, dropped), summary
+
+def gathered_only(uses):
+    return uses and all(u.op in GATHER_OPS and i == 0 for u, i in uses)
+
+def quantize_tables(graph_def, meta, src, dst):
+    """per-row int8 copies of the tables export keeps outside the graph
+    (meta["tables"]); each one's placeholder is replaced by an int8 and a
+    scale placeholder, loaded from their own .npy files"""
+    users = consumers(graph_def)
+    tables = {}
+    summary = {}
+    dropped = set()
+    for tensor, filename in meta.get("tables", {}).items():
+        name = base_name(tensor)
+        uses = users.get(name, [])
+        if not gathered_only(uses):
+            tables[tensor] = filename
+            continue
+        n = next(x for x in graph_def.node if x.name == name)
+        table = np.load(os.path.join(src, filename), mmap_mode="r")
+        new, (q, scale) = rewrite_embedding(n, table, uses,
+                                            node=lambda key, v: placeholder_node(key, v.dtype, v.shape))
+        stem = os.path.splitext(filename)[0]
+        for x, suffix, value in zip(new, ("int8", "scale"), (q, scale)):
+            np.save(os.path.join(dst, f"{stem}_{suffix}.npy"), value)
+            tables[f"{x.name}:0"] = f"{stem}_{suffix}.npy"
+        os.remove(os.path.join(dst, filename))
+        graph_def.node.extend(new)
+        dropped.add(name)
+        summary[name] = ("table int8", table.nbytes, q.nbytes + scale.nbytes)
+
+    return drop_nodes(graph_def, dropped), dict(meta, tables=tables), summary
+
+def quantize_export(src, dst, weights="int8", embeddings=True, min_elements=4096):
+    """copy the export directory `src` to `dst` with a quantized graph.pb (and
+    word table)"""
+    shutil.copytree(src, dst, dirs_exist_ok=True)
+    graph_def = tf.GraphDef()
+    with open(os.path.join(src, GRAPH_FILE), "rb") as f:
+        graph_def.ParseFromString(f.read())
+    with open(os.path.join(src, META_FILE), "r") as f:
+        meta = json.load(f)
+
+    graph_def, summary = quantize_graph(graph_def, weights, embeddings, min_elements)
+    if embeddings:
+        graph_def, meta, tables = quantize_tables(graph_def, meta, src, dst)
+        summary.update(tables)
+    #folded, each dequantized weight would be a float32 constant again
+    meta = dict(meta, fold_constants=False)
+    write_graph(graph_def, os.path.join(dst, GRAPH_FILE))
+    with open(os.path.join(dst, META_FILE), "w") as f:
+        json.dump(meta, f)
+
+    before = sum(b for _, b, _ in summary.values())
+    after = sum(a for _, _, a in summary.values())
+    tprint(f"quantized {len(summary)} tensors: {before / 2**20:.1f}MB -> {after / 2**20:.1f}MB")
+    return summary
+
+
+def read_examples(filename):
+    with open(filename, "r") as f:
+        pairs = [json.loads(l) for l in f]
+    return [p for p in pairs if p["gold_label"] in LABELS]
+
+def accuracy_report(float_dir, quant_dir, files, **kwargs):
+    """accuracy of the float and quantized exports on each file, their delta,
+    how often they agree and the largest probability change"""
+    ref = FrozenPredictor(float_dir, **kwargs)
+    quant = FrozenPredictor(quant_dir, **kwargs)
+    report = {}
+    for name, filename in files.items():
+        pairs = read_examples(filename)
+        gold = np.array([LABELS.index(p["gold_label"]) for p in pairs])
+        p_ref = ref.predict(pairs)
+        p_quant = quant.predict(pairs)
+        acc_ref = float(np.mean(p_ref.argmax(-1) == gold))
+        acc_quant = float(np.mean(p_quant.argmax(-1) == gold))
+        report[name] = {"examples": len(pairs),
+                        "accuracy": acc_ref,
+                        "quantized_accuracy": acc_quant,
+                        "delta": acc_quant - acc_ref,
+                        "agreement": float(np.mean(p_ref.argmax(-1) == p_quant.argmax(-1))),
+                        "max_prob_diff": float(np.max(np.abs(p_ref - p_quant))) if len(pairs) else 0.}
+        tprint(f"{name}> " + ", ".join(f"{k}:{v}" for k, v in report[name].items()))
+    return report
+
+
+if __name__ == "__main__":
+    ######parameters
+    export_dir = "export/cap+hinge+pos-abs"
+    weights = "int8" #"int8", "fp16" or None
+    embeddings = True #per-row int8 word embedding
+    shared_store = None
+    dev_files = {"dev_matched": "./DIIN/data/multinli_0.9/multinli_0.9_dev_matched_clean.jsonl",
+                 "dev_mismatched": "./DIIN/data/multinli_0.9/multinli_0.9_dev_mismatched_clean.jsonl"}
+    ##############################
+
+    quant_dir = f"{export_dir}-{weights or 'float'}{'-emb8' if embeddings else ''}"
+    quantize_export(export_dir, quant_dir, weights, embeddings)
+    accuracy_report(export_dir, quant_dir, dev_files, sc=load_shared_content(shared_store))
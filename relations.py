@@ -0,0 +1,220 @@
+import os
+import pickle
+import itertools
+from functools import lru_cache
+
+import numpy as np
+import nltk
+from nltk.corpus import wordnet as wn
+from tqdm import tqdm
+
+from util import tprint
+
+
+stemmer = nltk.SnowballStemmer('english')
+
+NEGATIONS = {("n't", "not"), ("not", "n't")}
+
+#bounded, so a long-running server matching unseen tokens doesn't grow without limit;
+#large enough to hold the MNLI vocabulary and its WordNet lemmas
+CACHE_SIZE = 1 << 18
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def stem(w):
+    return stemmer.stem(w)
+
+@lru_cache(maxsize=CACHE_SIZE)
+def synsets(w):
+    return tuple(wn.synsets(w))
+
+@lru_cache(maxsize=CACHE_SIZE)
+def lemma_relations(lemma):
+    """stemmed synonym and antonym names over every synset of `lemma`"""
+    synonyms = set()
+    antonyms = set()
+    for syn in synsets(lemma):
+        for l in syn.lemmas():
+            synonyms.add(stem(l.name()))
+            antonyms.update(stem(a.name()) for a in l.antonyms())
+    return frozenset(synonyms), frozenset(antonyms)
+
+def token_relations(token):
+    """(exact, synonym, antonym) stem sets a token1 stem is checked against, for token2 = `token`"""
+    exact = {stem(token)}
+    synonyms = set()
+    antonyms = set()
+    for syn in synsets(token):
+        for lemma in syn.lemma_names():
+            exact.add(stem(lemma))
+            s, a = lemma_relations(lemma)
+            synonyms |= s
+            antonyms |= a
+    return frozenset(exact), frozenset(synonyms), frozenset(antonyms)
+
+def reduce_flags(exact, antonym, synonym):
+    """[len1, len2] relation matrices -> (s1_exact, s2_exact, s1_antonym, s2_antonym, s1_synonym, s2_synonym)"""
+    return (exact.any(1), exact.any(0),
+            antonym.any(1), antonym.any(0),
+            synonym.any(1), synonym.any(0))
+
+
+class RelationIndex:
+    """WordNet relations per lowercased token, computed once and then reused.
+
+    The pairwise checks answer exactly like the original `is_exact_match`,
+    `is_synonyms` and `is_antonyms` of para_pre.py, but as set lookups.
+    """
+    def __init__(self, relations=None):
+        self.relations = relations or {}
+        self._tables = None
+
+    def __len__(self):
+        return len(self.relations)
+
+    def lookup(self, token):
+        """relations of `token`, adding it to the index (and so invalidating the
+        tables) if it is new; only build() grows the index"""
+        token = token.lower()
+        r = self.relations.get(token)
+        if r is None:
+            r = self.relations[token] = token_relations(token)
+            self._tables = None
+        return r
+
+    def relations_of(self, token):
+        """relations of `token` without adding it to the index"""
+        token = token.lower()
+        return self.relations.get(token) or token_relations(token)
+
+    def build(self, vocab):
+        tprint("building wordnet relation index")
+        for w in tqdm(vocab):
+            self.lookup(w)
+        return self
+
+    def is_exact_match(self, token1, token2):
+        token1 = token1.lower()
+        token2 = token2.lower()
+        return token1 == token2 or (token1, token2) in NEGATIONS or stem(token1) in self.relations_of(token2)[0]
+
+    def is_synonyms(self, token1, token2):
+        return stem(token1.lower()) in self.relations_of(token2)[1]
+
+    def is_antonyms(self, token1, token2):
+        return stem(token1.lower()) in self.relations_of(token2)[2]
+
+    def tables(self):
+        """vocab-id view of the index: token ids, stem ids and, per relation,
+        the sorted keys token2_id * n_stems + stem1_id of every related pair"""
+        if self._tables is None:
+            token_ids = {t:i for i, t in enumerate(self.relations)}
+            stems = set()
+            for r in self.relations.values():
+                for rel in r:
+                    stems |= rel
+            stem_ids = {s:i for i, s in enumerate(stems)}
+            n = len(stem_ids)
+            keys = [np.sort(np.array([token_ids[t] * n + stem_ids[s]
+                                      for t, r in self.relations.items() for s in r[k]], dtype=np.int64))
+                    for k in range(3)]
+            self._tables = (token_ids, stem_ids, n, keys)
+        return self._tables
+
+    def encode(self, tokens):
+        """(token ids, stem ids) of an already looked-up sentence; stems unrelated
+        to any indexed token get -1"""
+        token_ids, stem_ids, _, _ = self.tables()
+        tokens = [t.lower() for t in tokens]
+        return (np.array([token_ids[t] for t in tokens], dtype=np.int64),
+                np.array([stem_ids.get(stem(t), -1) for t in tokens], dtype=np.int64))
+
+    def pair_keys(self, s1_tokens, s2_tokens):
+        """[len1, len2] relation keys of every (s1 token, s2 token) pair, and the pairs
+        that can never match"""
+        _, s1_stems = self.encode(s1_tokens)
+        s2_ids, _ = self.encode(s2_tokens)
+        n = self.tables()[2]
+        keys = s2_ids[None, :] * n + s1_stems[:, None]
+        return keys, np.broadcast_to(s1_stems[:, None] < 0, keys.shape)
+
+    def negations(self, s1_tokens, s2_tokens):
+        s1 = np.array([t.lower() for t in s1_tokens], dtype=object)
+        s2 = np.array([t.lower() for t in s2_tokens], dtype=object)
+        neg = np.zeros((len(s1), len(s2)), dtype=bool)
+        for t1, t2 in NEGATIONS:
+            neg |= (s1 == t1)[:, None] & (s2 == t2)[None, :]
+        return neg
+
+    def match(self, s1_tokens, s2_tokens):
+        return self.match_batch([(s1_tokens, s2_tokens)])[0]
+
+    def match_batch(self, pairs):
+        """exact-match, antonym and synonym flags for a list of (s1 tokens, s2 tokens).
+
+        Every token pair of every sentence pair is looked up with one searchsorted
+        per relation, and the [len1, len2] boolean matrices are reduced along rows
+        (s1 flags) and columns (s2 flags). Returns, per pair, the tuple
+        (s1_exact, s2_exact, s1_antonym, s2_antonym, s1_synonym, s2_synonym).
+        Pairs with a token the index lacks go through match_unindexed, so the
+        tables are never rebuilt for them.
+        """
+        indexed = [all(t in self for t in itertools.chain(s1, s2)) for s1, s2 in pairs]
+        fast = iter(self.match_indexed([p for p, ok in zip(pairs, indexed) if ok]))
+        return [next(fast) if ok else self.match_unindexed(*p) for p, ok in zip(pairs, indexed)]
+
+    def match_indexed(self, pairs):
+        pair_keys = [self.pair_keys(s1, s2) for s1, s2 in pairs]
+        keys = np.concatenate([k.ravel() for k, _ in pair_keys]) if pairs else np.zeros(0, dtype=np.int64)
+        invalid = np.concatenate([v.ravel() for _, v in pair_keys]) if pairs else np.zeros(0, dtype=bool)
+        tables = self.tables()[3]
+
+        found = []
+        for table in tables:
+            i = np.minimum(np.searchsorted(table, keys), max(len(table) - 1, 0))
+            hit = table[i] == keys if len(table) else np.zeros(len(keys), dtype=bool)
+            found.append(hit & ~invalid)
+
+        results = []
+        offset = 0
+        for (s1, s2), (k, _) in zip(pairs, pair_keys):
+            exact, synonym, antonym = (f[offset:offset + k.size].reshape(k.shape) for f in found)
+            offset += k.size
+            results.append(reduce_flags(exact | self.negations(s1, s2), antonym, synonym))
+        return results
+
+    def __contains__(self, token):
+        return token.lower() in self.relations
+
+    def match_unindexed(self, s1_tokens, s2_tokens):
+        """match() without adding tokens to the index (which would rebuild its
+        tables); relations of unindexed tokens come from the memoized WordNet calls"""
+        s1 = [t.lower() for t in s1_tokens]
+        s2 = [t.lower() for t in s2_tokens]
+        rels = [self.relations_of(t) for t in s2]
+        stems = [stem(t) for t in s1]
+        shape = (len(s1), len(s2))
+        exact = np.array([[t1 == t2 or st in r[0] for t2, r in zip(s2, rels)]
+                          for t1, st in zip(s1, stems)], dtype=bool).reshape(shape)
+        synonym = np.array([[st in r[1] for r in rels] for st in stems], dtype=bool).reshape(shape)
+        antonym = np.array([[st in r[2] for r in rels] for st in stems], dtype=bool).reshape(shape)
+        return reduce_flags(exact | self.negations(s1_tokens, s2_tokens), antonym, synonym)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            pickle.dump(self.relations, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls(pickle.load(f))
+
+    @classmethod
+    def cached(cls, path, vocab):
+        """load the index at `path`, adding any `vocab` tokens it lacks"""
+        index = cls.load(path) if os.path.isfile(path) else cls()
+        size = len(index)
+        index.build(t for t in vocab if t.lower() not in index.relations)
+        if len(index) != size:
+            index.save(path)
+        return index
@@ -0,0 +1,212 @@
+import json
+import queue
+import threading
+from time import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from inference import Predictor, LABELS
+from features import FeatureService
+from dataset import DEFAULT_CHAR2IDX
+from util import tprint
+
+
+class Metrics:
+    """queue depth, batch-size histogram and latency percentiles of a MicroBatcher"""
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.batch_sizes = Counter()
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+
+    def record_batch(self, size, latencies, error=False):
+        with self.lock:
+            self.batch_sizes[size] += 1
+            self.latencies.extend(latencies)
+            self.requests += size
+            self.errors += size if error else 0
+
+    def snapshot(self, queue_depth):
+        with self.lock:
+            lat = np.array(self.latencies) * 1000.
+            return {"queue_depth": queue_depth,
+                    "requests": self.requests,
+                    "errors": self.errors,
+                    "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_sizes.items())},
+                    "latency_ms": {"p50": float(np.percentile(lat, 50)) if len(lat) else None,
+                                   "p99": float(np.percentile(lat, 99)) if len(lat) else None,
+                                   "window": len(lat)}}
+
+
+class MicroBatcher:
+    """Collects pairs from many threads into batches for one Predictor.
+
+    A batch closes when it has `max_batch` pairs or `max_wait` seconds after
+    its first pair arrived, whichever comes first, and runs on the single
+    worker thread that owns the session.
+    """
+    def __init__(self, predictor, max_batch=64, max_wait=0.005, max_queue=10000):
+        self.predictor = predictor
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue(max_queue)
+        self.metrics = Metrics()
+        self.worker = threading.Thread(target=self.loop, daemon=True)
+        self.worker.start()
+
+    def submit(self, pair):
+        """Future of the pair's [3] label probabilities; raises queue.Full when overloaded"""
+        future = Future()
+        self.queue.put_nowait((pair, future, time()))
+        return future
+
+    def predict(self, pairs, timeout=None):
+        futures = []
+        try:
+            for p in pairs:
+                futures.append(self.submit(p))
+            return [f.result(timeout) for f in futures]
+        finally:
+            #a rejected, failed or timed out request is answered as a whole;
+            #don't let the worker score its pairs still in the queue
+            for f in futures:
+                f.cancel()
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch:
+            wait = deadline - time()
+            try:
+                batch.append(self.queue.get(timeout=wait) if wait > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run_one(self, pair, future):
+        try:
+            future.set_result(self.predictor.predict([pair])[0])
+            return True
+        except Exception as e:
+            future.set_exception(e)
+            return False
+
+    def loop(self):
+        while True:
+            batch = [b for b in self.next_batch() if b[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            pairs, futures, starts = zip(*batch)
+            try:
+                probs = self.predictor.predict(pairs)
+            except Exception:
+                #one bad pair must not fail the others: score them one by one
+                for p, f, s in zip(pairs, futures, starts):
+                    ok = self.run_one(p, f)
+                    self.metrics.record_batch(1, [time() - s], error=not ok)
+                continue
+
+            end = time()
+            for f, p in zip(futures, probs):
+                f.set_result(p)
+            self.metrics.record_batch(len(batch), [end - s for s in starts])
+
+    def stats(self):
+        return self.metrics.snapshot(self.queue.qsize())
+
+
+MNLI_KEYS = ("sentence1_binary_parse", "sentence2_binary_parse", "sentence1_parse", "sentence2_parse")
+
+def read_pair(p):
+    if not isinstance(p, dict):
+        raise ValueError(f"a pair must be an object, not {type(p).__name__}")
+    keys = MNLI_KEYS if "sentence1_binary_parse" in p else ("premise", "hypothesis")
+    for k in keys:
+        if not isinstance(p.get(k), str) or not p[k].strip():
+            raise ValueError(f"{k} must be a non-empty string")
+    return p if keys is MNLI_KEYS else (p["premise"], p["hypothesis"])
+
+def read_pairs(body):
+    """{"premise", "hypothesis"}, or {"pairs": [...]} of such objects or MNLI json dicts"""
+    d = json.loads(body)
+    if not isinstance(d, dict):
+        raise ValueError("the body must be a json object")
+    items = d["pairs"] if "pairs" in d else [d]
+    if not isinstance(items, list) or not items:
+        raise ValueError("pairs must be a non-empty list")
+    return [read_pair(p) for p in items]
+
+
+class Handler(BaseHTTPRequestHandler):
+    batcher = None
+    timeout_s = 30
+
+    def reply(self, code, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self.reply(200, self.batcher.stats())
+        elif self.path == "/health":
+            self.reply(200, {"ok": True})
+        else:
+            self.reply(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            return self.reply(404, {"error": f"unknown path {self.path}"})
+        try:
+            pairs = read_pairs(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except (ValueError, KeyError, TypeError) as e:
+            return self.reply(400, {"error": f"bad request: {e}"})
+
+        try:
+            probs = self.batcher.predict(pairs, timeout=self.timeout_s)
+        except queue.Full:
+            return self.reply(503, {"error": "queue full"})
+        except ValueError as e:
+            return self.reply(400, {"error": f"bad pair: {e}"})
+        except Exception as e:
+            return self.reply(500, {"error": str(e)})
+
+        self.reply(200, {"labels": [LABELS[int(np.argmax(p))] for p in probs],
+                         "probabilities": [dict(zip(LABELS, map(float, p))) for p in probs]})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(batcher, host="127.0.0.1", port=8000):
+    handler = type("BoundHandler", (Handler,), {"batcher": batcher})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    tprint(f"serving on http://{host}:{port} (POST /predict, GET /metrics)")
+    httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    ######parameters
+    checkpoint = "model/cap+hinge+pos-abs"
+    variant = "chttvg+cap+"
+    glove_path = "glove.txt.gz"
+    char2idx = DEFAULT_CHAR2IDX #must be the training one; a store keeps it in meta["char2idx"]
+    relation_file = "DIIN/data/multinli_0.9/relations.pkl"
+    max_batch = 64
+    max_wait = 0.005 #seconds a pair may wait for its batch to fill
+    host = "127.0.0.1"
+    port = 8000
+    ##############################
+
+    predictor = Predictor.from_glove(checkpoint, variant, glove_path,
+                                     char2idx=char2idx,
+                                     features=FeatureService.load(relation_file),
+                                     batch_size=max_batch)
+    serve(MicroBatcher(predictor, max_batch=max_batch, max_wait=max_wait), host, port)
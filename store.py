@@ -0,0 +1,256 @@
+import os
+import json
+
+import numpy as np
+
+
+META_FILE = "meta.json"
+
+
+class ColumnWriter:
+    """Streams one column of a store to disk.
+
+    Ragged columns keep a `<name>_offsets.npy` next to the flat values so row i
+    is `values[offsets[i]:offsets[i+1]]`; fixed columns hold one value per row.
+    """
+    def __init__(self, path, name, dtype, inner_shape=(), ragged=True):
+        self.path = path
+        self.name = name
+        self.dtype = np.dtype(dtype)
+        self.inner_shape = tuple(inner_shape)
+        self.ragged = ragged
+        self.lengths = []
+        self.size = 0
+        self.f = open(os.path.join(path, f"{name}.bin"), "wb")
+
+    def append(self, x):
+        x = np.asarray(x, dtype=self.dtype)
+        if self.ragged:
+            x = x.reshape((-1,) + self.inner_shape)
+            self.lengths.append(len(x))
+            self.size += len(x)
+        else:
+            x = x.reshape(self.inner_shape)
+            self.size += 1
+        self.f.write(x.tobytes())
+
+    def close(self):
+        self.f.close()
+        if self.ragged:
+            offsets = np.zeros(len(self.lengths) + 1, dtype=np.int64)
+            np.cumsum(self.lengths, out=offsets[1:])
+            np.save(os.path.join(self.path, f"{self.name}_offsets.npy"), offsets)
+        return {"dtype": self.dtype.str,
+                "inner_shape": list(self.inner_shape),
+                "ragged": self.ragged,
+                "size": self.size}
+
+
+class Column:
+    def __init__(self, path, name, dtype, inner_shape, ragged, size):
+        shape = (size,) + tuple(inner_shape)
+        if size:
+            self.values = np.memmap(os.path.join(path, f"{name}.bin"), dtype=np.dtype(dtype), mode="r", shape=shape)
+        else:
+            self.values = np.zeros(shape, dtype=np.dtype(dtype))
+        self.offsets = np.load(os.path.join(path, f"{name}_offsets.npy"), mmap_mode="r") if ragged else None
+
+    def __len__(self):
+        return len(self.offsets) - 1 if self.offsets is not None else len(self.values)
+
+    def __getitem__(self, i):
+        if self.offsets is None:
+            return self.values[i]
+        return self.values[self.offsets[i]:self.offsets[i+1]]
+
+
+def write_store(path, columns, rows, meta=None):
+    """columns: [(name, dtype, inner_shape, ragged)], rows: iterable of tuples in column order."""
+    os.makedirs(path, exist_ok=True)
+    writers = [ColumnWriter(path, *c) for c in columns]
+    size = 0
+    for row in rows:
+        for w, x in zip(writers, row):
+            w.append(x)
+        size += 1
+
+    info = {"size": size,
+            "columns": [w.name for w in writers],
+            "arrays": {w.name: w.close() for w in writers},
+            "meta": meta or {}}
+    with open(os.path.join(path, META_FILE), "w") as f:
+        json.dump(info, f)
+    return info
+
+
+def read_meta(path):
+    with open(os.path.join(path, META_FILE), "r") as f:
+        return json.load(f)
+
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+class Store:
+    """Read-only, memory-mapped view of a store written by `write_store`.
+
+    Columns are opened on first access, so a Store can be created before
+    forking and the pages are shared between processes.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.info = read_meta(path)
+        self.meta = self.info["meta"]
+        self.names = self.info["columns"]
+        self._columns = None
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            self._columns = [Column(self.path, n, **self.info["arrays"][n]) for n in self.names]
+        return self._columns
+
+    def column(self, name):
+        return self.columns[self.names.index(name)]
+
+    def __len__(self):
+        return self.info["size"]
+
+    def __getitem__(self, i):
+        return tuple(c[i] for c in self.columns)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+KEYS_FILE = "keys.npy"
+ORDER_FILE = "order.npy"
+
+
+def write_keyed_store(path, columns, items, meta=None):
+    """like `write_store`, but rows come as (key, row) and can be looked up by key;
+    a repeated key maps to its last row, as it would in a dict"""
+    keys = []
+    def rows():
+        for k, row in items:
+            keys.append(k)
+            yield row
+
+    info = write_store(path, columns, rows(), meta=meta)
+    keys = np.array(keys, dtype=np.bytes_)
+    order = np.argsort(keys, kind="stable")
+    #stable sort puts a key's last row last in its run
+    last = np.append(keys[order][1:] != keys[order][:-1], True) if len(keys) else np.zeros(0, dtype=bool)
+    order = order[last]
+    np.save(os.path.join(path, KEYS_FILE), keys[order])
+    np.save(os.path.join(path, ORDER_FILE), order.astype(np.int64))
+    return info
+
+
+class KeyedStore(Store):
+    """Store whose rows are addressed by a string key (e.g. pairID).
+
+    The sorted key array is memory-mapped too, so lookups are a binary search
+    over shared pages rather than a per-process dict.
+    """
+    def __init__(self, path):
+        super().__init__(path)
+        self._keys = None
+        self._order = None
+
+    def _load_index(self):
+        if self._keys is None:
+            self._keys = np.load(os.path.join(self.path, KEYS_FILE), mmap_mode="r")
+            self._order = np.load(os.path.join(self.path, ORDER_FILE), mmap_mode="r")
+
+    def index(self, key):
+        self._load_index()
+        k = key.encode("utf-8") if isinstance(key, str) else key
+        i = np.searchsorted(self._keys, k)
+        if i < len(self._keys) and self._keys[i] == k:
+            return int(self._order[i])
+        return None
+
+    def __len__(self):
+        self._load_index()
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return self.index(key) is not None
+
+    def __iter__(self):
+        return self.keys()
+
+    def keys(self):
+        self._load_index()
+        return (k.decode("utf-8") for k in self._keys)
+
+    def items(self):
+        for k, i in zip(self.keys(), self._order):
+            yield k, dict(zip(self.names, super().__getitem__(int(i))))
+
+    def get(self, key, default=None):
+        i = self.index(key)
+        if i is None:
+            return default
+        return dict(zip(self.names, super().__getitem__(i)))
+
+    def __getitem__(self, key):
+        row = self.get(key)
+        if row is None:
+            raise KeyError(key)
+        return row
+
+
+SHARD_PREFIX = "shard-"
+
+
+class KeyedShards:
+    """KeyedStore split over `path` and its shard-NNNN subdirectories, so new
+    keys can be added as a new shard without rewriting the existing ones."""
+    def __init__(self, path):
+        self.path = path
+        self.shards = [KeyedStore(p) for p in shard_paths(path)]
+
+    def __len__(self):
+        return sum(len(s) for s in self.shards)
+
+    def __contains__(self, key):
+        return any(key in s for s in self.shards)
+
+    def __iter__(self):
+        return self.keys()
+
+    def keys(self):
+        for s in self.shards:
+            yield from s.keys()
+
+    def items(self):
+        for s in self.shards:
+            yield from s.items()
+
+    def get(self, key, default=None):
+        for s in self.shards:
+            row = s.get(key)
+            if row is not None:
+                return row
+        return default
+
+    def __getitem__(self, key):
+        row = self.get(key)
+        if row is None:
+            raise KeyError(key)
+        return row
+
+
+def shard_paths(path):
+    if not os.path.isdir(path):
+        return []
+    subdirs = sorted(os.path.join(path, d) for d in os.listdir(path) if d.startswith(SHARD_PREFIX))
+    return ([path] if is_store(path) else []) + [d for d in subdirs if is_store(d)]
+
+
+def next_shard(path):
+    return os.path.join(path, f"{SHARD_PREFIX}{len(shard_paths(path)):04d}")
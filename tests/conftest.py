@@ -0,0 +1,43 @@
+import types
+
+import numpy as np
+import pytest
+
+
+#small enough to build and run in a test
+TINY = dict(hidden_dim=16, num_heads=2, gru_units=8)
+TINY_VARIANT = "chttvg+cap+"
+WORDS = ["<PAD>", "<UNK>", "a", "man", "dog", "sleeps", "runs", "the", "is", "not", "."]
+
+
+def tiny_pair(premise, hypothesis, pairID=None):
+    """MNLI json dict of two space separated sentences, every token tagged NN"""
+    d = {"pairID": pairID}
+    for k, s in (("sentence1", premise), ("sentence2", hypothesis)):
+        d[f"{k}_binary_parse"] = s
+        d[f"{k}_parse"] = " ".join(f"(NN {w})" for w in s.split(" "))
+    return d
+
+
+@pytest.fixture(scope="session")
+def tiny_checkpoint(tmp_path_factory):
+    """checkpoint of an untrained TINY_VARIANT over WORDS, and its word2idx"""
+    tf = pytest.importorskip("tensorflow")
+    if not hasattr(tf, "placeholder"):
+        pytest.skip("the graph code needs the TensorFlow 1.x API")
+    from nn import init_feed_dict
+    from model import Model
+    from inference import Inputs
+    from dataset import DEFAULT_CHAR2IDX, DEFAULT_CHARPAD, POS2IDX
+
+    rng = np.random.RandomState(0)
+    embeddings = types.SimpleNamespace(embedding=rng.randn(len(WORDS), 12),
+                                       char_embedding=rng.randn(len(DEFAULT_CHAR2IDX), 8),
+                                       pos_embedding=rng.randn(len(POS2IDX), 10))
+    path = str(tmp_path_factory.mktemp("checkpoint") / "model")
+    with tf.Graph().as_default() as graph:
+        Model.variant(TINY_VARIANT, Inputs(DEFAULT_CHARPAD), embeddings, **TINY)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer(), init_feed_dict(graph))
+            tf.train.Saver().save(sess, path)
+    return path, {w:i for i, w in enumerate(WORDS)}
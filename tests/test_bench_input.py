@@ -0,0 +1,40 @@
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip("tensorflow")
+
+from dataset import SHARED_KEYS, decode_example, char2index
+from bench_input import synthetic_mnli, configs
+
+
+def test_synthetic_mnli(tmp_path):
+    path = str(tmp_path / "synthetic.jsonl")
+    word2idx, sc = synthetic_mnli(path, 50, vocab_size=100)
+    with open(path, "r") as f:
+        lines = f.readlines()
+
+    assert len(lines) == len(sc) == 50
+    for l in lines:
+        pairID = json.loads(l)["pairID"]
+        x = decode_example(l.encode("utf-8"),
+                           word2index=lambda w: word2idx[w],
+                           char2index=lambda w: char2index(w, pad=8),
+                           char_pad=8,
+                           sc=sc)
+        s1, s2 = x[0], x[1]
+        assert len(s1) and len(s2) and np.all(s1 > 1) and np.all(s2 > 1)
+        #side flags, chars and pos line up with the tokens
+        for k, flags in zip(SHARED_KEYS, x[3:9]):
+            assert len(flags) == len(s1 if k.startswith("sentence1") else s2)
+            assert flags.tolist() == sc[pairID][k]
+        assert x[9].shape == (len(s1), 8) and x[10].shape == (len(s2), 8)
+        assert len(x[11]) == len(s1) and len(x[12]) == len(s2)
+
+def test_configs():
+    base = {"batch": 128, "pad2": True}
+    sweep = {"batch": [32, 128], "pad2": [True, False]}
+    assert list(configs(base, sweep)) == [("base", base),
+                                          ("batch=32", {"batch": 32, "pad2": True}),
+                                          ("pad2=False", {"batch": 128, "pad2": False})]
@@ -0,0 +1,136 @@
+import os
+import gzip
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+pytest.importorskip("nltk")
+
+import dataset
+from dataset import padding_ratio, write_vocab, read_vocab, compile_glove, load_glove, prune_vocab
+
+
+def test_padding_ratio_without_buckets():
+    lengths = [(4, 1), (2, 2), (3, 3)]
+    #[(4, 1), (2, 2)] pads to 2 * (4 + 2), [(3, 3)] has no padding
+    assert padding_ratio(lengths, batch=2, pad2=False) == pytest.approx(1 - 15 / 18)
+    #pad2 pads both sentences to the longer one
+    assert padding_ratio(lengths, batch=2, pad2=True) == pytest.approx(1 - 15 / 22)
+    assert padding_ratio([], batch=2) == 0.
+
+def test_padding_ratio_bucket_edges():
+    #like bucket_by_sequence_length, boundaries [4, 8] make buckets [0, 4), [4, 8), [8, inf):
+    #a pair as long as a boundary goes to the bucket above it
+    lengths = [(4, 1), (3, 3), (4, 4), (7, 2), (8, 8)]
+    ratio = padding_ratio(lengths, batch=2, pad2=False, bucket_boundaries=[4, 8])
+    #batches [(4, 1), (4, 4)], then the partial buckets [(3, 3)], [(7, 2)], [(8, 8)]
+    assert ratio == pytest.approx(1 - 44 / 47)
+
+def test_padding_ratio_matches_tf_buckets():
+    if not hasattr(tf, "Session"):
+        pytest.skip("needs the TensorFlow 1.x API")
+    rng = np.random.RandomState(0)
+    lengths = [tuple(l) for l in rng.randint(1, 12, (200, 2))]
+    lengths += [(4, 4), (8, 1), (1, 12)]
+    boundaries, sizes = [4, 8, 12], [3, 5, 2, 4]
+
+    def pairs():
+        for l1, l2 in lengths:
+            yield np.ones(l1, dtype=np.int64), np.ones(l2, dtype=np.int64)
+    with tf.Graph().as_default():
+        D = tf.data.Dataset.from_generator(pairs, (tf.int64, tf.int64), ([None], [None]))
+        D = D.apply(tf.data.experimental.bucket_by_sequence_length(
+            lambda s1, s2: tf.cast(tf.maximum(tf.shape(s1)[0], tf.shape(s2)[0]), tf.int32),
+            boundaries, sizes))
+        s1, s2 = tf.data.make_one_shot_iterator(D).get_next()
+        real = total = 0
+        with tf.Session() as sess:
+            while True:
+                try:
+                    a, b = sess.run((s1, s2))
+                except tf.errors.OutOfRangeError:
+                    break
+                real += a.sum() + b.sum()
+                total += a.size + b.size
+
+    assert padding_ratio(lengths, pad2=False, bucket_boundaries=boundaries,
+                         bucket_batch_sizes=sizes) == pytest.approx(1 - real / total)
+
+
+def test_vocab_round_trip(tmp_path):
+    path = str(tmp_path / "vocab.txt")
+    #glove has tokens with "\r", spaces and unicode
+    words = ["<PAD>", "<UNK>", "the", "ru\rns", "\r", "new york", "caf\u00e9"]
+    write_vocab(path, words)
+    assert read_vocab(path) == words
+
+def glove_file(path, rows):
+    with gzip.open(path, "wb") as f:
+        for w, v in rows:
+            f.write((" ".join([w] + [str(x) for x in v]) + "\n").encode("utf-8"))
+
+GLOVE = [("the", [1., 2.]), ("ru\rns", [3., 4.]), ("new york", [5., 6.]), ("cat", [7., 8.])]
+
+def test_load_glove(tmp_path):
+    zfile = str(tmp_path / "glove.txt.gz")
+    glove_file(zfile, GLOVE)
+    word2idx, embedding = load_glove(zfile)
+    assert word2idx == {"<PAD>": 0, "<UNK>": 1, "the": 2, "ru\rns": 3, "new york": 4, "cat": 5}
+    np.testing.assert_array_equal(embedding, [[0, 0], [0, 0], [1, 2], [3, 4], [5, 6], [7, 8]])
+    assert embedding.dtype == np.float32
+
+    word2idx, embedding = load_glove(zfile, size=4)
+    assert list(word2idx) == ["<PAD>", "<UNK>", "the", "ru\rns"]
+    assert embedding.shape == (4, 2)
+
+def test_load_glove_reads_the_cache(tmp_path, monkeypatch):
+    zfile = str(tmp_path / "glove.txt.gz")
+    glove_file(zfile, GLOVE)
+    load_glove(zfile)
+    def compile_again(zfile, path):
+        raise AssertionError("compiled twice")
+    monkeypatch.setattr(dataset, "compile_glove", compile_again)
+    word2idx, embedding = load_glove(zfile)
+    assert word2idx["cat"] == 5
+    np.testing.assert_array_equal(embedding[5], [7, 8])
+
+def test_load_glove_vocab_mismatch(tmp_path):
+    zfile = str(tmp_path / "glove.txt.gz")
+    glove_file(zfile, GLOVE)
+    compile_glove(zfile, dataset.glove_cache_path(zfile))
+    vocab = os.path.join(dataset.glove_cache_path(zfile), dataset.GLOVE_VOCAB)
+    write_vocab(vocab, read_vocab(vocab)[:-1])
+    with pytest.raises(ValueError, match="recompile"):
+        load_glove(zfile)
+
+
+WORDS = ["<PAD>", "<UNK>", "the", "cat", "sat"]
+EMBEDDING = np.arange(10, dtype=np.float32).reshape(5, 2)
+
+def test_prune_vocab_unk():
+    word2idx, embedding = prune_vocab(WORDS, EMBEDDING, {"sat", "The", "dog", "<PAD>"}, oov="unk")
+    #"The" falls back to the row of "the"; "dog" is left to <UNK>
+    assert word2idx == {"<PAD>": 0, "<UNK>": 1, "The": 2, "sat": 3}
+    np.testing.assert_array_equal(embedding, EMBEDDING[[0, 1, 2, 4]])
+    assert embedding.dtype == np.float32
+
+def test_prune_vocab_random():
+    word2idx, embedding = prune_vocab(WORDS, EMBEDDING, {"sat", "The", "dog", "<UNK>"}, oov="random")
+    #<UNK> keeps row 1 rather than getting a random row as a missing word
+    assert word2idx == {"<PAD>": 0, "<UNK>": 1, "The": 2, "sat": 3, "dog": 4}
+    np.testing.assert_array_equal(embedding[:4], EMBEDDING[[0, 1, 2, 4]])
+    assert embedding.shape == (5, 2)
+    assert embedding.dtype == np.float32
+    assert np.any(embedding[4] != 0)
+
+def test_prune_vocab_rejects_policy():
+    with pytest.raises(ValueError, match="oov"):
+        prune_vocab(WORDS, EMBEDDING, {"the"}, oov="zero")
+
+def test_load_glove_pruned(tmp_path):
+    zfile = str(tmp_path / "glove.txt.gz")
+    glove_file(zfile, GLOVE)
+    word2idx, embedding = load_glove(zfile, vocab={"Cat", "ru\rns", "dog"})
+    assert word2idx == {"<PAD>": 0, "<UNK>": 1, "Cat": 2, "ru\rns": 3}
+    np.testing.assert_array_equal(embedding, [[0, 0], [0, 0], [7, 8], [3, 4]])
@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+if not hasattr(tf, "placeholder"):
+    pytest.skip("the graph code needs the TensorFlow 1.x API", allow_module_level=True)
+pytest.importorskip("tensorflow.tools.graph_transforms")
+
+import export
+from export import FrozenPredictor, export_frozen, read_word2idx, write_word2idx, write_graph
+from inference import Predictor
+from conftest import TINY, TINY_VARIANT, tiny_pair
+
+
+def test_word2idx_round_trip(tmp_path):
+    #gaps where glove had a word twice, and a token containing "\r"
+    word2idx = {"<PAD>": 0, "<UNK>": 1, "a": 3, "do\rg": 4, "new york": 7, "tab\tbed": 8}
+    path = str(tmp_path / "vocab.txt")
+    write_word2idx(path, word2idx)
+    assert read_word2idx(path) == word2idx
+
+def test_frozen_predictor_matches(tiny_checkpoint, tmp_path):
+    checkpoint, word2idx = tiny_checkpoint
+    word2idx = dict(word2idx)
+    del word2idx["runs"]
+    word2idx["ru\rns"] = 6
+    pairs = [tiny_pair("a man sleeps", "a man is not sleeping ."),
+             tiny_pair("the dog ru\rns", "a dog runs"),
+             tiny_pair("a man", "the man sleeps")]
+
+    predictor = Predictor(checkpoint, TINY_VARIANT, word2idx, **TINY)
+    try:
+        expected = predictor.predict(pairs)
+        export_frozen(predictor, str(tmp_path))
+    finally:
+        predictor.close()
+
+    frozen = FrozenPredictor(str(tmp_path))
+    try:
+        assert frozen.word2idx == word2idx
+        np.testing.assert_allclose(frozen.predict(pairs), expected, rtol=1e-5, atol=1e-6)
+    finally:
+        frozen.close()
+
+def test_write_graph_limit(tmp_path, monkeypatch):
+    graph_def = tf.GraphDef()
+    graph_def.node.add(name="x", op="NoOp")
+    monkeypatch.setattr(export, "MAX_GRAPH_BYTES", graph_def.ByteSize() - 1)
+    path = str(tmp_path / "graph.pb")
+    with pytest.raises(ValueError, match="2GB"):
+        write_graph(graph_def, path)
+    assert not os.path.exists(path)
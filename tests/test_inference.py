@@ -0,0 +1,71 @@
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip("tensorflow")
+pytest.importorskip("nltk")
+
+import inference
+from inference import Predictor, parse_pair
+from dataset import pos2index
+from conftest import TINY, TINY_VARIANT, tiny_pair
+
+
+def test_parse_pair_mnli():
+    pair = tiny_pair("a man sleeps", "the dog runs .", pairID="7e")
+    expected = (["a", "man", "sleeps"], ["the", "dog", "runs", "."],
+                [pos2index("NN")] * 3, [pos2index("NN")] * 4, "7e")
+    assert parse_pair(pair) == expected
+    assert parse_pair(json.dumps(pair)) == expected
+
+def test_parse_pair_empty():
+    with pytest.raises(ValueError):
+        parse_pair(tiny_pair("a man", ""))
+    with pytest.raises(ValueError):
+        parse_pair(tiny_pair("", "a man"))
+
+def test_nltk_checked_on_raw_pairs_only(monkeypatch):
+    def find(name):
+        raise LookupError(name)
+    monkeypatch.setattr(inference.nltk.data, "find", find)
+    monkeypatch.setattr(inference, "_nltk_checked", False)
+
+    parse_pair(tiny_pair("a man", "a dog"))
+    with pytest.raises(LookupError, match="nltk.download"):
+        parse_pair(("a man sleeps", "a dog runs"))
+
+
+def configured(batch_size, max_tokens):
+    p = Predictor.__new__(Predictor)
+    p.batch_size = batch_size
+    p.max_tokens = max_tokens
+    return p
+
+@pytest.mark.parametrize("batch_size,max_tokens", [(64, 4096), (3, 4096), (64, 12), (2, 5)])
+def test_batches(batch_size, max_tokens):
+    rng = np.random.RandomState(0)
+    examples = [(np.zeros(l1), np.zeros(l2)) for l1, l2 in rng.randint(1, 8, (40, 2))]
+    batches = list(configured(batch_size, max_tokens).batches(examples))
+
+    assert sorted(i for b in batches for i in b) == list(range(len(examples)))
+    for b in batches:
+        lengths = {(len(examples[i][0]), len(examples[i][1])) for i in b}
+        assert len(lengths) == 1
+        assert len(b) <= batch_size
+        #a single pair longer than max_tokens still gets its own batch
+        assert len(b) == 1 or len(b) * max(lengths.pop()) <= max_tokens
+
+def test_batched_scores_equal_single(tiny_checkpoint):
+    checkpoint, word2idx = tiny_checkpoint
+    pairs = [tiny_pair("a man sleeps", "a man is not sleeping ."),
+             tiny_pair("the dog runs", "a dog runs"),
+             tiny_pair("a man", "the man sleeps"),
+             tiny_pair("the dog is a dog", "a dog")]
+    predictor = Predictor(checkpoint, TINY_VARIANT, word2idx, **TINY)
+    try:
+        batched = predictor.predict(pairs)
+        single = np.concatenate([predictor.predict([p]) for p in pairs])
+    finally:
+        predictor.close()
+    np.testing.assert_allclose(batched, single, rtol=1e-5, atol=1e-6)
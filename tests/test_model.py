@@ -0,0 +1,98 @@
+import types
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+if not hasattr(tf, "placeholder"):
+    pytest.skip("the graph code needs the TensorFlow 1.x API", allow_module_level=True)
+
+from nn import init_feed_dict
+from model import Model, VARIANTS, checkpoint_saver
+
+
+CHAR_PAD = 16
+#premise flags, then hypothesis flags
+FLAGS1 = ("antonym1", "exact1to2", "synonym1")
+FLAGS2 = ("antonym2", "exact2to1", "synonym2")
+
+
+def placeholders():
+    x = types.SimpleNamespace(sentence1=tf.placeholder(tf.int64, (None, None)),
+                              sentence2=tf.placeholder(tf.int64, (None, None)),
+                              label=tf.placeholder(tf.int64, (None,)),
+                              sent1char=tf.placeholder(tf.int64, (None, None, CHAR_PAD)),
+                              sent2char=tf.placeholder(tf.int64, (None, None, CHAR_PAD)),
+                              pos1=tf.placeholder(tf.int64, (None, None)),
+                              pos2=tf.placeholder(tf.int64, (None, None)))
+    for k in FLAGS1 + FLAGS2:
+        setattr(x, k, tf.placeholder(tf.float32, (None, None)))
+    return x
+
+def batch(x, rng, lengths1=(6, 3), lengths2=(4, 2), pad2=False):
+    width = max(lengths1 + lengths2) if pad2 else None
+    def ids(lengths, high):
+        out = np.zeros((len(lengths), width or max(lengths)), dtype=np.int64)
+        for i, l in enumerate(lengths):
+            out[i, :l] = rng.randint(1, high, l)
+        return out
+    s1, s2 = ids(lengths1, 20), ids(lengths2, 20)
+    feed = {x.sentence1: s1, x.sentence2: s2,
+            x.label: rng.randint(0, 3, len(lengths1)),
+            x.sent1char: rng.randint(0, 30, s1.shape + (CHAR_PAD,)) * (s1[..., None] > 0),
+            x.sent2char: rng.randint(0, 30, s2.shape + (CHAR_PAD,)) * (s2[..., None] > 0),
+            x.pos1: ids(lengths1, 10), x.pos2: ids(lengths2, 10)}
+    for flags, s in ((FLAGS1, s1), (FLAGS2, s2)):
+        for k in flags:
+            feed[getattr(x, k)] = rng.randint(0, 2, s.shape).astype(np.float32) * (s > 0)
+    return feed
+
+
+@pytest.mark.parametrize("variant", sorted(VARIANTS))
+def test_variant_trains(variant):
+    rng = np.random.RandomState(0)
+    embeddings = types.SimpleNamespace(embedding=rng.randn(20, 12),
+                                       char_embedding=rng.randn(30, 8),
+                                       pos_embedding=rng.randn(10, 10))
+    with tf.Graph().as_default() as graph:
+        x = placeholders()
+        model = Model.variant(variant, x, embeddings, hidden_dim=16, num_heads=2, gru_units=8)
+        train_op = model.train_op(1e-3)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer(), init_feed_dict(graph))
+            #the joint interaction pairs premise and hypothesis steps, so both are padded alike
+            feed = batch(x, rng, pad2=model.interactive == "joint")
+            prob, loss, _ = sess.run((model.prob, model.loss, train_op), feed)
+
+    assert prob.shape == (2, 3)
+    np.testing.assert_allclose(prob.sum(-1), 1, rtol=1e-5)
+    assert np.isfinite(loss)
+
+def test_hag_checkpoint_names(tmp_path):
+    rng = np.random.RandomState(0)
+    embeddings = types.SimpleNamespace(embedding=rng.randn(20, 12))
+    path = str(tmp_path / "hag")
+    with tf.Graph().as_default() as graph:
+        Model.variant("hag", placeholders(), embeddings, hidden_dim=16)
+        saver = checkpoint_saver("hag")
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer(), init_feed_dict(graph))
+            saver.save(sess, path)
+            kernel = sess.run(graph.get_tensor_by_name("pre_atten/kernel:0"))
+
+    shapes = dict(tf.train.list_variables(path))
+    #the hag script scored attention with dense_2/dense_3 and classified with dense_4
+    assert shapes["dense_2/kernel"] == [3 * 16, 1]
+    assert shapes["dense_3/bias"] == [1]
+    assert shapes["dense_4/kernel"] == [128, 3]
+    assert not any(k.startswith(("pre_atten", "hyp_atten")) for k in shapes)
+    np.testing.assert_array_equal(tf.train.load_variable(path, "dense_2/kernel"), kernel)
+
+def test_unknown_component():
+    with tf.Graph().as_default():
+        with pytest.raises(ValueError):
+            Model(placeholders(), attention="additive")
+        with pytest.raises(ValueError):
+            Model(placeholders(), gru=None)
+        with pytest.raises(ValueError):
+            Model(placeholders(), gru="ugrnn")
@@ -0,0 +1,198 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+if not hasattr(tf, "placeholder"):
+    pytest.skip("the graph code needs the TensorFlow 1.x API", allow_module_level=True)
+
+from nn import (mask, per_token, highway_network, normalize, attention, trilinear_attention, interaction_pool, multihead_attention,
+                concat_sequences, split_sequences, gru_encoder, gru_pair)
+
+
+def evaluate(*tensors):
+    with tf.Session() as sess:
+        return sess.run(tensors)
+
+
+def softmax(x):
+    e = np.exp(x - x.max(-1, keepdims=True))
+    return e / e.sum(-1, keepdims=True)
+
+
+def test_trilinear_attention_equals_tiled():
+    rng = np.random.RandomState(0)
+    q = rng.randn(2, 5, 4).astype(np.float32)
+    k = rng.randn(2, 3, 4).astype(np.float32)
+    q_mask = np.array([[1, 1, 1, 1, 1], [1, 1, 0, 0, 0]], dtype=np.float32)
+    k_mask = np.array([[1, 1, 1], [1, 1, 0]], dtype=np.float32)
+
+    tf.reset_default_graph()
+    with tf.variable_scope("tiled"):
+        tiled = attention(tf.constant(q), tf.constant(k))
+    fast = trilinear_attention(tf.constant(q), tf.constant(k))
+    masked = trilinear_attention(tf.constant(q), tf.constant(k), q_mask, k_mask, reuse=True)
+    #both score with one [3d, 1] kernel and bias; give them the same values
+    kernel, bias = tf.trainable_variables("tiled")
+    nonzero_bias = tf.assign(bias, [0.5])
+    copy = [tf.assign(v, u) for v, u in zip(tf.trainable_variables("trilinear_attention"), (kernel, bias))]
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run(nonzero_bias)
+        sess.run(copy)
+        tiled, fast, masked, w, b = sess.run((tiled, fast, masked, kernel, bias))
+
+    np.testing.assert_allclose(fast, tiled, rtol=1e-5, atol=1e-5)
+
+    #reference with masks: padded keys get no weight, padded queries are 0
+    e = np.einsum("bqd,dx->bqx", q, w[:4]) + np.einsum("bkd,dx->bxk", k, w[4:8]) \
+        + np.einsum("bqd,bkd->bqk", q * w[8:, 0], k) + b
+    e += (1 - k_mask[:, None, :]) * -1e9
+    expect = np.einsum("bqk,bkd->bqd", softmax(e), k) * q_mask[..., None]
+    np.testing.assert_allclose(masked, expect, rtol=1e-5, atol=1e-5)
+
+
+def test_interaction_pool_equals_tiled():
+    rng = np.random.RandomState(0)
+    p = rng.randn(2, 5, 4).astype(np.float32)
+    h = rng.randn(2, 3, 4).astype(np.float32)
+
+    tf.reset_default_graph()
+    got = evaluate(*interaction_pool(tf.constant(p), tf.constant(h)))
+
+    i = p[:, :, None] * h[:, None] #[B, PL, HL, d]
+    expect = (i.sum(1), i.sum(2), i.mean(1), i.mean(2), i.max(1), i.max(2))
+    for g, e in zip(got, expect):
+        np.testing.assert_allclose(g, e, rtol=1e-5, atol=1e-6)
+
+
+def test_multihead_attention_ignores_padding():
+    rng = np.random.RandomState(0)
+    x = rng.randn(2, 5, 8).astype(np.float32)
+    x_mask = np.array([[1, 1, 1, 1, 1], [1, 1, 1, 0, 0]], dtype=np.float32)
+    x[1, 3:] = 100. #padding content must not matter
+
+    tf.reset_default_graph()
+    xp = tf.placeholder(tf.float32, (None, None, 8))
+    mp = tf.placeholder(tf.float32, (None, None))
+    padded = multihead_attention(xp, xp, xp, dk=4, h=2, ff=16, q_mask=mp, k_mask=mp)
+    trimmed = multihead_attention(xp, xp, xp, dk=4, h=2, ff=16, reuse=True)
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        padded = sess.run(padded, {xp: x, mp: x_mask})
+        trimmed = sess.run(trimmed, {xp: x[1:, :3]})
+
+    np.testing.assert_allclose(padded[1, :3], trimmed[0], rtol=1e-4, atol=1e-5)
+    np.testing.assert_array_equal(padded[1, 3:], 0)
+
+
+@pytest.mark.parametrize("cross", [False, True])
+def test_fused_qkv_is_interchangeable(cross):
+    rng = np.random.RandomState(0)
+    q = rng.randn(2, 5, 8).astype(np.float32)
+    k = rng.randn(2, 3, 8).astype(np.float32) if cross else q
+
+    outputs = []
+    values = None
+    for fused in (False, True):
+        with tf.Graph().as_default():
+            qp = tf.placeholder(tf.float32, (None, None, 8))
+            kp = tf.placeholder(tf.float32, (None, None, 8)) if cross else qp
+            y = multihead_attention(qp, kp, kp, dk=4, h=2, ff=16, fused=fused)
+            with tf.Session() as sess:
+                sess.run(tf.global_variables_initializer())
+                variables = {v.op.name: v for v in tf.global_variables()}
+                if values is None:
+                    values = sess.run(variables)
+                else:
+                    #same variable names, so one's values load into the other
+                    assert set(variables) == set(values)
+                    for name, v in variables.items():
+                        v.load(values[name], sess)
+                outputs.append(sess.run(y, {qp: q, kp: k}))
+
+    np.testing.assert_allclose(outputs[0], outputs[1], rtol=1e-5, atol=1e-5)
+
+
+def test_per_token_equals_masked():
+    rng = np.random.RandomState(0)
+    x = rng.randn(3, 5, 6).astype(np.float32)
+    x_mask = np.array([[1, 1, 1, 1, 1], [1, 1, 0, 0, 0], [0, 0, 0, 0, 0]], dtype=np.float32)
+    w = rng.randn(3, 5, 4).astype(np.float32)
+
+    def layers(x):
+        x = highway_network(x, 2, [tf.nn.sigmoid] * 2, "premise")
+        return normalize(tf.layers.dense(x, 4))
+
+    results = []
+    values = None
+    for skip in (False, True):
+        with tf.Graph().as_default():
+            xp = tf.placeholder(tf.float32, (None, None, 6))
+            mp = tf.placeholder(tf.float32, (None, None))
+            y = per_token(layers, xp, mp) if skip else mask(layers(xp), mp)
+            #normalize makes sum(y ** 2) almost flat, so weigh the outputs to get a real gradient
+            grad, = tf.gradients(tf.reduce_sum(y * w), xp)
+            with tf.Session() as sess:
+                sess.run(tf.global_variables_initializer())
+                variables = {v.op.name: v for v in tf.global_variables()}
+                if values is None:
+                    values = sess.run(variables)
+                else:
+                    #same variable names, so checkpoints don't care which one built the graph
+                    assert set(variables) == set(values)
+                    for name, v in variables.items():
+                        v.load(values[name], sess)
+                results.append(sess.run((y, grad), {xp: x, mp: x_mask}))
+
+    for masked, skipped in zip(*results):
+        np.testing.assert_allclose(skipped, masked, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize("la, lb", [(4, 3), (0, 3), (4, 0), (0, 0)])
+def test_concat_split_sequences(la, lb):
+    rng = np.random.RandomState(0)
+    a = rng.randn(3, la, 2).astype(np.float32)
+    b = rng.randn(3, lb, 2).astype(np.float32)
+    a_len = np.array([la, la // 2, 0])
+    b_len = np.array([lb, 0, lb // 2])
+
+    tf.reset_default_graph()
+    ab = concat_sequences(tf.constant(a), a_len, tf.constant(b), b_len)
+    sa, sb = split_sequences(ab, a_len, la, lb)
+    ab, sa, sb = evaluate(ab, sa, sb)
+
+    assert ab.shape == (3, la + lb, 2)
+    for i in range(3):
+        expect = np.zeros((la + lb, 2), dtype=np.float32)
+        expect[:a_len[i] + b_len[i]] = np.concatenate((a[i, :a_len[i]], b[i, :b_len[i]]))
+        np.testing.assert_array_equal(ab[i], expect)
+        np.testing.assert_array_equal(sa[i, :a_len[i]], a[i, :a_len[i]])
+        np.testing.assert_array_equal(sa[i, a_len[i]:], 0)
+        np.testing.assert_array_equal(sb[i, :b_len[i]], b[i, :b_len[i]])
+        np.testing.assert_array_equal(sb[i, b_len[i]:], 0)
+
+
+@pytest.mark.parametrize("chained", [True, False])
+def test_gru_pair_equals_two_encoders(chained):
+    rng = np.random.RandomState(0)
+    p = rng.randn(3, 5, 4).astype(np.float32)
+    h = rng.randn(3, 4, 4).astype(np.float32)
+    p_len = np.array([5, 2, 0])
+    h_len = np.array([4, 0, 3])
+
+    tf.reset_default_graph()
+    pp = tf.placeholder(tf.float32, (None, None, 4))
+    hp = tf.placeholder(tf.float32, (None, None, 4))
+    got = gru_pair(pp, p_len, hp, h_len, units=6, chained=chained, fused=False)
+    #the same weights, one dynamic_rnn per sentence
+    p_out, p_state = gru_encoder(pp, p_len, units=6, fused=False, reuse=True)
+    h_out, h_state = gru_encoder(hp, h_len, units=6, initial_state=p_state if chained else None,
+                                 fused=False, reuse=True)
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        feed = {pp: p, hp: h}
+        got, expect = sess.run(([x for x in got if x is not None],
+                                [p_out, h_out, h_state] if chained else [p_out, h_out, p_state, h_state]), feed)
+
+    for g, e in zip(got, expect):
+        np.testing.assert_allclose(g, e, rtol=1e-5, atol=1e-6)
@@ -0,0 +1,129 @@
+import json
+import threading
+
+import pytest
+
+pytest.importorskip("tensorflow")
+pytest.importorskip("nltk")
+
+import para_pre
+from para_pre import bounded, chunked, done_pairs, generate, publish
+
+
+def write_lines(path, lines):
+    with open(path, "wb") as f:
+        f.write(b"".join(lines))
+
+def line(pairID, content=None):
+    return f"{pairID} {json.dumps(content or {'n': 1})}\n".encode("utf-8")
+
+
+def test_done_pairs(tmp_path):
+    path = str(tmp_path / "shared.json")
+    assert done_pairs(path) == set()
+    write_lines(path, [line("a"), line("b")])
+    assert done_pairs(path) == {"a", "b"}
+
+def test_done_pairs_truncates_torn_last_line(tmp_path):
+    path = str(tmp_path / "shared.json")
+    write_lines(path, [line("a"), line("b"), line("c")[:-5]])
+    assert done_pairs(path) == {"a", "b"}
+    with open(path, "rb") as f:
+        assert f.read() == line("a") + line("b")
+
+    #a last line that is whole but not json is torn too
+    write_lines(path, [line("a"), b"b {\"n\": \n"])
+    assert done_pairs(path) == {"a"}
+
+def test_done_pairs_rejects_malformed_middle_line(tmp_path):
+    path = str(tmp_path / "shared.json")
+    lines = [line("a"), b"b {\"n\": \n", line("c")]
+    write_lines(path, lines)
+    with pytest.raises(ValueError, match=":2"):
+        done_pairs(path)
+    #the damaged file is left for a human
+    with open(path, "rb") as f:
+        assert f.read() == b"".join(lines)
+
+def test_publish(tmp_path):
+    sf = str(tmp_path / "shared.json")
+    partial = f"{sf}.partial"
+    write_lines(partial, [line("a")])
+    publish(sf, partial)
+    assert done_pairs(sf) == {"a"}
+
+    write_lines(partial, [line("b"), line("c")])
+    publish(sf, partial)
+    with open(sf, "rb") as f:
+        assert f.read() == line("a") + line("b") + line("c")
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["shared.json"]
+
+def test_chunked():
+    assert list(chunked(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(chunked(range(6), 3)) == [[0, 1, 2], [3, 4, 5]]
+    assert list(chunked([], 3)) == []
+
+def test_bounded():
+    sem = threading.Semaphore(2)
+    stop = threading.Event()
+    fed = []
+    feeder = threading.Thread(target=lambda: fed.extend(bounded(range(5), sem, stop)), daemon=True)
+    feeder.start()
+    feeder.join(0.2)
+    #two items, then it waits for a result to be consumed
+    assert feeder.is_alive()
+    sem.release()
+    feeder.join(0.2)
+    assert feeder.is_alive()
+
+    stop.set()
+    sem.release()
+    feeder.join(5)
+    assert not feeder.is_alive()
+    assert fed == [0, 1, 2]
+
+
+def nli_file(path, n):
+    with open(path, "w") as f:
+        for i in range(n):
+            f.write(json.dumps({"pairID": f"p{i}", "gold_label": "neutral",
+                                "sentence1_binary_parse": "a", "sentence2_binary_parse": "b"}) + "\n")
+
+def count_worker(dataset):
+    return {e["pairID"]: {"n": 1} for e in dataset}
+
+def failing_worker(dataset):
+    raise RuntimeError("worker failed")
+
+def test_generate_adds_missing_pairs(tmp_path, monkeypatch):
+    monkeypatch.setattr(para_pre, "worker", count_worker)
+    sf, df = str(tmp_path / "shared.json"), str(tmp_path / "data.jsonl")
+    nli_file(df, 5)
+    write_lines(sf, [line("p1", {"n": 0})])
+
+    generate(sf, df, chunk_size=2, num_workers=1)
+    assert done_pairs(sf) == {f"p{i}" for i in range(5)}
+    with open(sf) as f:
+        lines = f.read().splitlines()
+    #p1 was done already and is not computed again
+    assert lines[0] == 'p1 {"n": 0}'
+    assert len(lines) == 5
+
+def test_generate_worker_error(tmp_path, monkeypatch):
+    monkeypatch.setattr(para_pre, "worker", failing_worker)
+    sf, df = str(tmp_path / "shared.json"), str(tmp_path / "data.jsonl")
+    nli_file(df, 50)
+
+    errors = []
+    def run():
+        try:
+            generate(sf, df, chunk_size=1, num_workers=1)
+        except RuntimeError as e:
+            errors.append(e)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    #with the feeder blocked on its permits, closing the pool used to hang
+    thread.join(60)
+    assert not thread.is_alive()
+    assert len(errors) == 1
+    assert done_pairs(sf) == set()
@@ -0,0 +1,65 @@
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from tensorflow.core.framework.step_stats_pb2 import StepStats
+
+from profiler import StepProfiler, scope_of, op_devices
+
+
+@pytest.mark.parametrize("name,expected", [
+    ("pre_atten/dense/MatMul", ("attention", False)),
+    ("gradients/pre_atten/dense/MatMul_grad/MatMul", ("attention", True)),
+    ("gradients_1/rnn/while/gru_cell/MatMul", ("rnn", True)),
+    ("p2h_multihead_attention/dense_1/Softmax", ("attention", False)),
+    ("IteratorGetNext", ("input", False)),
+    ("premise_highway1/transform_gate", ("highway", False)),
+    #first match wins: capsule comes before rnn in SCOPES
+    ("capsule_1/rnn/while/MatMul", ("capsule", False)),
+    #"gradients" only means backward as the first part
+    ("dense_3/gradients/MatMul", ("other", False)),
+    ("dense_3/MatMul", ("other", False)),
+    ("gradients/dense_3/MatMul_grad/MatMul", ("other", True)),
+])
+def test_scope_of(name, expected):
+    assert scope_of(name) == expected
+
+
+def step_stats(devices, micros=10):
+    stats = StepStats()
+    for i, d in enumerate(devices):
+        dev = stats.dev_stats.add(device=d)
+        dev.node_stats.add(node_name=f"pre_atten/op{i}", all_end_rel_micros=micros)
+    return stats
+
+GPU = "/job:localhost/replica:0/task:0/device:GPU:0"
+CPU = "/job:localhost/replica:0/task:0/device:CPU:0"
+
+def test_op_devices_streams():
+    devices = [CPU, GPU, f"{GPU}/stream:all", f"{GPU}/stream:7", f"{GPU}/memcpy"]
+    kept = [d.device for d in op_devices(step_stats(devices))]
+    #with stream:all, the GPU launch side and the single streams would count kernels twice
+    assert kept == [CPU, f"{GPU}/stream:all"]
+
+def test_op_devices_without_streams():
+    kept = [d.device for d in op_devices(step_stats([CPU, GPU]))]
+    assert kept == [CPU, GPU]
+
+
+def test_summary(tmp_path):
+    profiler = StepProfiler(None, str(tmp_path), max_traces=0)
+    #nothing traced yet: zeros, not a ZeroDivisionError
+    s = profiler.summary()
+    assert s["traced_steps"] == 0
+    assert all(r["forward_ms"] == 0 and r["share"] == 0 for r in s["scopes"])
+    assert profiler.report() is None
+
+    profiler.add(step_stats([CPU, GPU, f"{GPU}/stream:all"], micros=1000))
+    profiler.add(step_stats([CPU], micros=1000))
+    s = profiler.summary()
+    assert s["traced_steps"] == 2
+    top = s["scopes"][0]
+    assert top["scope"] == "attention"
+    #3 counted ops of 1ms over 2 steps
+    assert top["forward_ms"] == pytest.approx(1.5)
+    assert top["share"] == pytest.approx(1.)
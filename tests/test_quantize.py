@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+if not hasattr(tf, "placeholder"):
+    pytest.skip("the graph code needs the TensorFlow 1.x API", allow_module_level=True)
+
+from quantize import quantize_int8, quantize_graph, quantize_export
+from conftest import TINY, TINY_VARIANT, tiny_pair
+
+
+@pytest.mark.parametrize("axis", [0, 1])
+def test_quantize_int8(axis):
+    w = np.random.RandomState(0).randn(30, 20).astype(np.float32)
+    w[3] = 0
+    w[:, 4] = 0
+    q, scale = quantize_int8(w, axis)
+
+    assert q.dtype == np.int8 and scale.dtype == np.float32
+    assert scale.shape == (1, 20) if axis == 0 else scale.shape == (30, 1)
+    assert np.abs(q).max() == 127
+    assert np.all(np.abs(q * scale - w) <= scale / 2 + 1e-6)
+    #all-zero slices get scale 1 rather than a division by 0
+    zero = w[:, 4] if axis == 0 else w[3]
+    assert np.all(zero == 0) and np.all((q[:, 4] if axis == 0 else q[3]) == 0)
+
+
+def test_quantize_graph():
+    rng = np.random.RandomState(0)
+    table = rng.randn(100, 64).astype(np.float32)
+    weight = rng.randn(64, 128).astype(np.float32)
+    ids = np.array([0, 5, 99, 5])
+
+    graph = tf.Graph()
+    with graph.as_default():
+        x = tf.placeholder(tf.int64, (None,), name="ids")
+        #embedding_lookup colocates its ops with the table, which quantize_graph drops
+        y = tf.matmul(tf.nn.embedding_lookup(tf.constant(table), x), tf.constant(weight))
+        tf.identity(y, name="y")
+    graph_def, summary = quantize_graph(graph.as_graph_def(), weights="int8")
+
+    assert sorted(kind for kind, _, _ in summary.values()) == ["embedding int8", "weight int8"]
+    assert all(new < old for _, old, new in summary.values())
+    consts = [n for n in graph_def.node if n.op == "Const"]
+    assert sum(n.attr["dtype"].type == tf.int8.as_datatype_enum for n in consts) == 2
+    #the float table and weight are gone; only the small scales stay float
+    assert all(n.attr["value"].tensor.tensor_shape.dim[0].size * n.attr["value"].tensor.tensor_shape.dim[1].size < 4096
+               for n in consts if n.attr["dtype"].type == tf.float32.as_datatype_enum)
+
+    quantized = tf.Graph()
+    with quantized.as_default():
+        tf.import_graph_def(graph_def, name="")
+    with tf.Session(graph=quantized) as sess:
+        got = sess.run("y:0", {"ids:0": ids})
+    expect = table[ids] @ weight
+    assert np.max(np.abs(got - expect)) < 0.02 * np.max(np.abs(expect))
+
+
+def test_quantize_export(tiny_checkpoint, tmp_path, monkeypatch):
+    pytest.importorskip("tensorflow.tools.graph_transforms")
+    from export import FrozenPredictor, export_frozen
+    from inference import Predictor
+
+    checkpoint, word2idx = tiny_checkpoint
+    pairs = [tiny_pair("a man sleeps", "a man is not sleeping ."),
+             tiny_pair("the dog runs", "a dog runs")]
+    float_dir, quant_dir = str(tmp_path / "float"), str(tmp_path / "int8")
+    predictor = Predictor(checkpoint, TINY_VARIANT, word2idx, **TINY)
+    try:
+        export_frozen(predictor, float_dir)
+    finally:
+        predictor.close()
+    summary = quantize_export(float_dir, quant_dir, min_elements=64)
+    assert {kind for kind, _, _ in summary.values()} == {"table int8", "weight int8"}
+
+    folds = []
+    session = FrozenPredictor.session
+    monkeypatch.setattr(FrozenPredictor, "session",
+                        lambda self, threads=0, fold_constants=True: folds.append(fold_constants) or session(self, threads, fold_constants))
+    ref, quant = FrozenPredictor(float_dir), FrozenPredictor(quant_dir)
+    try:
+        np.testing.assert_allclose(quant.predict(pairs), ref.predict(pairs), atol=0.05)
+    finally:
+        ref.close()
+        quant.close()
+    #folding the quantized graph would turn its weights back into float32 constants
+    assert folds == [True, False]
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("nltk")
+from nltk.corpus import wordnet as wn
+try:
+    wn.synsets("dog")
+except LookupError:
+    pytest.skip("needs the nltk wordnet data", allow_module_level=True)
+
+from relations import RelationIndex, reduce_flags, stemmer
+
+
+PAIRS = [("A big dog is n't small".split(), "The large hound is not little".split()),
+         ("Dogs bark".split(), "a dog barks".split()),
+         ("small dogs".split(), "Big dogs".split()),
+         ("a zebra".split(), "an okapi".split())]
+
+
+def pairwise(index, s1, s2):
+    def matrix(predicate):
+        return np.array([[predicate(a, b) for b in s2] for a in s1], dtype=bool)
+    return reduce_flags(matrix(index.is_exact_match), matrix(index.is_antonyms), matrix(index.is_synonyms))
+
+def assert_flags_equal(got, expect):
+    assert len(got) == len(expect) == 6
+    for g, e in zip(got, expect):
+        np.testing.assert_array_equal(g, e)
+
+
+@pytest.mark.parametrize("indexed", [0, 2, len(PAIRS)])
+def test_match_batch_equals_pairwise(indexed):
+    #the first `indexed` pairs' tokens are in the index, the rest go unindexed
+    index = RelationIndex().build({t for s1, s2 in PAIRS[:indexed] for t in s1 + s2})
+    for got, (s1, s2) in zip(index.match_batch(PAIRS), PAIRS):
+        assert_flags_equal(got, pairwise(index, s1, s2))
+
+def test_match_batch_keeps_index():
+    index = RelationIndex().build(PAIRS[0][0] + PAIRS[0][1])
+    size = len(index)
+    tables = index.tables()
+    index.match_batch(PAIRS)
+    assert len(index) == size
+    assert index.tables() is tables
+
+
+#the predicates as para_pre.py had them before relations.py, so the index is
+#checked against the original behaviour rather than against itself
+def original_is_exact_match(token1, token2):
+    token1 = token1.lower()
+    token2 = token2.lower()
+    token1_stem = stemmer.stem(token1)
+    if token1 == token2:
+        return True
+    for synsets in wn.synsets(token2):
+        for lemma in synsets.lemma_names():
+            if token1_stem == stemmer.stem(lemma):
+                return True
+    if token1 == "n't" and token2 == "not":
+        return True
+    elif token1 == "not" and token2 == "n't":
+        return True
+    elif token1_stem == stemmer.stem(token2):
+        return True
+    return False
+
+def original_is_antonyms(token1, token2):
+    token1 = token1.lower()
+    token2 = token2.lower()
+    token1_stem = stemmer.stem(token1)
+    antonyms = set()
+    for synsets in wn.synsets(token2):
+        for lemma_synsets in [wn.synsets(l) for l in synsets.lemma_names()]:
+            for lemma_syn in lemma_synsets:
+                for lemma in lemma_syn.lemmas():
+                    for antonym in lemma.antonyms():
+                        antonyms.add(antonym.name())
+    return any(token1_stem == stemmer.stem(a) for a in antonyms)
+
+def original_is_synonyms(token1, token2):
+    token1 = token1.lower()
+    token2 = token2.lower()
+    token1_stem = stemmer.stem(token1)
+    synonyms = set()
+    for synsets in wn.synsets(token2):
+        for lemma_synsets in [wn.synsets(l) for l in synsets.lemma_names()]:
+            for lemma_syn in lemma_synsets:
+                for lemma in lemma_syn.lemmas():
+                    synonyms.add(lemma.name())
+    return any(token1_stem == stemmer.stem(s) for s in synonyms)
+
+VOCAB = ["big", "Large", "small", "little", "dog", "Dogs", "hound", "bark", "barks",
+         "good", "bad", "hot", "cold", "n't", "not", "is", "a", "zebra", "okapi", "run", "running"]
+
+@pytest.mark.parametrize("built", [False, True])
+def test_predicates_equal_original(built):
+    #with and without the tokens in the index beforehand
+    index = RelationIndex().build(VOCAB) if built else RelationIndex()
+    for a in VOCAB:
+        for b in VOCAB:
+            assert index.is_exact_match(a, b) == original_is_exact_match(a, b), (a, b)
+            assert index.is_antonyms(a, b) == original_is_antonyms(a, b), (a, b)
+            assert index.is_synonyms(a, b) == original_is_synonyms(a, b), (a, b)
@@ -0,0 +1,142 @@
+import json
+import queue
+import threading
+import http.client
+from time import time, sleep
+from concurrent.futures import TimeoutError
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+pytest.importorskip("tensorflow")
+pytest.importorskip("nltk")
+
+from server import MicroBatcher, Handler, read_pairs
+
+
+class StubPredictor:
+    """scores pair p as [p, 0, 0]; raises on "bad" pairs and waits for `gate`"""
+    def __init__(self):
+        self.calls = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def predict(self, pairs):
+        self.gate.wait()
+        self.calls.append(list(pairs))
+        if "bad" in pairs:
+            raise ValueError("bad pair")
+        return np.array([[p, 0, 0] for p in pairs], dtype=np.float32)
+
+    def scored(self):
+        return [p for c in self.calls for p in c]
+
+
+def blocked(batcher):
+    """the worker stuck scoring pair -1 until the gate opens; needs max_batch=1"""
+    batcher.predictor.gate.clear()
+    future = batcher.submit(-1)
+    while not future.running():
+        sleep(0.001)
+    return future
+
+def drain(batcher):
+    batcher.predictor.gate.set()
+    while batcher.queue.qsize():
+        sleep(0.001)
+    assert batcher.predict([-2], timeout=5)[0][0] == -2
+
+
+def test_deadline_from_first_pair():
+    batcher = MicroBatcher(StubPredictor(), max_batch=64, max_wait=0.4)
+    st = time()
+    first = batcher.submit(1)
+    sleep(0.2)
+    second = batcher.submit(2)
+    assert second.result(5)[0] == 2
+    elapsed = time() - st
+    assert first.result(0)[0] == 1
+    #waiting from the second pair would take 0.6s
+    assert 0.35 <= elapsed < 0.55
+    assert batcher.predictor.calls == [[1, 2]]
+
+def test_full_batch_closes_early():
+    batcher = MicroBatcher(StubPredictor(), max_batch=3, max_wait=10)
+    futures = [batcher.submit(i) for i in range(3)]
+    assert [f.result(5)[0] for f in futures] == [0, 1, 2]
+    assert batcher.predictor.calls == [[0, 1, 2]]
+
+def test_queue_full_cancels_request():
+    batcher = MicroBatcher(StubPredictor(), max_batch=1, max_queue=2)
+    blocked(batcher)
+    with pytest.raises(queue.Full):
+        batcher.predict([1, 2, 3])
+    drain(batcher)
+    assert batcher.predictor.scored() == [-1, -2]
+
+def test_timeout_cancels_request():
+    batcher = MicroBatcher(StubPredictor(), max_batch=1)
+    blocked(batcher)
+    with pytest.raises(TimeoutError):
+        batcher.predict([1, 2], timeout=0.05)
+    drain(batcher)
+    assert batcher.predictor.scored() == [-1, -2]
+
+def test_bad_pair_fallback():
+    batcher = MicroBatcher(StubPredictor(), max_batch=3, max_wait=10)
+    futures = [batcher.submit(p) for p in (1, "bad", 2)]
+    assert futures[0].result(5)[0] == 1
+    assert futures[2].result(5)[0] == 2
+    with pytest.raises(ValueError):
+        futures[1].result(5)
+    #the batch, then each of its pairs alone
+    assert batcher.predictor.calls == [[1, "bad", 2], [1], ["bad"], [2]]
+    stats = batcher.stats()
+    assert stats["errors"] == 1
+    assert stats["requests"] == 3
+
+
+def test_read_pairs():
+    raw = {"premise": "a man sleeps", "hypothesis": "a man is awake"}
+    assert read_pairs(json.dumps(raw)) == [("a man sleeps", "a man is awake")]
+    mnli = {k: "(a b)" for k in ("sentence1_binary_parse", "sentence2_binary_parse",
+                                 "sentence1_parse", "sentence2_parse")}
+    assert read_pairs(json.dumps({"pairs": [mnli, raw]})) == [mnli, ("a man sleeps", "a man is awake")]
+
+@pytest.mark.parametrize("body", ['[]', '{"pairs": []}', '{"pairs": [1]}',
+                                  '{"premise": "a man"}', '{"premise": " ", "hypothesis": "a man"}'])
+def test_read_pairs_rejects(body):
+    with pytest.raises(ValueError):
+        read_pairs(body)
+
+
+@pytest.fixture
+def url():
+    predictor = StubPredictor()
+    predictor.predict = lambda pairs: StubPredictor.predict(predictor, [len(p[0]) for p in pairs])
+    handler = type("BoundHandler", (Handler,), {"batcher": MicroBatcher(predictor)})
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd.server_address
+    httpd.shutdown()
+    httpd.server_close()
+
+def request(address, method, path, body=None):
+    conn = http.client.HTTPConnection(*address, timeout=5)
+    conn.request(method, path, body=json.dumps(body) if body is not None else None)
+    r = conn.getresponse()
+    return r.status, json.loads(r.read())
+
+def test_handler(url):
+    status, out = request(url, "POST", "/predict", {"premise": "a man", "hypothesis": "a dog"})
+    assert status == 200
+    assert out["labels"] == ["neutral"]
+    assert out["probabilities"][0]["neutral"] == 5
+
+    assert request(url, "POST", "/predict", {"premise": "a man"})[0] == 400
+    assert request(url, "POST", "/score", {})[0] == 404
+    assert request(url, "GET", "/health") == (200, {"ok": True})
+    status, stats = request(url, "GET", "/metrics")
+    assert status == 200
+    assert stats["requests"] == 1
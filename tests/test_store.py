@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from store import Store, KeyedStore, KeyedShards, write_store, write_keyed_store, next_shard
+
+
+COLUMNS = [("tokens", np.int64, (), True),
+           ("chars", np.int16, (3,), True),
+           ("label", np.uint8, (), False)]
+
+ROWS = [([1, 2, 3], [[1, 2, 3], [4, 5, 6], [7, 8, 9]], 0),
+        ([], np.zeros((0, 3)), 1),
+        ([4], [[1, 0, 0]], 2)]
+
+
+def assert_rows_equal(got, expect):
+    assert len(got) == len(expect)
+    for g, e in zip(got, expect):
+        np.testing.assert_array_equal(g, np.asarray(e).reshape(np.shape(g)))
+
+
+def test_store_round_trip(tmp_path):
+    info = write_store(str(tmp_path), COLUMNS, ROWS, meta={"char_pad": 3})
+    store = Store(str(tmp_path))
+
+    assert info["size"] == len(store) == len(ROWS)
+    assert store.meta == {"char_pad": 3}
+    for i, row in enumerate(store):
+        assert_rows_equal(row, ROWS[i])
+    assert store.column("chars")[0].shape == (3, 3)
+    assert store.column("tokens")[1].shape == (0,)
+
+
+def test_empty_store(tmp_path):
+    write_store(str(tmp_path), COLUMNS, [])
+    store = Store(str(tmp_path))
+    assert len(store) == 0
+    assert list(store) == []
+
+
+def test_keyed_store(tmp_path):
+    items = [("b", ([1], [[1, 1, 1]], 0)),
+             ("a", ([2, 3], [[2, 2, 2], [3, 3, 3]], 1)),
+             ("b", ([4], [[4, 4, 4]], 2))]
+    write_keyed_store(str(tmp_path), COLUMNS, items)
+    store = KeyedStore(str(tmp_path))
+
+    #a repeated key keeps its last row, as a dict would
+    expect = dict(items)
+    assert len(store) == len(expect)
+    assert sorted(store) == sorted(store.keys()) == sorted(expect)
+    assert "a" in store and "c" not in store
+    assert store.get("c") is None
+    with pytest.raises(KeyError):
+        store["c"]
+    for k, row in store.items():
+        assert_rows_equal([row[n] for n in store.names], expect[k])
+        assert_rows_equal([store[k][n] for n in store.names], expect[k])
+
+
+def test_keyed_shards(tmp_path):
+    path = str(tmp_path)
+    write_keyed_store(next_shard(path), COLUMNS, [("a", ROWS[0])])
+    write_keyed_store(next_shard(path), COLUMNS, [("b", ROWS[1]), ("c", ROWS[2])])
+    shards = KeyedShards(path)
+
+    assert len(shards) == 3
+    assert list(shards) == ["a", "b", "c"]
+    for k, row in shards.items():
+        assert_rows_equal([row[n] for n in shards.shards[0].names], ROWS["abc".index(k)])
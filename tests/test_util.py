@@ -0,0 +1,24 @@
+from util import LRU
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRU(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.get("b", "missing") == "missing"
+    assert (cache.hits, cache.misses) == (3, 1)
+
+def test_lru_capacity_by_size():
+    cache = LRU(10, size=len)
+    cache.put("a", "xxxx")
+    cache.put("b", "xxxx")
+    cache.put("a", "xxxxxx") #replacing a value frees its old size
+    assert len(cache) == 2 and cache.total == 10
+    cache.put("c", "x")
+    assert "b" not in cache and cache.total == 7
+    cache.put("d", "x" * 11) #larger than the whole cache: not kept
+    assert "d" not in cache and cache.total == 7
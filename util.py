@@ -1,4 +1,6 @@
 import time
+import threading
+from collections import OrderedDict
 
 
 def timef():
@@ -7,3 +9,44 @@ def timef():
 def tprint(msg):
     print(timef(), end=": ")
     print(msg)
+
+
+class LRU:
+    """least recently used cache holding values up to a total `capacity`,
+    measured by `size(value)` (1 per entry by default)"""
+    def __init__(self, capacity, size=lambda v: 1):
+        self.capacity = capacity
+        self.size = size
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.data:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.data.move_to_end(key)
+            return self.data[key][0]
+
+    def put(self, key, value):
+        s = self.size(value)
+        with self.lock:
+            if key in self.data:
+                self.total -= self.data.pop(key)[1]
+            if s > self.capacity:
+                return
+            self.data[key] = (value, s)
+            self.total += s
+            while self.total > self.capacity:
+                _, (_, old) = self.data.popitem(last=False)
+                self.total -= old